@@ -101,6 +101,24 @@ def is_true(obj):
     return obj is not False
 
 
+def eqv_key(obj):
+    """Get dictionary key, objects with equal keys are eqv?.
+
+    Used by case dispatch tables.
+    """
+    if type(obj) is types.Symbol:
+        return obj
+    if isinstance(obj, (bool, numbers.Number)):
+        return type(obj), obj
+    if isinstance(obj, types.Char):
+        return types.Char, obj.char
+    try:
+        hash(obj)
+    except TypeError:
+        return object, id(obj)
+    return object, obj
+
+
 @builtin("+")
 def plus(*objs):
     return sum(objs)
@@ -202,7 +220,7 @@ def cdr(pair):
 
 @builtin("list")
 def list_(*args):
-    return scheme_list(args)
+    return types.pair_list(args)
 
 
 builtin("eq?")(operator.is_)
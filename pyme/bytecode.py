@@ -1,6 +1,8 @@
 import math
 from enum import IntEnum, auto
 
+from pyme import types
+
 
 class OpCode(IntEnum):
     """Operation code."""
@@ -24,6 +26,51 @@ class OpCode(IntEnum):
     PUSH_FALSE = auto()
     MAKE_CLOSURE = auto()
     APPLY = auto()
+    READ_LOCAL_1 = auto()
+    READ_LOCAL_3 = auto()
+    SET_LOCAL_1 = auto()
+    SET_LOCAL_3 = auto()
+    CONST_RET_1 = auto()
+    READ_VAR_CALL_1 = auto()
+    READ_VAR_TAIL_CALL_1 = auto()
+    READ_LOCAL_CALL_1 = auto()
+    READ_LOCAL_TAIL_CALL_1 = auto()
+    CALL_BRANCH_1 = auto()
+    ADD2_1 = auto()
+    SUB2_1 = auto()
+    LT2_1 = auto()
+    NUM_EQ2_1 = auto()
+    CAR_1 = auto()
+    CDR_1 = auto()
+    CONS_1 = auto()
+    NULLP_1 = auto()
+    PAIRP_1 = auto()
+    EQ_1 = auto()
+    SELF_TAIL_CALL_1 = auto()
+    CASE_1 = auto()
+    CASE_3 = auto()
+    READ_BOXED_1 = auto()
+    READ_BOXED_3 = auto()
+    SET_BOXED_1 = auto()
+    SET_BOXED_3 = auto()
+    BOX_LOCAL_1 = auto()
+    BOX_LOCAL_3 = auto()
+    READ_STACK_1 = auto()
+    READ_STACK_3 = auto()
+    SET_STACK_1 = auto()
+    SET_STACK_3 = auto()
+    READ_FREE_1 = auto()
+    READ_FREE_3 = auto()
+    READ_FREE_BOXED_1 = auto()
+    READ_FREE_BOXED_3 = auto()
+    SET_FREE_BOXED_1 = auto()
+    SET_FREE_BOXED_3 = auto()
+    READ_STACK_CALL_1 = auto()
+    READ_STACK_TAIL_CALL_1 = auto()
+    DIRECT_CALL_1 = auto()
+    DIRECT_TAIL_CALL_1 = auto()
+    CHECK_ASSIGNED_1 = auto()
+    CHECK_ASSIGNED_3 = auto()
 
 
 opcode_num_args = {
@@ -45,30 +92,248 @@ opcode_num_args = {
     OpCode.SET_VAR_3: 3,
     OpCode.PUSH_FALSE: 0,
     OpCode.MAKE_CLOSURE: 0,
+    OpCode.READ_LOCAL_1: 1,
+    OpCode.READ_LOCAL_3: 3,
+    OpCode.SET_LOCAL_1: 1,
+    OpCode.SET_LOCAL_3: 3,
+    OpCode.CALL_BRANCH_1: 1,
+    OpCode.ADD2_1: 1,
+    OpCode.SUB2_1: 1,
+    OpCode.LT2_1: 1,
+    OpCode.NUM_EQ2_1: 1,
+    OpCode.CAR_1: 1,
+    OpCode.CDR_1: 1,
+    OpCode.CONS_1: 1,
+    OpCode.NULLP_1: 1,
+    OpCode.PAIRP_1: 1,
+    OpCode.EQ_1: 1,
+    OpCode.SELF_TAIL_CALL_1: 1,
+    OpCode.CASE_1: 1,
+    OpCode.CASE_3: 3,
+    OpCode.READ_BOXED_1: 1,
+    OpCode.READ_BOXED_3: 3,
+    OpCode.SET_BOXED_1: 1,
+    OpCode.SET_BOXED_3: 3,
+    OpCode.BOX_LOCAL_1: 1,
+    OpCode.BOX_LOCAL_3: 3,
+    OpCode.READ_STACK_1: 1,
+    OpCode.READ_STACK_3: 3,
+    OpCode.SET_STACK_1: 1,
+    OpCode.SET_STACK_3: 3,
+    OpCode.READ_FREE_1: 1,
+    OpCode.READ_FREE_3: 3,
+    OpCode.READ_FREE_BOXED_1: 1,
+    OpCode.READ_FREE_BOXED_3: 3,
+    OpCode.SET_FREE_BOXED_1: 1,
+    OpCode.SET_FREE_BOXED_3: 3,
+    OpCode.CHECK_ASSIGNED_1: 1,
+    OpCode.CHECK_ASSIGNED_3: 3,
+}
+
+
+primitive_opcodes = frozenset([
+    OpCode.ADD2_1, OpCode.SUB2_1, OpCode.LT2_1, OpCode.NUM_EQ2_1,
+    OpCode.CAR_1, OpCode.CDR_1, OpCode.CONS_1,
+    OpCode.NULLP_1, OpCode.PAIRP_1, OpCode.EQ_1,
+])
+"""Opcodes for builtin calls, argument is variable bound to builtin."""
+
+
+fused_opcodes = {
+    OpCode.CONST_RET_1: (OpCode.CONST_1, OpCode.RET),
+    OpCode.READ_VAR_CALL_1: (OpCode.READ_VAR_1, OpCode.CALL_1),
+    OpCode.READ_VAR_TAIL_CALL_1: (OpCode.READ_VAR_1, OpCode.TAIL_CALL_1),
+    OpCode.READ_LOCAL_CALL_1: (OpCode.READ_LOCAL_1, OpCode.CALL_1),
+    OpCode.READ_LOCAL_TAIL_CALL_1: (OpCode.READ_LOCAL_1, OpCode.TAIL_CALL_1),
+    OpCode.READ_STACK_CALL_1: (OpCode.READ_STACK_1, OpCode.CALL_1),
+    OpCode.READ_STACK_TAIL_CALL_1: (OpCode.READ_STACK_1, OpCode.TAIL_CALL_1),
+}
+"""Superinstructions, each does the work of a sequence of opcodes.
+
+Arguments of superinstruction are arguments of opcodes in the sequence.
+"""
+
+
+direct_call_operands = {
+    OpCode.DIRECT_CALL_1: (OpCode.CONST_1, OpCode.CALL_1),
+    OpCode.DIRECT_TAIL_CALL_1: (OpCode.CONST_1, OpCode.TAIL_CALL_1),
+}
+"""Calls of procedure known at compile time.
+
+Operands are the constant lambda the procedure must be made from
+and the number of arguments, decoded like operands of the listed
+opcodes.
+"""
+
+
+compound_operands = {**fused_opcodes, **direct_call_operands}
+
+
+opcode_num_args.update({
+    compound: sum(opcode_num_args[opcode] for opcode in opcodes)
+    for compound, opcodes in compound_operands.items()
+})
+
+
+opcode_operands = {
+    opcode: tuple((component, opcode_num_args[component])
+                  for component in compound_operands.get(opcode, [opcode])
+                  if opcode_num_args[component] > 0)
+    for opcode in opcode_num_args
 }
+"""Operands of opcode as (component opcode, size in bytes) pairs."""
+
+
+opcode_by_value = {opcode.value: opcode for opcode in opcode_num_args}
+
+
+constant_opcodes = frozenset([
+    OpCode.CONST_1, OpCode.CONST_3,
+    OpCode.CASE_1, OpCode.CASE_3,
+])
+
+
+variable_opcodes = frozenset([
+    OpCode.READ_VAR_1, OpCode.READ_VAR_3,
+    OpCode.DEFINE_1, OpCode.DEFINE_3,
+    OpCode.SET_VAR_1, OpCode.SET_VAR_3,
+    OpCode.CHECK_ASSIGNED_1, OpCode.CHECK_ASSIGNED_3,
+])
+
+
+cached_variable_opcodes = frozenset([
+    OpCode.READ_VAR_1, OpCode.READ_VAR_3,
+    OpCode.SET_VAR_1, OpCode.SET_VAR_3,
+]).union(primitive_opcodes)
+
+
+local_opcodes = frozenset([
+    OpCode.READ_LOCAL_1, OpCode.READ_LOCAL_3,
+    OpCode.SET_LOCAL_1, OpCode.SET_LOCAL_3,
+    OpCode.READ_BOXED_1, OpCode.READ_BOXED_3,
+    OpCode.SET_BOXED_1, OpCode.SET_BOXED_3,
+    OpCode.BOX_LOCAL_1, OpCode.BOX_LOCAL_3,
+])
+
+
+call_opcodes = frozenset([
+    OpCode.CALL_1, OpCode.CALL_3,
+    OpCode.TAIL_CALL_1, OpCode.TAIL_CALL_3,
+    OpCode.CALL_BRANCH_1,
+])
+"""Opcodes whose argument is number of arguments of a call."""
+
+
+jump_opcodes = frozenset([OpCode.JUMP_IF_NOT_3, OpCode.JUMP_3])
+
+
+class GlobalCache:
+    """Inline cache of the cell a global variable resolves to.
+
+    Cache is valid while environment is the same and
+    Environment.version did not change since the cell was resolved.
+    """
+
+    __slots__ = ["variable", "env", "version", "cell"]
+
+    def __init__(self, variable):
+        self.variable = variable
+        self.env = None
+        self.version = -1
+        self.cell = None
+
+
+class CallCache:
+    """Inline cache of the procedure called from a call site.
+
+    'target' identifies the procedure called last time: bytecode of
+    a closure, so the cache does not keep the closure and its frame
+    alive, or the procedure itself for Python procedures. 'kind'
+    tells the evaluator how to call it. Cache is valid while
+    a procedure with the same target is called again.
+    """
+
+    __slots__ = ["num_args", "target", "kind"]
+
+    def __init__(self, num_args):
+        self.num_args = num_args
+        self.target = None
+        self.kind = None
+
+
+class BindingPlan:
+    """Precomputed layout of procedure frame.
+
+    'fixed_arity' is number of formals or None if procedure takes
+    rest argument, 'padding' fills slots after arguments with
+    'types.Unassigned.instance'.
+    """
+
+    __slots__ = ["formals", "formals_rest", "num_formals", "fixed_arity",
+                 "frame_size", "padding"]
+
+    def __init__(self, formals=(), formals_rest=None, frame_size=0):
+        self.formals = tuple(formals)
+        self.formals_rest = formals_rest
+        self.num_formals = len(self.formals)
+        self.frame_size = frame_size
+        if formals_rest is None:
+            self.fixed_arity = self.num_formals
+            num_bound = self.num_formals
+        else:
+            self.fixed_arity = None
+            num_bound = self.num_formals + 1
+        self.padding = ((types.Unassigned.instance,)
+                        * max(frame_size - num_bound, 0))
 
 
 class Bytecode:
-    """Bytecode for Scheme function or code block."""
+    """Bytecode for Scheme function or code block.
+
+    'captures' lists addresses of free variables, which closure
+    created from this bytecode copies into its frame, None stands
+    for the closure itself.
+
+    Frame of 'leaf' procedure lives on the operand stack: arguments
+    stay where the caller pushed them and the frame is dropped on
+    return, so the call allocates no frame. Leaf code reads its
+    locals with STACK opcodes and captured variables with FREE opcodes.
+    """
 
     def __init__(self):
         """Create empty bytecode."""
         self.code = bytearray()
         self.constants = []
         self.variables = []
-        self.formals = []
-        self.formals_rest = None
+        self.locals = []
+        self.captures = ()
+        self.leaf = False
+        self.set_formals()
+        self.lambda_ = None
+        self.calls = 0
+        self.native = None
+        self._decoded = None
+
+    def set_formals(self, formals=(), formals_rest=None, frame_size=0):
+        """Set procedure formals and frame size, build binding plan."""
+        self.binding = BindingPlan(formals, formals_rest, frame_size)
+        self.formals = self.binding.formals
+        self.formals_rest = formals_rest
+        self.frame_size = frame_size
 
     def append(self, byte):
+        self._decoded = None
         self.code.append(byte)
 
     def position(self):
         return len(self.code)
 
     def extend(self, bytes_):
+        self._decoded = None
         self.code.extend(bytes_)
 
     def truncate_by(self, length):
+        self._decoded = None
         del self.code[len(self.code) - length:]
 
     def add_constant(self, value):
@@ -81,6 +346,89 @@ class Bytecode:
         self.variables.append(value)
         return pos
 
+    def add_local(self, address):
+        """Add lexical address (depth, slot) of local variable."""
+        pos = len(self.locals)
+        self.locals.append(address)
+        return pos
+
+    def decoded(self):
+        """Get decoded form of bytecode.
+
+        Returns pair of parallel lists (opcodes, args). Argument of
+        an instruction is already resolved: constant value for CONST,
+        variable symbol for global definition, GlobalCache for
+        global variable access, (depth, slot)
+        lexical address for local variable access, instruction index
+        for jumps and CallCache with number of arguments for calls.
+        Decoded form is built on first use and kept until code
+        is modified.
+        """
+        if self._decoded is None:
+            self._decoded = decode_code(self)
+        return self._decoded
+
+
+def instruction_args(code, ip):
+    """Get list of integer arguments of instruction at 'ip'."""
+    result = []
+    pos = ip + 1
+    for _, n in opcode_operands[code[ip]]:
+        result.append(int.from_bytes(code[pos:pos+n], byteorder='big'))
+        pos += n
+    return result
+
+
+def decode_arg(bytecode, instr, arg):
+    if instr in constant_opcodes:
+        return bytecode.constants[arg]
+    elif instr in cached_variable_opcodes:
+        return GlobalCache(bytecode.variables[arg])
+    elif instr in variable_opcodes:
+        return bytecode.variables[arg]
+    elif instr in local_opcodes:
+        return bytecode.locals[arg]
+    elif instr in call_opcodes:
+        return CallCache(arg)
+    else:
+        return arg
+
+
+def decode_code(bytecode):
+    code = bytecode.code
+    opcodes = []
+    args = []
+    positions = {}
+    ip = 0
+    while ip < len(code):
+        positions[ip] = len(opcodes)
+        instr = opcode_by_value.get(code[ip])
+        if instr is None:
+            # Unknown opcode, evaluator reports it when it gets there.
+            opcodes.append(code[ip])
+            args.append(None)
+            break
+        decoded = []
+        pos = ip + 1
+        for component, n in opcode_operands[instr]:
+            arg = int.from_bytes(code[pos:pos+n], byteorder='big')
+            decoded.append(decode_arg(bytecode, component, arg))
+            pos += n
+        if len(decoded) == 0:
+            arg = None
+        elif len(decoded) == 1:
+            arg = decoded[0]
+        else:
+            arg = tuple(decoded)
+        opcodes.append(instr)
+        args.append(arg)
+        ip += opcode_num_args[instr] + 1
+    positions[ip] = len(opcodes)
+    for i, instr in enumerate(opcodes):
+        if instr in jump_opcodes:
+            args[i] = positions[args[i]]
+    return opcodes, args
+
 
 def decompile_code_inner(bytecode, *, result, prefix):
     l = math.ceil(math.log10(len(bytecode.code) + 1))
@@ -89,13 +437,15 @@ def decompile_code_inner(bytecode, *, result, prefix):
     result.append("{0}formals_rest = {1}".format(prefix, bytecode.formals_rest))
     result.append("{0}constants = {1}".format(prefix, bytecode.constants))
     result.append("{0}variables = {1}".format(prefix, bytecode.variables))
+    result.append("{0}locals = {1}".format(prefix, bytecode.locals))
+    result.append("{0}frame_size = {1}".format(prefix, bytecode.frame_size))
     while ip < len(bytecode.code):
         instr = OpCode(bytecode.code[ip])
         n = opcode_num_args[instr]
         if n > 0:
-            arg = int.from_bytes(bytecode.code[ip+1:ip+n+1], byteorder='big')
+            args = instruction_args(bytecode.code, ip)
             result.append("{0}{1:0{2}}: {3:10} {4}".format(
-                prefix, ip, l, instr.name, arg))
+                prefix, ip, l, instr.name, " ".join(map(str, args))))
             ip += n + 1
         else:
             result.append("{0}{1:0{2}}: {3:10}".format(
@@ -1,5 +1,14 @@
+import collections
+import functools
+import operator
+
+from pyme import base
 from pyme import core
-from pyme.core import TAIL
+from pyme import optimize as optimize_
+from pyme.bytecode import OpCode
+from pyme.core import (
+    ADDRESS, BOXED, CAPTURES, DIRECT, FRAME_SIZE, LEAF, PRIMITIVE,
+    SELF_CALL, SELF_CHECKED, SELF_JUMP, TAIL, TOP_FRAME_SIZE, UNASSIGNED)
 from pyme.drive import RunDriver
 from pyme.compile_to_bytecode import BytecodeCompiler
 
@@ -48,6 +57,19 @@ class TailAttribute(core.Visitor):
         element.attribute[TAIL] = self.tail
         element.body.accept(TailAttribute.true)
 
+    def let(self, element):
+        element.attribute[TAIL] = self.tail
+        for value in element.values:
+            value.accept(TailAttribute.false)
+        element.body.accept(self)
+
+    def case(self, element):
+        element.attribute[TAIL] = self.tail
+        element.key.accept(TailAttribute.false)
+        for clause in element.clauses:
+            clause.accept(self)
+        element.else_.accept(self)
+
 
 TailAttribute.true = TailAttribute(True)
 
@@ -55,16 +77,522 @@ TailAttribute.true = TailAttribute(True)
 TailAttribute.false = TailAttribute(False)
 
 
-def compile(expr, *, env):
-    """Compile expr to Bytecode.
+class Binding:
+    """Local variable stored in a frame slot.
 
-    'exprs' is a Scheme expression to compile.
+    Variable is boxed when a closure captures it and the value in
+    the slot can change after the closure copied it: the variable is
+    assigned, or a closure other than its own value captured it
+    before it was initialized.
+    """
 
-    Use 'env' to resolve special forms while compiling expression.
+    __slots__ = ["slot", "initialized", "assigned", "captured", "late"]
+
+    def __init__(self, slot, *, initialized):
+        self.slot = slot
+        self.initialized = initialized
+        self.assigned = False
+        self.captured = False
+        self.late = False
+
+    @property
+    def boxed(self):
+        return self.captured and (self.assigned or self.late)
+
+
+class Scope:
+    """Local variables mapped to frame slots.
+
+    Scope of a procedure owns a frame. Scope of a let block is
+    a 'block' scope which takes slots in frame of enclosing scope.
+
+    Procedure scope also maps free variables, which the closure
+    captures from enclosing frames, to slots of closure frame:
+    'captures' lists (address in enclosing frame, binding, is self
+    reference) for each slot of closure frame. 'self_binding' is
+    binding of variable defined as this procedure.
+    """
+
+    def __init__(self, parent=None, *, block=False):
+        self.parent = parent
+        self.block = block
+        self.slots = {}
+        self.frame_scope = parent.frame_scope if block else self
+        self.size = 0
+        self.free = {}
+        self.captures = []
+        self.self_binding = None
+
+    def add(self, variable, *, initialized=True):
+        binding = self.slots.get(variable)
+        if binding is None:
+            binding = Binding(self.frame_scope.size, initialized=initialized)
+            self.slots[variable] = binding
+            self.frame_scope.size += 1
+        return binding
+
+    def lookup(self, variable):
+        """Get binding of variable in frame of this scope or None."""
+        scope = self
+        while True:
+            binding = scope.slots.get(variable)
+            if binding is not None or not scope.block:
+                return binding
+            scope = scope.parent
+
+    def resolve(self, variable):
+        """Get (lexical address, binding) or None for global.
+
+        Address is (0, slot) for variables in procedure frame and
+        (1, slot) for variables in closure frame.
+        """
+        binding = self.lookup(variable)
+        if binding is not None:
+            return (0, binding.slot), binding
+        return self.frame_scope.capture(variable)
+
+    def capture(self, variable):
+        captured = self.free.get(variable)
+        if captured is not None:
+            return captured
+        if self.parent is None:
+            return None
+        resolved = self.parent.resolve(variable)
+        if resolved is None:
+            return None
+        address, binding = resolved
+        is_self = binding is self.self_binding and address[0] == 0
+        binding.captured = True
+        if not binding.initialized and not is_self:
+            binding.late = True
+        captured = (1, len(self.captures)), binding
+        self.captures.append((address, binding, is_self))
+        self.free[variable] = captured
+        return captured
+
+
+class InternalDefines(core.Walker):
+    """Collect variables defined in procedure body.
+
+    Does not descend into nested lambdas.
+    """
+
+    def __init__(self):
+        self.variables = []
+
+    def define_variable(self, element):
+        self.variables.append(element.variable)
+        element.value.accept(self)
+
+    def lambda_(self, element):
+        pass
+
+
+class LexicalAddress(core.Walker):
+    """Resolve local variables to (depth, slot) lexical addresses.
+
+    Sets ADDRESS attribute of variable access elements to lexical
+    address or to None for global variables, and FRAME_SIZE attribute
+    of lambdas to number of slots in procedure frame. Formals take
+    first slots, internal definitions take slots after them, then
+    variables of let blocks. ADDRESS attribute of Let is the list
+    of addresses of its variables.
+
+    Closures are flat: depth 0 is procedure frame, depth 1 is closure
+    frame holding copies of free variables. CAPTURES attribute of
+    lambda lists addresses of free variables in enclosing frame, None
+    stands for the closure itself. Variables which need a box are
+    marked by BOXED attribute of access elements, BOXED attribute
+    of Let (list of flags) and BOXED attribute of lambda (list of
+    slots boxed on entry). Boxes are set by 'finish', call it after
+    visiting the tree. LEAF attribute of lambda is true when it has
+    no nested lambdas, so nothing refers to its frame after return.
+
+    UNASSIGNED attribute of variable read is true when the read comes
+    before initialization of internal definition or letrec variable
+    in the source, so it may find the variable unassigned at run time.
+    References of procedure to the variable it is defined as are not
+    marked, procedure cannot be called before it is assigned.
+
+    Let outside of any lambda takes slots in frame of top-level code,
+    'top_scope' is scope of that frame or None if there are no such lets.
+    """
+
+    def __init__(self):
+        self.scope = None
+        self.top_scope = None
+        self.enclosing = None
+        self.defining = []
+        self.accesses = []
+        self.lets = []
+        self.lambdas = []
+
+    def resolve(self, element):
+        resolved = None
+        if self.scope is not None:
+            resolved = self.scope.resolve(element.variable)
+        if resolved is None:
+            element.attribute[ADDRESS] = None
+            return None
+        address, binding = resolved
+        element.attribute[ADDRESS] = address
+        self.accesses.append((element, binding))
+        return binding
+
+    def get_variable(self, element):
+        binding = self.resolve(element)
+        element.attribute[UNASSIGNED] = (
+            binding is not None and not binding.initialized
+            and binding not in self.defining)
+
+    def set_variable(self, element):
+        element.value.accept(self)
+        binding = self.resolve(element)
+        if binding is not None:
+            binding.assigned = True
+
+    def define_variable(self, element):
+        binding = None
+        if self.scope is not None:
+            binding = self.scope.lookup(element.variable)
+        if (binding is not None and not binding.initialized
+                and isinstance(element.value, core.Lambda)):
+            self.visit_lambda(element.value, binding)
+        else:
+            element.value.accept(self)
+        binding = self.resolve(element)
+        if binding is not None:
+            if binding.initialized:
+                binding.assigned = True
+            binding.initialized = True
+
+    def lambda_(self, element):
+        self.visit_lambda(element, None)
+
+    def visit_lambda(self, element, self_binding):
+        """Visit lambda which is the value of 'self_binding' or None."""
+        scope = Scope(self.scope)
+        scope.self_binding = self_binding
+        for arg in element.args:
+            scope.add(arg)
+        if element.rest_args is not None:
+            scope.add(element.rest_args)
+        defines = InternalDefines()
+        element.body.accept(defines)
+        for variable in defines.variables:
+            scope.add(variable, initialized=False)
+        element.attribute[LEAF] = True
+        if self.enclosing is not None:
+            self.enclosing.attribute[LEAF] = False
+        outer = self.scope, self.enclosing
+        self.scope = scope
+        self.enclosing = element
+        self.defining.append(self_binding)
+        element.body.accept(self)
+        self.defining.pop()
+        self.scope, self.enclosing = outer
+        element.attribute[FRAME_SIZE] = scope.size
+        self.lambdas.append((element, scope))
+
+    def let(self, element):
+        parent = self.scope
+        if parent is None:
+            if self.top_scope is None:
+                self.top_scope = Scope()
+            parent = self.top_scope
+        if not element.recursive:
+            for value in element.values:
+                value.accept(self)
+        scope = Scope(parent, block=True)
+        bindings = [
+            scope.add(variable, initialized=not element.recursive)
+            for variable in element.variables]
+        outer = self.scope
+        self.scope = scope
+        if element.recursive:
+            for binding, value in zip(bindings, element.values):
+                if isinstance(value, core.Lambda):
+                    self.visit_lambda(value, binding)
+                else:
+                    value.accept(self)
+                binding.initialized = True
+        element.body.accept(self)
+        self.scope = outer
+        element.attribute[ADDRESS] = [
+            (0, binding.slot) for binding in bindings]
+        self.lets.append((element, bindings))
+
+    def finish(self):
+        """Set attributes which depend on the whole tree."""
+        for element, binding in self.accesses:
+            element.attribute[BOXED] = binding.boxed
+        for element, bindings in self.lets:
+            element.attribute[BOXED] = [
+                binding.boxed for binding in bindings]
+        for element, scope in self.lambdas:
+            element.attribute[CAPTURES] = [
+                None if is_self and not binding.boxed else address
+                for address, binding, is_self in scope.captures]
+            element.attribute[BOXED] = [
+                binding.slot for binding in scope.slots.values()
+                if binding.boxed]
+
+
+class AssignedVariables(core.Walker):
+    """Collect variables assigned with set!, including nested lambdas."""
+
+    def __init__(self):
+        self.variables = set()
+
+    def set_variable(self, element):
+        self.variables.add(element.variable)
+        element.value.accept(self)
+
+
+class HasLambda(core.Walker):
+    """Check if element contains a lambda."""
+
+    def __init__(self):
+        self.found = False
+
+    def lambda_(self, element):
+        self.found = True
+
+
+class SelfTailCalls(core.Walker):
+    """Find tail calls of procedure to itself.
+
+    Sets SELF_CALL attribute of Apply to SELF_JUMP when procedure is
+    a local variable defined once and never assigned, so the call
+    can jump to procedure start, or to SELF_CHECKED when procedure is
+    a global variable, which can be redefined, so the call checks
+    the procedure at runtime. Procedures with rest argument or nested
+    lambdas, which could capture the frame, are not considered.
+    """
+
+    def __init__(self, fixed=frozenset(), target=None):
+        self.fixed = fixed
+        self.target = target
+
+    def define_variable(self, element):
+        value = element.value
+        if not isinstance(value, core.Lambda):
+            value.accept(self)
+        elif element.attribute[ADDRESS] is None:
+            self.visit_lambda(value, (element.variable, None, SELF_CHECKED))
+        elif element.variable in self.fixed:
+            self.visit_lambda(value, (element.variable, 1, SELF_JUMP))
+        else:
+            self.visit_lambda(value, None)
+
+    def lambda_(self, element):
+        self.visit_lambda(element, None)
+
+    def let(self, element):
+        if not element.recursive:
+            super().let(element)
+            return
+        assigned = AssignedVariables()
+        element.accept(assigned)
+        for variable, value in zip(element.variables, element.values):
+            if not isinstance(value, core.Lambda):
+                value.accept(self)
+            elif (variable not in assigned.variables
+                    and element.variables.count(variable) == 1):
+                self.visit_lambda(value, (variable, 1, SELF_JUMP))
+            else:
+                self.visit_lambda(value, None)
+        element.body.accept(self)
+
+    def visit_lambda(self, element, binding):
+        """Visit lambda bound by define as described by 'binding'.
+
+        'binding' is (variable, depth of references from lambda body
+        or None for global, SELF_CALL value) or None.
+        """
+        defines = InternalDefines()
+        element.body.accept(defines)
+        assigned = AssignedVariables()
+        element.body.accept(assigned)
+        counts = collections.Counter(defines.variables)
+        fixed = frozenset(
+            variable for variable, count in counts.items()
+            if count == 1 and variable not in assigned.variables
+            and variable not in element.args)
+        has_lambda = HasLambda()
+        element.body.accept(has_lambda)
+        if (element.rest_args is not None or element.kwargs
+                or element.rest_kwargs or has_lambda.found):
+            binding = None
+        target = None if binding is None else (element, binding)
+        element.body.accept(SelfTailCalls(fixed, target))
+
+    def apply(self, element):
+        super().apply(element)
+        element.attribute[SELF_CALL] = None
+        if self.target is None or not element.attribute[TAIL]:
+            return
+        lambda_, (variable, depth, kind) = self.target
+        proc = element.proc
+        if (not isinstance(proc, core.GetVariable)
+                or proc.variable != variable or element.kwargs
+                or len(element.args) != len(lambda_.args)):
+            return
+        address = proc.attribute[ADDRESS]
+        if depth is None and address is None:
+            element.attribute[SELF_CALL] = kind
+        elif (depth is not None and address is not None
+                and address[0] == depth):
+            element.attribute[SELF_CALL] = kind
+
+
+@functools.lru_cache(maxsize=None)
+def primitives():
+    """Get builtins with dedicated opcodes.
+
+    Returns list of (builtin, number of args, opcode).
+    """
+    return [
+        (base.plus, 2, OpCode.ADD2_1),
+        (base.minus, 2, OpCode.SUB2_1),
+        (base.lt, 2, OpCode.LT2_1),
+        (base.arithmetic_eq, 2, OpCode.NUM_EQ2_1),
+        (base.car, 1, OpCode.CAR_1),
+        (base.cdr, 1, OpCode.CDR_1),
+        (base.cons, 2, OpCode.CONS_1),
+        (base.nullp, 1, OpCode.NULLP_1),
+        (base.pairp, 1, OpCode.PAIRP_1),
+        (operator.is_, 2, OpCode.EQ_1),
+    ]
+
+
+class PrimitiveCalls(core.Walker):
+    """Find calls of builtins which have dedicated opcodes.
+
+    Sets PRIMITIVE attribute of Apply to the opcode when procedure
+    is a global variable bound to a known builtin at compile time.
+    Opcode checks the binding at runtime and falls back to generic call
+    if it has changed.
+    """
+
+    def __init__(self, env):
+        self.env = env
+
+    def apply(self, element):
+        super().apply(element)
+        element.attribute[PRIMITIVE] = None
+        proc = element.proc
+        if (not isinstance(proc, core.GetVariable)
+                or proc.attribute[ADDRESS] is not None or element.kwargs):
+            return
+        value = self.env.get(proc.variable)
+        for builtin, num_args, opcode in primitives():
+            if value is builtin and len(element.args) == num_args:
+                element.attribute[PRIMITIVE] = opcode
+                return
+
+
+class GlobalDefines(core.Walker):
+    """Collect values defined for global variables."""
+
+    def __init__(self):
+        self.values = collections.defaultdict(list)
+
+    def define_variable(self, element):
+        if element.attribute[ADDRESS] is None:
+            self.values[element.variable].append(element.value)
+        super().define_variable(element)
+
+
+class DirectCalls(core.Walker):
+    """Find calls of global procedures known at compile time.
+
+    Procedure is known when its global variable is defined once by
+    a lambda in the compiled code and never assigned there, or else is
+    bound in 'env' to a procedure compiled from a lambda. Sets DIRECT
+    attribute of Apply to the lambda when the call passes as many
+    arguments as the lambda takes. Call checks at runtime that the
+    variable is still bound to a procedure made from the lambda and
+    falls back to generic call if it is not.
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.known = {}
+        self.assigned = set()
+
+    def find_known(self, element):
+        defines = GlobalDefines()
+        element.accept(defines)
+        assigned = AssignedVariables()
+        element.accept(assigned)
+        self.assigned = assigned.variables
+        for variable, values in defines.values.items():
+            if len(values) == 1 and isinstance(values[0], core.Lambda):
+                self.known[variable] = values[0]
+            else:
+                self.known[variable] = None
+
+    def known_lambda(self, variable):
+        if variable in self.assigned:
+            return None
+        if variable in self.known:
+            return self.known[variable]
+        bytecode = getattr(self.env.get(variable), "bytecode", None)
+        return getattr(bytecode, "lambda_", None)
+
+    def apply(self, element):
+        super().apply(element)
+        element.attribute[DIRECT] = None
+        proc = element.proc
+        if (not isinstance(proc, core.GetVariable)
+                or proc.attribute[ADDRESS] is not None or element.kwargs
+                or element.attribute[PRIMITIVE] is not None
+                or element.attribute[SELF_CALL] is not None):
+            return
+        lambda_ = self.known_lambda(proc.variable)
+        if (lambda_ is not None and lambda_.rest_args is None
+                and not lambda_.kwargs and not lambda_.rest_kwargs
+                and len(lambda_.args) == len(element.args)):
+            element.attribute[DIRECT] = lambda_
+
+
+def compile_core(expr, *, env, optimize=0):
+    """Compile expr to core elements with analysis attributes set.
+
+    Common front end of the bytecode and closure compilers.
+    'optimize' is optimization level, see 'optimize.passes'.
     """
     driver = RunDriver(env=env)
     core_code = driver.compile_expr(expr)
+    if optimize:
+        core_code = optimize_.optimize(core_code, env=env, level=optimize)
     core_code.accept(TailAttribute.true)
+    lexical_address = LexicalAddress()
+    core_code.accept(lexical_address)
+    lexical_address.finish()
+    top_scope = lexical_address.top_scope
+    top_frame_size = 0 if top_scope is None else top_scope.size
+    core_code.attribute[TOP_FRAME_SIZE] = top_frame_size
+    core_code.accept(PrimitiveCalls(env))
+    core_code.accept(SelfTailCalls())
+    direct_calls = DirectCalls(env)
+    direct_calls.find_known(core_code)
+    core_code.accept(direct_calls)
+    return core_code
+
+
+def compile(expr, *, env, optimize=0):
+    """Compile expr to Bytecode.
+
+    'exprs' is a Scheme expression to compile.
+
+    Use 'env' to resolve special forms while compiling expression.
+    'optimize' is optimization level.
+    """
+    core_code = compile_core(expr, env=env, optimize=optimize)
     compiler = BytecodeCompiler()
+    compiler.bytecode.set_formals(
+        frame_size=core_code.attribute[TOP_FRAME_SIZE])
     compiler.compile(core_code)
     return compiler.bytecode
@@ -1,19 +1,156 @@
 """Compile from abstract source tree to bytecode."""
 
 from pyme import core
-from pyme.core import TAIL
-from pyme.bytecode import Bytecode, OpCode
+from pyme.core import (
+    ADDRESS, BOXED, CAPTURES, DIRECT, FRAME_SIZE, LEAF, PRIMITIVE,
+    SELF_CALL, SELF_CHECKED, SELF_JUMP, TAIL, UNASSIGNED)
+from pyme.bytecode import (
+    Bytecode, OpCode, fused_opcodes, instruction_args, jump_opcodes,
+    opcode_by_value, opcode_num_args, opcode_operands)
 from pyme.exceptions import CompileError
 
 
+_fuse_pairs = {
+    opcodes: fused for fused, opcodes in fused_opcodes.items()
+}
+
+
+_dead_pairs = frozenset([
+    (OpCode.PUSH_FALSE, OpCode.DROP),
+    (OpCode.CONST_1, OpCode.DROP),
+    (OpCode.CONST_3, OpCode.DROP),
+])
+"""Pairs which push a value and immediately drop it."""
+
+
+def _parse_code(code):
+    """Split code to list of [opcode, args] instructions.
+
+    Jump targets are converted to instruction indexes.
+    """
+    instrs = []
+    positions = {}
+    ip = 0
+    while ip < len(code):
+        positions[ip] = len(instrs)
+        instr = opcode_by_value[code[ip]]
+        instrs.append([instr, instruction_args(code, ip)])
+        ip += opcode_num_args[instr] + 1
+    positions[ip] = len(instrs)
+    for instr in instrs:
+        if instr[0] in jump_opcodes:
+            instr[1] = [positions[instr[1][0]]]
+    return instrs
+
+
+def _thread_jumps(instrs):
+    """Retarget jumps to jumps, replace jumps to RET with RET."""
+    for instr in instrs:
+        if instr[0] not in jump_opcodes:
+            continue
+        target = instr[1][0]
+        seen = set()
+        while (target < len(instrs) and target not in seen
+               and instrs[target][0] == OpCode.JUMP_3):
+            seen.add(target)
+            target = instrs[target][1][0]
+        instr[1] = [target]
+        if (instr[0] == OpCode.JUMP_3 and target < len(instrs)
+                and instrs[target][0] == OpCode.RET):
+            instr[0] = OpCode.RET
+            instr[1] = []
+
+
+def _is_branch_call(instrs, i):
+    return (i + 1 < len(instrs) and instrs[i][0] == OpCode.CALL_1
+            and instrs[i + 1][0] == OpCode.JUMP_IF_NOT_3)
+
+
+def _fuse(instrs):
+    """Replace opcode sequences with superinstructions.
+
+    Second instruction of a sequence must not be a jump target.
+    """
+    targets = {instr[1][0] for instr in instrs if instr[0] in jump_opcodes}
+    result = []
+    new_index = {}
+    i = 0
+    while i < len(instrs):
+        new_index[i] = len(result)
+        opcode, args = instrs[i]
+        if i + 1 < len(instrs) and i + 1 not in targets:
+            next_opcode, next_args = instrs[i + 1]
+            pair = (opcode, next_opcode)
+            if pair in _dead_pairs:
+                i += 2
+                continue
+            fused = _fuse_pairs.get(pair)
+            if _is_branch_call(instrs, i + 1):
+                # Keep the call, it becomes CALL_BRANCH below.
+                fused = None
+            if fused is not None:
+                result.append([fused, args + next_args])
+                i += 2
+                continue
+        if _is_branch_call(instrs, i):
+            opcode = OpCode.CALL_BRANCH_1
+        result.append([opcode, args])
+        i += 1
+    new_index[len(instrs)] = len(result)
+    for instr in result:
+        if instr[0] in jump_opcodes:
+            instr[1] = [new_index[instr[1][0]]]
+    return result
+
+
+def _encode_code(instrs):
+    positions = []
+    ip = 0
+    for opcode, args in instrs:
+        positions.append(ip)
+        ip += opcode_num_args[opcode] + 1
+    positions.append(ip)
+    code = bytearray()
+    for opcode, args in instrs:
+        code.append(opcode)
+        if opcode in jump_opcodes:
+            code.extend(positions[args[0]].to_bytes(3, byteorder='big'))
+            continue
+        for (_, size), arg in zip(opcode_operands[opcode], args):
+            code.extend(arg.to_bytes(size, byteorder='big'))
+    return code
+
+
+def peephole(bytecode):
+    """Optimize code of 'bytecode' in place.
+
+    Folds jump-to-jump chains and jumps to RET, removes values pushed
+    only to be dropped, and replaces common opcode sequences with
+    superinstructions.
+    """
+    instrs = _parse_code(bytecode.code)
+    _thread_jumps(instrs)
+    instrs = _fuse(instrs)
+    code = _encode_code(instrs)
+    bytecode.truncate_by(len(bytecode.code))
+    bytecode.extend(code)
+
+
 class BytecodeCompiler:
+    """Compile core elements to Bytecode.
+
+    With 'leaf' set locals are compiled to access the frame
+    on the operand stack, see 'Bytecode.leaf'.
+    """
 
-    def __init__(self):
+    def __init__(self, *, leaf=False):
         self.bytecode = Bytecode()
+        self.bytecode.leaf = leaf
         self.outer_bytecodes = []
 
     def compile(self, element):
         element.accept(self)
+        peephole(self.bytecode)
 
     def compile_shortest(self, arg, *opcodes):
         """Compile shortest form of opcode with argument.
@@ -47,19 +184,143 @@ class BytecodeCompiler:
         if element.attribute[TAIL]:
             self.bytecode.append(OpCode.RET.value)
 
-    def get_variable(self, element):
-        pos = self.bytecode.add_variable(element.variable)
+    def compile_leaf_local(self, address, boxed, opcodes):
+        """Compile access to local of leaf procedure.
+
+        'opcodes' are (stack, free, boxed free) opcode variants
+        with 1-byte and 3-bytes argument.
+        """
+        depth, slot = address
+        if depth == 0:
+            variants = opcodes[0]
+        elif boxed:
+            variants = opcodes[2]
+        elif opcodes[1] is not None:
+            variants = opcodes[1]
+        else:
+            raise CompileError("Cannot assign unboxed captured variable")
+        self.compile_shortest(slot, variants[0].value, None,
+                              variants[1].value)
+
+    def compile_set_local(self, address, boxed=False):
+        if self.bytecode.leaf:
+            self.compile_leaf_local(address, boxed, [
+                (OpCode.SET_STACK_1, OpCode.SET_STACK_3),
+                None,
+                (OpCode.SET_FREE_BOXED_1, OpCode.SET_FREE_BOXED_3),
+            ])
+            return
+        pos = self.bytecode.add_local(address)
+        if boxed:
+            self.compile_shortest(
+                pos,
+                OpCode.SET_BOXED_1.value, None, OpCode.SET_BOXED_3.value)
+        else:
+            self.compile_shortest(
+                pos,
+                OpCode.SET_LOCAL_1.value, None, OpCode.SET_LOCAL_3.value)
+
+    def compile_box_local(self, slot):
+        pos = self.bytecode.add_local((0, slot))
         self.compile_shortest(
             pos,
-            OpCode.READ_VAR_1.value, None, OpCode.READ_VAR_3.value)
+            OpCode.BOX_LOCAL_1.value, None, OpCode.BOX_LOCAL_3.value)
+
+    def get_variable(self, element):
+        address = element.attribute[ADDRESS]
+        if address is None:
+            pos = self.bytecode.add_variable(element.variable)
+            self.compile_shortest(
+                pos,
+                OpCode.READ_VAR_1.value, None, OpCode.READ_VAR_3.value)
+        elif self.bytecode.leaf:
+            self.compile_leaf_local(address, element.attribute[BOXED], [
+                (OpCode.READ_STACK_1, OpCode.READ_STACK_3),
+                (OpCode.READ_FREE_1, OpCode.READ_FREE_3),
+                (OpCode.READ_FREE_BOXED_1, OpCode.READ_FREE_BOXED_3),
+            ])
+        elif element.attribute[BOXED]:
+            pos = self.bytecode.add_local(address)
+            self.compile_shortest(
+                pos,
+                OpCode.READ_BOXED_1.value, None, OpCode.READ_BOXED_3.value)
+        else:
+            pos = self.bytecode.add_local(address)
+            self.compile_shortest(
+                pos,
+                OpCode.READ_LOCAL_1.value, None, OpCode.READ_LOCAL_3.value)
+        if address is not None and element.attribute[UNASSIGNED]:
+            pos = self.bytecode.add_variable(element.variable)
+            self.compile_shortest(
+                pos,
+                OpCode.CHECK_ASSIGNED_1.value, None,
+                OpCode.CHECK_ASSIGNED_3.value)
         if element.attribute[TAIL]:
             self.bytecode.append(OpCode.RET.value)
 
+    def compile_primitive(self, element):
+        """Compile call of builtin with dedicated opcode.
+
+        Returns False if the opcode cannot be used.
+        """
+        opcode = element.attribute.get(PRIMITIVE)
+        if opcode is None:
+            return False
+        if len(self.bytecode.variables) > 0xff:
+            return False
+        pos = self.bytecode.add_variable(element.proc.variable)
+        for arg in element.args:
+            arg.accept(self)
+        self.bytecode.append(opcode.value)
+        self.bytecode.append(pos)
+        if element.attribute[TAIL]:
+            self.bytecode.append(OpCode.RET.value)
+        return True
+
+    def compile_self_jump(self, element):
+        """Compile self tail call to argument stores and jump to start."""
+        for arg in element.args:
+            arg.accept(self)
+        for slot in reversed(range(len(element.args))):
+            self.compile_set_local((0, slot))
+        self.bytecode.append(OpCode.JUMP_3.value)
+        self.bytecode.extend(b"\x00\x00\x00")
+
+    def compile_direct_call(self, element):
+        """Compile call of procedure known at compile time.
+
+        Procedure and arguments are already on the stack.
+        Returns False if the direct call opcode cannot be used.
+        """
+        lambda_ = element.attribute.get(DIRECT)
+        if (lambda_ is None or len(self.bytecode.constants) > 0xff
+                or len(element.args) > 0xff):
+            return False
+        if element.attribute[TAIL]:
+            opcode = OpCode.DIRECT_TAIL_CALL_1
+        else:
+            opcode = OpCode.DIRECT_CALL_1
+        self.bytecode.append(opcode.value)
+        self.bytecode.append(self.bytecode.add_constant(lambda_))
+        self.bytecode.append(len(element.args))
+        return True
+
     def apply(self, element):
+        if self.compile_primitive(element):
+            return
+        self_call = element.attribute.get(SELF_CALL)
+        if self_call == SELF_JUMP:
+            self.compile_self_jump(element)
+            return
         element.proc.accept(self)
         for arg in element.args:
             arg.accept(self)
-        if element.attribute[TAIL]:
+        if self_call == SELF_CHECKED:
+            self.compile_shortest(
+                len(element.args), OpCode.SELF_TAIL_CALL_1.value)
+        elif self.compile_direct_call(element):
+            pass
+        elif element.attribute[TAIL]:
             self.compile_shortest(
                 len(element.args),
                 OpCode.TAIL_CALL_1.value, None, OpCode.TAIL_CALL_3.value)
@@ -104,31 +365,95 @@ class BytecodeCompiler:
             self.bytecode.code[then_addr:then_addr+3] = pos
 
     def lambda_(self, element):
-        compiler = BytecodeCompiler()
-        compiler.bytecode.formals = element.args
-        compiler.bytecode.formals_rest = element.rest_args
-        element.body.accept(compiler)
+        compiler = BytecodeCompiler(leaf=element.attribute[LEAF])
+        compiler.bytecode.set_formals(
+            element.args, element.rest_args, element.attribute[FRAME_SIZE])
+        compiler.bytecode.lambda_ = element
+        compiler.bytecode.captures = tuple(element.attribute[CAPTURES])
+        for slot in element.attribute[BOXED]:
+            compiler.compile_box_local(slot)
+        compiler.compile(element.body)
         self.compile_constant(compiler.bytecode)
         self.bytecode.append(OpCode.MAKE_CLOSURE.value)
         if element.attribute[TAIL]:
             self.bytecode.append(OpCode.RET.value)
 
-    def define_variable(self, element):
-        element.value.accept(self)
-        pos = self.bytecode.add_variable(element.variable)
+    def let(self, element):
+        addresses = element.attribute[ADDRESS]
+        boxed = element.attribute[BOXED]
+        if element.recursive:
+            for address, is_boxed in zip(addresses, boxed):
+                if is_boxed:
+                    self.compile_box_local(address[1])
+            for address, is_boxed, value in zip(
+                    addresses, boxed, element.values):
+                value.accept(self)
+                self.compile_set_local(address, is_boxed)
+        else:
+            for value in element.values:
+                value.accept(self)
+            for address in reversed(addresses):
+                self.compile_set_local(address)
+            for address, is_boxed in zip(addresses, boxed):
+                if is_boxed:
+                    self.compile_box_local(address[1])
+        element.body.accept(self)
+
+    def case(self, element):
+        """Compile case to CASE instruction followed by jump vector.
+
+        CASE skips as many JUMP instructions of the vector as is
+        the index of matching clause, last JUMP goes to else clause.
+        """
+        element.key.accept(self)
+        pos = self.bytecode.add_constant(
+            (element.table, len(element.clauses)))
         self.compile_shortest(
             pos,
-            OpCode.DEFINE_1.value, None, OpCode.DEFINE_3.value)
+            OpCode.CASE_1.value, None, OpCode.CASE_3.value)
+        vector = []
+        for _ in range(len(element.clauses) + 1):
+            self.bytecode.append(OpCode.JUMP_3.value)
+            vector.append(self.bytecode.position())
+            self.bytecode.extend(b"\x00\x00\x00")
+        ends = []
+        bodies = element.clauses + [element.else_]
+        for i, (addr, body) in enumerate(zip(vector, bodies)):
+            pos = self.bytecode.position().to_bytes(3, byteorder='big')
+            self.bytecode.code[addr:addr+3] = pos
+            body.accept(self)
+            if not element.attribute[TAIL] and i < len(bodies) - 1:
+                self.bytecode.append(OpCode.JUMP_3.value)
+                ends.append(self.bytecode.position())
+                self.bytecode.extend(b"\x00\x00\x00")
+        pos = self.bytecode.position().to_bytes(3, byteorder='big')
+        for addr in ends:
+            self.bytecode.code[addr:addr+3] = pos
+
+    def define_variable(self, element):
+        element.value.accept(self)
+        address = element.attribute[ADDRESS]
+        if address is None:
+            pos = self.bytecode.add_variable(element.variable)
+            self.compile_shortest(
+                pos,
+                OpCode.DEFINE_1.value, None, OpCode.DEFINE_3.value)
+        else:
+            self.compile_set_local(address, element.attribute[BOXED])
         self.bytecode.append(OpCode.PUSH_FALSE.value)
         if element.attribute[TAIL]:
             self.bytecode.append(OpCode.RET.value)
 
     def set_variable(self, element):
         element.value.accept(self)
-        pos = self.bytecode.add_variable(element.variable)
-        self.compile_shortest(
-            pos,
-            OpCode.SET_VAR_1.value, None, OpCode.SET_VAR_3.value)
+        address = element.attribute[ADDRESS]
+        if address is None:
+            pos = self.bytecode.add_variable(element.variable)
+            self.compile_shortest(
+                pos,
+                OpCode.SET_VAR_1.value, None, OpCode.SET_VAR_3.value)
+        else:
+            self.compile_set_local(address, element.attribute[BOXED])
         self.bytecode.append(OpCode.PUSH_FALSE.value)
         if element.attribute[TAIL]:
             self.bytecode.append(OpCode.RET.value)
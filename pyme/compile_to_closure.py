@@ -0,0 +1,522 @@
+"""Compile from abstract source tree to Python closures.
+
+Alternative to bytecode compiler and evaluator. Every element of source
+tree is compiled to a Python function 'node(runtime, frame)' which
+returns value of the element, so evaluation does not dispatch
+on every instruction. Calls in tail position return TailCall which is
+performed by trampoline in 'Runtime.run'.
+
+Calls in non-tail position recurse in Python, each takes a few
+Python stack frames. Evaluation raises Python recursion limit to
+'recursion_limit', so non-tail calls can nest tens of thousands deep.
+Deeper nesting raises EvalError, the bytecode evaluator has no such
+limit.
+"""
+
+import operator
+import sys
+
+from pyme import base
+from pyme import compile as compile_
+from pyme import core
+from pyme import interop
+from pyme import types
+from pyme.bytecode import BindingPlan, GlobalCache, OpCode
+from pyme.core import (
+    ADDRESS, BOXED, CAPTURES, FRAME_SIZE, PRIMITIVE, TAIL, TOP_FRAME_SIZE,
+    UNASSIGNED)
+from pyme.eval import _bind_formals
+from pyme.exceptions import EvalError, IdentifierNotBoundError
+
+
+class TailCall:
+    """Call which trampoline makes after procedure body returns."""
+
+    __slots__ = ["proc", "args"]
+
+    def __init__(self, proc, args):
+        self.proc = proc
+        self.args = args
+
+
+class Code:
+    """Compiled procedure body."""
+
+    __slots__ = ["body", "binding"]
+
+    def __init__(self, body, binding=BindingPlan()):
+        self.body = body
+        self.binding = binding
+
+
+recursion_limit = 200000 if sys.version_info >= (3, 11) else None
+"""Python recursion limit during evaluation or None to keep it.
+
+Before Python 3.11 Python calls also recurse on C stack, which would
+overflow before a high limit is reached.
+"""
+
+
+def _recursion_error():
+    return EvalError("Too deep recursion of non-tail calls")
+
+
+class Procedure:
+    """Scheme procedure compiled to Python closures.
+
+    'env' is environment for global variables, 'frame' is the frame
+    of lexically enclosing procedure.
+    """
+
+    __slots__ = ["code", "env", "frame"]
+
+    def __init__(self, code, env, frame=None):
+        self.code = code
+        self.env = env
+        self.frame = frame
+
+    def __call__(self, *args):
+        try:
+            return Runtime().call(self, list(args))
+        except RecursionError:
+            raise _recursion_error() from None
+
+
+class Runtime:
+    """State of evaluation of closure-compiled code.
+
+    Provides the part of Evaluator interface used by hooks
+    and by builtins marked with 'with_evaluator'.
+
+    Every non-tail call made by 'call' recurses in Python. 'eval'
+    raises Python recursion limit to 'recursion_limit' and reports
+    RecursionError as EvalError.
+    """
+
+    def __init__(self, *, hooks=None):
+        self.call_stack = []
+        self.result = None
+        self.running = False
+        self.set_hooks(hooks)
+
+    def set_hooks(self, hooks):
+        """Look up hooks in 'hooks' config."""
+        self.call_hook = interop.get_config(hooks, "eval.call")
+        self.optimize = interop.get_config(hooks, "compile.optimize", 0)
+
+    def call(self, proc, args):
+        """Call 'proc' in non-tail position and return the result.
+
+        Tail calls returned by procedure body are made in a loop,
+        which is inlined here to save a Python frame per call.
+        """
+        if type(proc) is not Procedure:
+            if hasattr(proc, "with_evaluator"):
+                proc(*args, evaluator=self, tail=False)
+                return self.result
+            return proc(*args)
+        self.call_stack.append(proc)
+        result = TailCall(proc, args)
+        while type(result) is TailCall:
+            proc = result.proc
+            args = result.args
+            if type(proc) is Procedure:
+                code = proc.code
+                frame = types.Frame(
+                    _bind_formals(code.binding, args), proc.frame)
+                if self.call_hook is not None:
+                    self.call_hook(self)
+                result = code.body(self, frame)
+            elif hasattr(proc, "with_evaluator"):
+                proc(*args, evaluator=self, tail=True)
+                result = self.result
+            else:
+                result = proc(*args)
+        self.call_stack.pop()
+        return result
+
+    def do_apply(self, proc, args, *, tail):
+        if tail:
+            self.result = TailCall(proc, list(args))
+        else:
+            self.result = self.call(proc, list(args))
+
+    def do_eval(self, expr, env, *, tail):
+        code = compile(expr, env=env, optimize=self.optimize)
+        self.do_apply(Procedure(code, env), [], tail=tail)
+
+    def eval(self, expr, *, env):
+        """Compile and execute Scheme expression 'expr' in 'env'."""
+        code = compile(expr, env=env, optimize=self.optimize)
+        self.call_stack.clear()
+        frame = None
+        if code.binding.frame_size:
+            frame = types.Frame(list(code.binding.padding))
+        self.running = True
+        limit = sys.getrecursionlimit()
+        if recursion_limit is not None and limit < recursion_limit:
+            sys.setrecursionlimit(recursion_limit)
+        try:
+            result = code.body(self, frame)
+            if type(result) is TailCall:
+                result = self.call(result.proc, result.args)
+        except RecursionError:
+            raise _recursion_error() from None
+        finally:
+            sys.setrecursionlimit(limit)
+            self.running = False
+        return result
+
+
+def _add(x, y):
+    if type(x) is type(y) is int:
+        return x + y
+    return base.plus(x, y)
+
+
+def _sub(x, y):
+    if type(x) is type(y) is int:
+        return x - y
+    return base.minus(x, y)
+
+
+def _primitive_operations():
+    return {
+        OpCode.ADD2_1: _add,
+        OpCode.SUB2_1: _sub,
+        OpCode.LT2_1: operator.lt,
+        OpCode.NUM_EQ2_1: operator.eq,
+        OpCode.CAR_1: operator.attrgetter("car"),
+        OpCode.CDR_1: operator.attrgetter("cdr"),
+        OpCode.CONS_1: types.Pair,
+        OpCode.NULLP_1: lambda x: x is types.EmptyList.instance,
+        OpCode.PAIRP_1: lambda x: isinstance(x, types.Pair),
+        OpCode.EQ_1: operator.is_,
+    }
+
+
+primitive_operations = _primitive_operations()
+"""Python operations performed by primitive calls with unchanged binding."""
+
+
+class ClosureCompiler(core.Visitor):
+    """Compile core elements to Python closures.
+
+    Expects TAIL, ADDRESS, FRAME_SIZE and PRIMITIVE attributes
+    to be set. 'env' is environment for global variables.
+    """
+
+    def __init__(self, env):
+        self.env = env
+
+    def compile(self, element):
+        frame_size = element.attribute[TOP_FRAME_SIZE]
+        return Code(element.accept(self), BindingPlan(frame_size=frame_size))
+
+    def global_cell(self, variable):
+        """Get function returning cell of global 'variable'."""
+        env = self.env
+        cache = GlobalCache(variable)
+
+        def global_cell():
+            if cache.version != types.Environment.version:
+                cell = env.lookup(variable)
+                if cell is None:
+                    raise IdentifierNotBoundError(str(variable))
+                cache.version = types.Environment.version
+                cache.cell = cell
+            return cache.cell
+        return global_cell
+
+    def constant(self, element):
+        value = element.value
+
+        def constant(rt, frame):
+            return value
+        return constant
+
+    def get_variable(self, element):
+        address = element.attribute[ADDRESS]
+        if address is None:
+            global_cell = self.global_cell(element.variable)
+
+            def read_global(rt, frame):
+                return global_cell().value
+            return read_global
+        read = self.read_local(element)
+        if not element.attribute[UNASSIGNED]:
+            return read
+        unassigned = types.Unassigned.instance
+        variable = element.variable
+
+        def read_checked(rt, frame):
+            result = read(rt, frame)
+            if result is unassigned:
+                raise IdentifierNotBoundError(str(variable))
+            return result
+        return read_checked
+
+    def read_local(self, element):
+        """Compile read of local variable without initialization check."""
+        depth, slot = element.attribute[ADDRESS]
+        if element.attribute[BOXED]:
+            if depth == 0:
+                def read_boxed(rt, frame):
+                    return frame.values[slot].value
+            else:
+                def read_boxed(rt, frame):
+                    return frame.parent.values[slot].value
+            return read_boxed
+        if depth == 0:
+            def read_local(rt, frame):
+                return frame.values[slot]
+        else:
+            def read_local(rt, frame):
+                return frame.parent.values[slot]
+        return read_local
+
+    def store(self, element):
+        """Compile storing value of 'element' to a local variable."""
+        value = element.value.accept(self)
+        depth, slot = element.attribute[ADDRESS]
+        if element.attribute[BOXED]:
+            def set_boxed(rt, frame):
+                result = value(rt, frame)
+                if depth:
+                    frame = frame.parent
+                frame.values[slot].value = result
+                return False
+            return set_boxed
+
+        def set_local(rt, frame):
+            result = value(rt, frame)
+            if depth:
+                frame = frame.parent
+            frame.values[slot] = result
+            return False
+        return set_local
+
+    def set_variable(self, element):
+        if element.attribute[ADDRESS] is not None:
+            return self.store(element)
+        value = element.value.accept(self)
+        global_cell = self.global_cell(element.variable)
+
+        def set_global(rt, frame):
+            global_cell().value = value(rt, frame)
+            return False
+        return set_global
+
+    def define_variable(self, element):
+        if element.attribute[ADDRESS] is not None:
+            return self.store(element)
+        value = element.value.accept(self)
+        env = self.env
+        variable = element.variable
+
+        def define_global(rt, frame):
+            env.define(variable, value(rt, frame))
+            return False
+        return define_global
+
+    def primitive(self, element, args):
+        """Compile call of builtin which has a dedicated operation.
+
+        'args' are compiled arguments.
+        """
+        opcode = element.attribute[PRIMITIVE]
+        operation = primitive_operations[opcode]
+        builtin = self.env.get(element.proc.variable)
+        global_cell = self.global_cell(element.proc.variable)
+        tail = element.attribute[TAIL]
+        if len(args) == 1:
+            arg, = args
+
+            def primitive1(rt, frame):
+                proc = global_cell().value
+                x = arg(rt, frame)
+                if proc is builtin:
+                    return operation(x)
+                if tail:
+                    return TailCall(proc, [x])
+                return rt.call(proc, [x])
+            return primitive1
+        arg1, arg2 = args
+
+        def primitive2(rt, frame):
+            proc = global_cell().value
+            x = arg1(rt, frame)
+            y = arg2(rt, frame)
+            if proc is builtin:
+                return operation(x, y)
+            if tail:
+                return TailCall(proc, [x, y])
+            return rt.call(proc, [x, y])
+        return primitive2
+
+    def apply(self, element):
+        args = [arg.accept(self) for arg in element.args]
+        if element.attribute.get(PRIMITIVE) is not None:
+            return self.primitive(element, args)
+        proc = element.proc.accept(self)
+        if element.attribute[TAIL]:
+            def tail_call(rt, frame):
+                return TailCall(proc(rt, frame),
+                                [arg(rt, frame) for arg in args])
+            return tail_call
+
+        def call(rt, frame):
+            return rt.call(proc(rt, frame), [arg(rt, frame) for arg in args])
+        return call
+
+    def block(self, element):
+        exprs = [expr.accept(self) for expr in element.exprs]
+        if len(exprs) == 0:
+            def block(rt, frame):
+                return False
+        elif len(exprs) == 1:
+            block, = exprs
+        else:
+            init = exprs[:-1]
+            last = exprs[-1]
+
+            def block(rt, frame):
+                for expr in init:
+                    expr(rt, frame)
+                return last(rt, frame)
+        return block
+
+    def if_(self, element):
+        condition = element.condition.accept(self)
+        then_ = element.then_.accept(self)
+        else_ = element.else_.accept(self)
+
+        def if_(rt, frame):
+            if condition(rt, frame) is False:
+                return else_(rt, frame)
+            return then_(rt, frame)
+        return if_
+
+    def let(self, element):
+        if not element.variables:
+            # Top-level code has no frame when no let takes a slot.
+            return element.body.accept(self)
+        slots = [slot for _, slot in element.attribute[ADDRESS]]
+        values = [value.accept(self) for value in element.values]
+        body = element.body.accept(self)
+        bindings = list(zip(slots, values))
+        boxed = element.attribute[BOXED]
+        if any(boxed):
+            box = types.Cell
+            unassigned = types.Unassigned.instance
+            boxed_slots = [
+                slot for slot, is_boxed in zip(slots, boxed) if is_boxed]
+            if element.recursive:
+                def let_boxed(rt, frame):
+                    frame_values = frame.values
+                    for slot in boxed_slots:
+                        frame_values[slot] = box(unassigned)
+                    for (slot, value), is_boxed in zip(bindings, boxed):
+                        if is_boxed:
+                            frame_values[slot].value = value(rt, frame)
+                        else:
+                            frame_values[slot] = value(rt, frame)
+                    return body(rt, frame)
+            else:
+                def let_boxed(rt, frame):
+                    results = [value(rt, frame) for value in values]
+                    frame_values = frame.values
+                    for slot, result, is_boxed in zip(slots, results, boxed):
+                        frame_values[slot] = (
+                            box(result) if is_boxed else result)
+                    return body(rt, frame)
+            return let_boxed
+        if element.recursive:
+            def let(rt, frame):
+                for slot, value in bindings:
+                    frame.values[slot] = value(rt, frame)
+                return body(rt, frame)
+        else:
+            def let(rt, frame):
+                results = [value(rt, frame) for value in values]
+                frame_values = frame.values
+                for slot, result in zip(slots, results):
+                    frame_values[slot] = result
+                return body(rt, frame)
+        return let
+
+    def case(self, element):
+        key = element.key.accept(self)
+        table = element.table
+        default = len(element.clauses)
+        bodies = [clause.accept(self) for clause in element.clauses]
+        bodies.append(element.else_.accept(self))
+        eqv_key = base.eqv_key
+
+        def case(rt, frame):
+            index = table.get(eqv_key(key(rt, frame)), default)
+            return bodies[index](rt, frame)
+        return case
+
+    def lambda_(self, element):
+        body = element.body.accept(self)
+        boxed_slots = element.attribute[BOXED]
+        if boxed_slots:
+            unboxed_body = body
+            box = types.Cell
+
+            def boxed_body(rt, frame):
+                frame_values = frame.values
+                for slot in boxed_slots:
+                    frame_values[slot] = box(frame_values[slot])
+                return unboxed_body(rt, frame)
+            body = boxed_body
+        code = Code(
+            body,
+            BindingPlan(element.args, element.rest_args,
+                        element.attribute[FRAME_SIZE]))
+        env = self.env
+        captures = element.attribute[CAPTURES]
+        if not captures:
+            def make_procedure(rt, frame):
+                return Procedure(code, env)
+            return make_procedure
+        self_slots = [slot for slot, address in enumerate(captures)
+                      if address is None]
+        make_frame = types.Frame
+
+        def make_closure(rt, frame):
+            values = []
+            for address in captures:
+                if address is None:
+                    values.append(None)
+                elif address[0]:
+                    values.append(frame.parent.values[address[1]])
+                else:
+                    values.append(frame.values[address[1]])
+            procedure = Procedure(code, env, make_frame(values))
+            for slot in self_slots:
+                values[slot] = procedure
+            return procedure
+        return make_closure
+
+
+def compile(expr, *, env, optimize=0):
+    """Compile expr to Code.
+
+    'exprs' is a Scheme expression to compile.
+
+    Use 'env' to resolve special forms and global variables.
+    'optimize' is optimization level.
+    """
+    core_code = compile_.compile_core(expr, env=env, optimize=optimize)
+    return ClosureCompiler(env).compile(core_code)
+
+
+def eval(expr, *, env, hooks=None):
+    """Evaluate scheme expr with closure compiler.
+
+    Compile and execute Scheme expression 'expr'
+    in environment 'env'.
+    """
+    return Runtime(hooks=hooks).eval(expr, env=env)
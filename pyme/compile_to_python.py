@@ -0,0 +1,375 @@
+"""Compile hot procedures from abstract source tree to Python source.
+
+Evaluator counts calls of every Bytecode when tiering is enabled and
+translates procedure which reaches the threshold to a Python function,
+which is then called instead of interpreting the bytecode.
+
+Only procedures which never leave generated code for long are
+translated: procedure body may call builtins bound to global variables
+and call itself in tail position. Self tail calls become a 'while' loop,
+builtin calls become direct Python calls guarded by a check that the
+global variable is still bound to the same builtin. Procedures with
+nested lambdas, other closure calls or non-tail self calls are left to
+the bytecode evaluator.
+"""
+
+from pyme import base
+from pyme import core
+from pyme import types
+from pyme.core import ADDRESS, BOXED, UNASSIGNED
+from pyme.compile import primitives
+from pyme.bytecode import GlobalCache, OpCode
+from pyme.exceptions import IdentifierNotBoundError
+
+
+_primitive_templates = {
+    OpCode.ADD2_1: "{0} + {1} if type({0}) is type({1}) is int"
+                   " else _plus({0}, {1})",
+    OpCode.SUB2_1: "{0} - {1} if type({0}) is type({1}) is int"
+                   " else _minus({0}, {1})",
+    OpCode.LT2_1: "{0} < {1}",
+    OpCode.NUM_EQ2_1: "{0} == {1}",
+    OpCode.CAR_1: "{0}.car",
+    OpCode.CDR_1: "{0}.cdr",
+    OpCode.CONS_1: "_Pair({0}, {1})",
+    OpCode.NULLP_1: "{0} is _nil",
+    OpCode.PAIRP_1: "isinstance({0}, _Pair)",
+    OpCode.EQ_1: "{0} is {1}",
+}
+"""Python expressions for builtins with dedicated opcodes.
+
+Only integers are added and subtracted inline, like in the evaluator.
+"""
+
+
+class NotSupported(Exception):
+    """Procedure cannot be translated to Python."""
+
+
+def _resolve(cache, env):
+    """Get cell of global variable, refresh 'cache' if stale."""
+    cell = env.lookup(cache.variable)
+    if cell is None:
+        raise IdentifierNotBoundError(str(cache.variable))
+    cache.env = env
+    cache.version = types.Environment.version
+    cache.cell = cell
+    return cell
+
+
+class AssignedSlots(core.Walker):
+    """Collect frame slots assigned in procedure body."""
+
+    def __init__(self):
+        self.slots = set()
+
+    def set_variable(self, element):
+        address = element.attribute[ADDRESS]
+        if address is not None and address[0] == 0:
+            self.slots.add(address[1])
+        element.value.accept(self)
+
+    def define_variable(self, element):
+        self.set_variable(element)
+
+    def let(self, element):
+        for _, slot in element.attribute[ADDRESS]:
+            self.slots.add(slot)
+        super().let(element)
+
+    def lambda_(self, element):
+        pass
+
+
+class PythonCompiler(core.Visitor):
+    """Translate lambda body to source of a Python function.
+
+    'closure' is the procedure being translated, values of its
+    global and outer local variables decide which calls are
+    builtin calls and which are self calls.
+
+    Visitor methods emit statements computing element and return
+    Python expression with its value.
+    """
+
+    def __init__(self, closure):
+        self.closure = closure
+        self.lines = []
+        self.indent = 2
+        self.namespace = {
+            "_Env": types.Environment,
+            "_Pair": types.Pair,
+            "_nil": types.EmptyList.instance,
+            "_resolve": _resolve,
+            "_eqv_key": base.eqv_key,
+            "_plus": base.plus,
+            "_minus": base.minus,
+        }
+        self.num_temps = 0
+        self.loop = False
+        assigned = AssignedSlots()
+        closure.bytecode.lambda_.body.accept(assigned)
+        self.assigned = assigned.slots
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def temp(self):
+        self.num_temps += 1
+        return f"_t{self.num_temps}"
+
+    def add_name(self, prefix, value):
+        name = f"{prefix}{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def current_value(self, element):
+        """Value of variable referenced by 'element' at translation time.
+
+        Returns None for local variables of the translated procedure.
+        """
+        address = element.attribute[ADDRESS]
+        if address is None:
+            return self.closure.env.get(element.variable)
+        depth, slot = address
+        if depth == 0:
+            return None
+        value = self.closure.frame.values[slot]
+        if element.attribute[BOXED]:
+            value = value.value
+        return value
+
+    def compile_body(self, element):
+        """Emit statements of the procedure body in tail position."""
+        self.tail(element)
+
+    def tail(self, element):
+        """Emit statements returning value of 'element'."""
+        if isinstance(element, core.If):
+            condition = element.condition.accept(self)
+            self.emit(f"if {condition} is not False:")
+            self.indent += 1
+            self.tail(element.then_)
+            self.indent -= 1
+            self.emit("else:")
+            self.indent += 1
+            self.tail(element.else_)
+            self.indent -= 1
+        elif isinstance(element, core.Block) and element.exprs:
+            for expr in element.exprs[:-1]:
+                expr.accept(self)
+            self.tail(element.exprs[-1])
+        elif isinstance(element, core.Let):
+            self.bind(element)
+            self.tail(element.body)
+        elif isinstance(element, core.Case):
+            self.dispatch(element, self.tail)
+        elif isinstance(element, core.Apply) and self.is_self_call(element):
+            self.self_tail_call(element)
+        else:
+            self.emit(f"return {element.accept(self)}")
+
+    def is_self_call(self, element):
+        if not isinstance(element.proc, core.GetVariable):
+            return False
+        value = self.current_value(element.proc)
+        return (getattr(value, "bytecode", None) is self.closure.bytecode
+                and len(element.args) == len(value.bytecode.formals)
+                and not element.kwargs)
+
+    def self_tail_call(self, element):
+        proc = element.proc.accept(self)
+        args = [arg.accept(self) for arg in element.args]
+        bytecode = self.closure.bytecode
+        self.emit(f"if {proc} is _self:")
+        self.indent += 1
+        if args:
+            formals = ", ".join(f"v{i}" for i in range(len(args)))
+            self.emit(f"{formals}, = {', '.join(args)},")
+        for slot in range(len(bytecode.formals), bytecode.frame_size):
+            self.emit(f"v{slot} = None")
+        self.emit("continue")
+        self.indent -= 1
+        self.emit(f"return _evaluator.call_nested({proc}, [{', '.join(args)}])")
+        self.loop = True
+
+    def constant(self, element):
+        value = element.value
+        if value is False or value is True:
+            return repr(value)
+        return self.add_name("_c", value)
+
+    def get_variable(self, element):
+        address = element.attribute[ADDRESS]
+        if address is None:
+            cache = self.add_name("_g", GlobalCache(element.variable))
+            result = self.temp()
+            self.emit(f"if {cache}.env is _env "
+                      f"and {cache}.version == _Env.version:")
+            self.emit(f"    {result} = {cache}.cell.value")
+            self.emit("else:")
+            self.emit(f"    {result} = _resolve({cache}, _env).value")
+            return result
+        if element.attribute[UNASSIGNED]:
+            raise NotSupported("read of possibly unassigned variable")
+        depth, slot = address
+        if depth == 0 and slot not in self.assigned:
+            return f"v{slot}"
+        result = self.temp()
+        if depth == 0:
+            self.emit(f"{result} = v{slot}")
+        else:
+            self.emit(f"{result} = {self.captured(element)}")
+        return result
+
+    def captured(self, element):
+        """Expression for variable captured in closure frame."""
+        slot = element.attribute[ADDRESS][1]
+        if element.attribute[BOXED]:
+            return f"_frame.values[{slot}].value"
+        return f"_frame.values[{slot}]"
+
+    def store(self, element, value):
+        depth, slot = element.attribute[ADDRESS]
+        if depth == 0:
+            self.emit(f"v{slot} = {value}")
+        else:
+            self.emit(f"{self.captured(element)} = {value}")
+
+    def set_variable(self, element):
+        value = element.value.accept(self)
+        if element.attribute[ADDRESS] is None:
+            cache = self.add_name("_g", GlobalCache(element.variable))
+            self.emit(f"_resolve({cache}, _env).value = {value}")
+        else:
+            self.store(element, value)
+        return "False"
+
+    def define_variable(self, element):
+        if element.attribute[ADDRESS] is None:
+            raise NotSupported("global define")
+        self.store(element, element.value.accept(self))
+        return "False"
+
+    def apply(self, element):
+        if element.kwargs or not isinstance(element.proc, core.GetVariable):
+            raise NotSupported("call of computed procedure")
+        builtin = self.current_value(element.proc)
+        if (builtin is None or hasattr(builtin, "bytecode")
+                or hasattr(builtin, "with_evaluator")
+                or not callable(builtin)):
+            raise NotSupported("call of non-builtin procedure")
+        proc = element.proc.accept(self)
+        args = [arg.accept(self) for arg in element.args]
+        name = self.add_name("_b", builtin)
+        template = None
+        for primitive, num_args, opcode in primitives():
+            if primitive is builtin and num_args == len(args):
+                template = _primitive_templates[opcode]
+        if template is None:
+            call = f"{name}({', '.join(args)})"
+        else:
+            call = template.format(*args)
+        result = self.temp()
+        self.emit(f"if {proc} is {name}:")
+        self.emit(f"    {result} = {call}")
+        self.emit("else:")
+        self.emit(f"    {result} = _evaluator.call_nested("
+                  f"{proc}, [{', '.join(args)}])")
+        return result
+
+    def if_(self, element):
+        condition = element.condition.accept(self)
+        result = self.temp()
+        self.emit(f"if {condition} is not False:")
+        self.indent += 1
+        self.emit(f"{result} = {element.then_.accept(self)}")
+        self.indent -= 1
+        self.emit("else:")
+        self.indent += 1
+        self.emit(f"{result} = {element.else_.accept(self)}")
+        self.indent -= 1
+        return result
+
+    def block(self, element):
+        result = "False"
+        for expr in element.exprs:
+            result = expr.accept(self)
+        return result
+
+    def bind(self, element):
+        """Emit statements storing let values to frame slots."""
+        addresses = element.attribute[ADDRESS]
+        if element.recursive:
+            for address, value in zip(addresses, element.values):
+                self.emit(f"v{address[1]} = {value.accept(self)}")
+        else:
+            values = [value.accept(self) for value in element.values]
+            for address, value in zip(addresses, values):
+                self.emit(f"v{address[1]} = {value}")
+
+    def let(self, element):
+        self.bind(element)
+        return element.body.accept(self)
+
+    def dispatch(self, element, compile_clause):
+        """Emit selection of case clause, 'compile_clause' emits clause."""
+        key = element.key.accept(self)
+        table = self.add_name("_c", element.table)
+        index = self.temp()
+        self.emit(f"{index} = {table}.get(_eqv_key({key}), "
+                  f"{len(element.clauses)})")
+        bodies = element.clauses + [element.else_]
+        for i, body in enumerate(bodies):
+            if i == 0:
+                self.emit(f"if {index} == 0:")
+            elif i < len(bodies) - 1:
+                self.emit(f"elif {index} == {i}:")
+            else:
+                self.emit("else:")
+            self.indent += 1
+            compile_clause(body)
+            self.indent -= 1
+
+    def case(self, element):
+        result = self.temp()
+        self.dispatch(
+            element,
+            lambda body: self.emit(f"{result} = {body.accept(self)}"))
+        return result
+
+    def lambda_(self, element):
+        raise NotSupported("nested lambda")
+
+
+def compile(closure):
+    """Translate procedure of 'closure' to a Python function.
+
+    Function is called as 'function(evaluator, closure, *args)'
+    with exactly as many arguments as there are formals.
+    Returns None if the procedure cannot be translated.
+    """
+    bytecode = closure.bytecode
+    if bytecode.lambda_ is None or bytecode.formals_rest is not None:
+        return None
+    compiler = PythonCompiler(closure)
+    try:
+        compiler.compile_body(bytecode.lambda_.body)
+    except NotSupported:
+        return None
+    formals = "".join(f", v{i}" for i in range(len(bytecode.formals)))
+    lines = [f"def native(_evaluator, _self{formals}):",
+             "    _env = _self.env",
+             "    _frame = _self.frame"]
+    for slot in range(len(bytecode.formals), bytecode.frame_size):
+        lines.append(f"    v{slot} = None")
+    if compiler.loop:
+        lines.append("    while True:")
+    else:
+        compiler.lines = [line[4:] for line in compiler.lines]
+    source = "\n".join(lines + compiler.lines) + "\n"
+    namespace = compiler.namespace
+    exec(source, namespace)
+    native = namespace["native"]
+    native.source = source
+    return native
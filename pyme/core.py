@@ -102,6 +102,42 @@ class Lambda(Element):
         return visitor.lambda_(self)
 
 
+class Let(Element):
+    """Bind variables to values in slots of the current frame.
+
+    When 'recursive' is true variables are visible in values,
+    which are evaluated and bound one by one, as in letrec*.
+    """
+
+    def __init__(self, *, variables, values, body, recursive=False):
+        super().__init__()
+        self.variables = variables
+        self.values = values
+        self.body = body
+        self.recursive = recursive
+
+    def accept(self, visitor):
+        return visitor.let(self)
+
+
+class Case(Element):
+    """Select clause by value of key.
+
+    'table' maps base.eqv_key of datums to clause index.
+    'else_' is evaluated when key matches no datum.
+    """
+
+    def __init__(self, *, key, table, clauses, else_):
+        super().__init__()
+        self.key = key
+        self.table = table
+        self.clauses = clauses
+        self.else_ = else_
+
+    def accept(self, visitor):
+        return visitor.case(self)
+
+
 class Visitor(ABC):
 
     @abstractmethod
@@ -136,5 +172,154 @@ class Visitor(ABC):
     def lambda_(self, element):
         pass
 
+    @abstractmethod
+    def let(self, element):
+        pass
+
+    @abstractmethod
+    def case(self, element):
+        pass
+
+
+class Walker(Visitor):
+    """Visitor which visits all subelements.
+
+    Override methods to act on particular elements.
+    """
+
+    def constant(self, element):
+        pass
+
+    def get_variable(self, element):
+        pass
+
+    def set_variable(self, element):
+        element.value.accept(self)
+
+    def define_variable(self, element):
+        element.value.accept(self)
+
+    def apply(self, element):
+        element.proc.accept(self)
+        for arg in element.args:
+            arg.accept(self)
+        for arg in element.kwargs.values():
+            arg.accept(self)
+
+    def if_(self, element):
+        element.condition.accept(self)
+        element.then_.accept(self)
+        element.else_.accept(self)
+
+    def block(self, element):
+        for expr in element.exprs:
+            expr.accept(self)
+
+    def lambda_(self, element):
+        element.body.accept(self)
+
+    def let(self, element):
+        for value in element.values:
+            value.accept(self)
+        element.body.accept(self)
+
+    def case(self, element):
+        element.key.accept(self)
+        for clause in element.clauses:
+            clause.accept(self)
+        element.else_.accept(self)
+
+
+class Transformer(Visitor):
+    """Visitor which rebuilds tree from results of visiting elements.
+
+    Default methods replace subelements by results of visiting them
+    and return the element itself. Override methods to return
+    a different element.
+    """
+
+    def constant(self, element):
+        return element
+
+    def get_variable(self, element):
+        return element
+
+    def set_variable(self, element):
+        element.value = element.value.accept(self)
+        return element
+
+    def define_variable(self, element):
+        element.value = element.value.accept(self)
+        return element
+
+    def apply(self, element):
+        element.proc = element.proc.accept(self)
+        element.args = [arg.accept(self) for arg in element.args]
+        element.kwargs = {key: arg.accept(self)
+                          for key, arg in element.kwargs.items()}
+        return element
+
+    def if_(self, element):
+        element.condition = element.condition.accept(self)
+        element.then_ = element.then_.accept(self)
+        element.else_ = element.else_.accept(self)
+        return element
+
+    def block(self, element):
+        element.exprs = [expr.accept(self) for expr in element.exprs]
+        return element
+
+    def lambda_(self, element):
+        element.body = element.body.accept(self)
+        return element
+
+    def let(self, element):
+        element.values = [value.accept(self) for value in element.values]
+        element.body = element.body.accept(self)
+        return element
+
+    def case(self, element):
+        element.key = element.key.accept(self)
+        element.clauses = [clause.accept(self)
+                           for clause in element.clauses]
+        element.else_ = element.else_.accept(self)
+        return element
+
 
 TAIL = "tail"
+
+
+ADDRESS = "address"
+
+
+FRAME_SIZE = "frame_size"
+
+
+CAPTURES = "captures"
+
+
+BOXED = "boxed"
+
+
+LEAF = "leaf"
+
+
+TOP_FRAME_SIZE = "top_frame_size"
+
+
+PRIMITIVE = "primitive"
+
+
+SELF_CALL = "self_call"
+
+
+DIRECT = "direct"
+
+
+SELF_JUMP = "jump"
+
+
+SELF_CHECKED = "checked"
+
+
+UNASSIGNED = "unassigned"
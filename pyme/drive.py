@@ -3,6 +3,8 @@
 from pyme import core
 from pyme import base
 from pyme import interop
+from pyme import types
+from pyme.macro import SyntaxRules
 from pyme.exceptions import CompileError
 from pyme.registry import builtin
 
@@ -24,6 +26,8 @@ class RunDriver:
         proc_binding = self.env.get(proc)
         if isinstance(proc_binding, _Builtin):
             return proc_binding.compile(self, *args)
+        elif isinstance(proc_binding, SyntaxRules):
+            return self.compile_expr(proc_binding.expand(expr))
         else:
             proc = self.compile_expr(proc)
             args = [self.compile_expr(arg) for arg in args]
@@ -45,6 +49,35 @@ class RunDriver:
         exprs = [self.compile_expr(expr) for expr in exprs]
         return core.Block(exprs=exprs)
 
+    def compile_body(self, exprs):
+        """Compile lambda or let body with internal definitions.
+
+        Definitions at the start of body are scanned out to
+        a letrec* binding them in order, so they are stored
+        to frame slots like other local variables. Definition
+        after an expression or repeated name is an error, it
+        would not be scoped to the body.
+        """
+        block = self.compile_block(exprs)
+        count = 0
+        for expr in block.exprs:
+            if not isinstance(expr, core.DefineVariable):
+                break
+            count += 1
+        defines = block.exprs[:count]
+        variables = [define.variable for define in defines]
+        if len(set(variables)) != len(variables):
+            raise CompileError("define: duplicate definition in body")
+        for expr in block.exprs[count:]:
+            if isinstance(expr, core.DefineVariable):
+                raise CompileError("define: definition after expression in body")
+        if not defines:
+            return block
+        return core.Let(variables=variables,
+                        values=[define.value for define in defines],
+                        body=core.Block(exprs=block.exprs[count:]),
+                        recursive=True)
+
     def compile_if(self, condition, then_, else_):
         condition = self.compile_expr(condition)
         then_ = self.compile_expr(then_)
@@ -66,7 +99,7 @@ class RunDriver:
                 positional.append(f)
             else:
                 raise CompileError(f"syntax error in lambda arguments list: {f}")
-        body = self.compile_block(body)
+        body = self.compile_body(body)
         return core.Lambda(name=False,
                            args=positional,
                            rest_args=formals_rest,
@@ -74,6 +107,194 @@ class RunDriver:
                            rest_kwargs=None,
                            body=body)
 
+    def parse_bindings(self, form, bindings):
+        """Split let bindings list to variables and init expressions."""
+        variables = []
+        inits = []
+        for binding in interop.from_scheme_list(bindings):
+            if not base.pairp(binding):
+                raise CompileError(f"{form}: invalid binding")
+            binding = interop.from_scheme_list(binding)
+            if len(binding) != 2 or not base.symbolp(binding[0]):
+                raise CompileError(f"{form}: invalid binding")
+            variables.append(binding[0])
+            inits.append(self.compile_expr(binding[1]))
+        return variables, inits
+
+    def make_lambda(self, args, body):
+        return core.Lambda(name=False,
+                           args=args,
+                           rest_args=None,
+                           kwargs=None,
+                           rest_kwargs=None,
+                           body=body)
+
+    def compile_let(self, bindings, *body):
+        if base.symbolp(bindings):
+            if len(body) < 1:
+                raise CompileError("let: missing bindings")
+            return self.compile_named_let(bindings, *body)
+        variables, inits = self.parse_bindings("let", bindings)
+        body = self.compile_body(body)
+        return core.Let(variables=variables, values=inits, body=body)
+
+    def named_let(self, name, variables, inits, body):
+        """Build named let from compiled parts.
+
+        (let name ((var init) ...) body) is
+        ((letrec ((name (lambda (var ...) body))) name) init ...)
+        """
+        lambda_ = self.make_lambda(variables, body)
+        proc = core.Let(variables=[name],
+                        values=[lambda_],
+                        body=core.GetVariable(variable=name),
+                        recursive=True)
+        return core.Apply(proc=proc, args=inits, kwargs={})
+
+    def compile_named_let(self, name, bindings, *body):
+        variables, inits = self.parse_bindings("let", bindings)
+        return self.named_let(name, variables, inits, self.compile_body(body))
+
+    def compile_let_star(self, bindings, *body):
+        variables, inits = self.parse_bindings("let*", bindings)
+        result = self.compile_body(body)
+        if not variables:
+            return core.Let(variables=[], values=[], body=result)
+        for variable, init in reversed(list(zip(variables, inits))):
+            result = core.Let(variables=[variable], values=[init], body=result)
+        return result
+
+    def compile_letrec(self, bindings, *body):
+        variables, inits = self.parse_bindings("letrec", bindings)
+        body = self.compile_body(body)
+        return core.Let(variables=variables, values=inits, body=body,
+                        recursive=True)
+
+    def is_syntax_symbol(self, expr, name):
+        return base.symbolp(expr) and expr.name == name
+
+    def compile_cond(self, *clauses):
+        result = core.Constant(value=False)
+        for clause in reversed(clauses):
+            if not base.pairp(clause):
+                raise CompileError("cond: invalid clause")
+            test, *body = interop.from_scheme_list(clause)
+            if self.is_syntax_symbol(test, "else"):
+                result = self.compile_block(body)
+                continue
+            test = self.compile_expr(test)
+            if body and self.is_syntax_symbol(body[0], "=>"):
+                if len(body) != 2:
+                    raise CompileError("cond: invalid => clause")
+                temp = types.Symbol("cond")
+                value = core.GetVariable(variable=temp)
+                then_ = core.Apply(proc=self.compile_expr(body[1]),
+                                   args=[core.GetVariable(variable=temp)],
+                                   kwargs={})
+                result = core.Let(
+                    variables=[temp], values=[test],
+                    body=core.If(condition=value, then_=then_, else_=result))
+            elif not body:
+                result = self.or_(test, result)
+            else:
+                result = core.If(condition=test,
+                                 then_=self.compile_block(body),
+                                 else_=result)
+        return result
+
+    def compile_case(self, key, *clauses):
+        table = {}
+        bodies = []
+        else_ = core.Constant(value=False)
+        for i, clause in enumerate(clauses):
+            if not base.pairp(clause):
+                raise CompileError("case: invalid clause")
+            datums, *body = interop.from_scheme_list(clause)
+            if self.is_syntax_symbol(datums, "else"):
+                if i != len(clauses) - 1:
+                    raise CompileError("case: else clause must be last")
+                else_ = self.compile_block(body)
+                continue
+            for datum in interop.from_scheme_list(datums):
+                table.setdefault(base.eqv_key(datum), len(bodies))
+            bodies.append(self.compile_block(body))
+        return core.Case(key=self.compile_expr(key),
+                         table=table,
+                         clauses=bodies,
+                         else_=else_)
+
+    def compile_and(self, *exprs):
+        if not exprs:
+            return core.Constant(value=True)
+        result = self.compile_expr(exprs[-1])
+        for expr in reversed(exprs[:-1]):
+            result = core.If(condition=self.compile_expr(expr),
+                             then_=result,
+                             else_=core.Constant(value=False))
+        return result
+
+    def or_(self, first, rest):
+        """Build (or first rest) from compiled expressions."""
+        temp = types.Symbol("or")
+        value = core.GetVariable(variable=temp)
+        return core.Let(
+            variables=[temp], values=[first],
+            body=core.If(condition=value,
+                         then_=core.GetVariable(variable=temp),
+                         else_=rest))
+
+    def compile_or(self, *exprs):
+        if not exprs:
+            return core.Constant(value=False)
+        result = self.compile_expr(exprs[-1])
+        for expr in reversed(exprs[:-1]):
+            result = self.or_(self.compile_expr(expr), result)
+        return result
+
+    def compile_when(self, test, *body):
+        return core.If(condition=self.compile_expr(test),
+                       then_=self.compile_block(body),
+                       else_=core.Constant(value=False))
+
+    def compile_unless(self, test, *body):
+        return core.If(condition=self.compile_expr(test),
+                       then_=core.Constant(value=False),
+                       else_=self.compile_block(body))
+
+    def compile_do(self, specs, test_clause, *commands):
+        """Compile do loop to named let.
+
+        (do ((var init step) ...) (test expr ...) command ...) is
+        (let loop ((var init) ...)
+          (if test (begin expr ...) (begin command ... (loop step ...))))
+        """
+        variables = []
+        inits = []
+        steps = []
+        for spec in interop.from_scheme_list(specs):
+            if not base.pairp(spec):
+                raise CompileError("do: invalid variable specification")
+            spec = interop.from_scheme_list(spec)
+            if len(spec) not in (2, 3) or not base.symbolp(spec[0]):
+                raise CompileError("do: invalid variable specification")
+            variables.append(spec[0])
+            inits.append(self.compile_expr(spec[1]))
+            steps.append(spec[-1])
+        if not base.pairp(test_clause):
+            raise CompileError("do: invalid test clause")
+        test, *exprs = interop.from_scheme_list(test_clause)
+        loop = types.Symbol("do")
+        next_ = core.Apply(proc=core.GetVariable(variable=loop),
+                           args=[self.compile_expr(step) for step in steps],
+                           kwargs={})
+        body = core.Block(
+            exprs=[self.compile_expr(command) for command in commands]
+            + [next_])
+        body = core.If(condition=self.compile_expr(test),
+                       then_=self.compile_block(exprs),
+                       else_=body)
+        return self.named_let(loop, variables, inits, body)
+
     def compile_define_var(self, var, value):
         if not base.symbolp(var):
             raise CompileError("define: non-symbol in variable definition")
@@ -109,6 +330,37 @@ class RunDriver:
         return core.SetVariable(variable=var,
                                 value=value)
 
+    def compile_syntax_rules(self, spec):
+        if (not base.pairp(spec)
+                or not self.is_syntax_symbol(spec.car, "syntax-rules")):
+            raise CompileError("define-syntax: expected syntax-rules")
+        if not base.pairp(spec.cdr):
+            raise CompileError("syntax-rules: missing literals")
+        literals = interop.from_scheme_list(spec.cdr.car)
+        if not all(base.symbolp(literal) for literal in literals):
+            raise CompileError("syntax-rules: invalid literals")
+        rules = []
+        for rule in interop.from_scheme_list(spec.cdr.cdr):
+            rule = interop.from_scheme_list(rule)
+            if len(rule) != 2 or not base.pairp(rule[0]):
+                raise CompileError("syntax-rules: invalid rule")
+            pattern, template = rule
+            rules.append((pattern.cdr, template))
+        return SyntaxRules(literals, rules)
+
+    def compile_define_syntax(self, keyword, spec):
+        """Define macro 'keyword'.
+
+        Macro is bound at compile time, so that forms compiled
+        after the definition are expanded.
+        """
+        if not base.symbolp(keyword):
+            raise CompileError("define-syntax: non-symbol macro keyword")
+        macro = self.compile_syntax_rules(spec)
+        self.env.define(keyword, macro)
+        return core.DefineVariable(variable=keyword,
+                                   value=core.Constant(value=macro))
+
 
 class _Builtin:
 
@@ -126,3 +378,16 @@ class Builtins:
     LAMBDA = builtin("lambda")(_Builtin(RunDriver.compile_lambda))
     DEFINE = builtin("define")(_Builtin(RunDriver.compile_define))
     SET = builtin("set!")(_Builtin(RunDriver.compile_set_var))
+    LET = builtin("let")(_Builtin(RunDriver.compile_let))
+    LET_STAR = builtin("let*")(_Builtin(RunDriver.compile_let_star))
+    LETREC = builtin("letrec")(_Builtin(RunDriver.compile_letrec))
+    LETREC_STAR = builtin("letrec*")(_Builtin(RunDriver.compile_letrec))
+    COND = builtin("cond")(_Builtin(RunDriver.compile_cond))
+    CASE = builtin("case")(_Builtin(RunDriver.compile_case))
+    AND = builtin("and")(_Builtin(RunDriver.compile_and))
+    OR = builtin("or")(_Builtin(RunDriver.compile_or))
+    WHEN = builtin("when")(_Builtin(RunDriver.compile_when))
+    UNLESS = builtin("unless")(_Builtin(RunDriver.compile_unless))
+    DO = builtin("do")(_Builtin(RunDriver.compile_do))
+    DEFINE_SYNTAX = builtin("define-syntax")(
+        _Builtin(RunDriver.compile_define_syntax))
@@ -23,7 +23,7 @@ def empty_environment(interpreter):
 
 @builtin("copy-environment")
 def copy_environment(env):
-    return types.Environment(parent=env.parent, bindings=dict(env.bindings))
+    return env.copy()
 
 
 @builtin("get-environment-parent")
@@ -45,33 +45,33 @@ def set_env_parent(env, parent):
 
 @builtin("has-environment-binding?")
 def has_environment_binding(env, key):
-    return key in env.bindings
+    return env.has_binding(key)
 
 
 @builtin("get-environment-binding")
 def get_environment_binding(env, key, default=False):
-    return env.bindings.get(key, default)
+    return env.get_binding(key, default)
 
 
 @builtin("set-environment-binding!")
 def set_environment_binding(env, key, value):
-    env.bindings[key] = value
+    env.define(key, value)
     return False
 
 
 @builtin("delete-environment-binding!")
 def delete_environment_binding(env, key):
-    env.bindings.pop(key, None)
+    env.delete(key)
     return False
 
 
 @builtin("get-environment-bindings")
 def get_environment_bindings(env):
-    items = [base.cons(key, value) for key, value in env.bindings.items()]
+    items = [base.cons(key, value) for key, value in env.items()]
     return interop.scheme_list(items)
 
 
 @builtin("clear-environment-bindings!")
 def clear_environment_bindings(env):
-    env.bindings.clear()
+    env.clear()
     return False
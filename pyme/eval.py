@@ -1,19 +1,22 @@
 """Evaluate Scheme code."""
 
 import numbers
+import operator
 from abc import ABC, abstractmethod
 from collections import namedtuple
 
 from pyme import base
 from pyme import compile
+from pyme import compile_to_python
 from pyme import interop
 from pyme import types
-from pyme.bytecode import OpCode
-from pyme.exceptions import EvalError
+from pyme.bytecode import Bytecode, OpCode
+from pyme.exceptions import EvalError, IdentifierNotBoundError
 from pyme.registry import builtin
 
 
-Closure = namedtuple('Closure', ['bytecode', 'env'])
+Closure = namedtuple('Closure', ['bytecode', 'env', 'frame'],
+                     defaults=[None])
 
 
 def with_evaluator(proc):
@@ -21,54 +24,147 @@ def with_evaluator(proc):
     return proc
 
 
-def _bind_formals(bytecode, args):
-    if len(bytecode.formals) > len(args):
+def _bind_formals(binding, args, start=0):
+    """Build frame values for a call of procedure with 'binding' plan.
+
+    Arguments are 'args[start:]', 'args' is usually the operand stack
+    itself, so arguments are copied into frame only once.
+    """
+    if len(args) - start == binding.fixed_arity:
+        values = args[start:]
+        if binding.padding:
+            values += binding.padding
+        return values
+    num_args = len(args) - start
+    num_formals = binding.num_formals
+    if num_formals > num_args:
         raise EvalError("Not enough arguments in procedure call")
-    if bytecode.formals_rest is None and len(bytecode.formals) < len(args):
+    if binding.fixed_arity is not None:
         raise EvalError("Too many arguments in procedure call")
+    rest_start = start + num_formals
+    values = args[start:rest_start]
+    values.append(types.pair_list(args[rest_start:]))
+    values += binding.padding
+    return values
+
+
+_CALL_GENERIC = 0
+_CALL_LEAF = 1
+_CALL_FRAME = 2
+_CALL_EVALUATOR = 3
+_CALL_PYTHON = 4
+
+
+def _call_kind(proc, num_args):
+    """Get how to call 'proc' with 'num_args' arguments.
+
+    Closures which need arity check or rest argument
+    take the generic path of 'Evaluator.do_call'.
+    """
+    if isinstance(proc, Closure):
+        bytecode = proc.bytecode
+        if bytecode.binding.fixed_arity != num_args:
+            return _CALL_GENERIC
+        return _CALL_LEAF if bytecode.leaf else _CALL_FRAME
+    if hasattr(proc, "with_evaluator"):
+        return _CALL_EVALUATOR
+    return _CALL_PYTHON
 
-    bindings = {}
-    for i in range(len(bytecode.formals)):
-        bindings[bytecode.formals[i]] = args[i]
-    args_rest = args[len(bytecode.formals):]
-    if bytecode.formals_rest is not None:
-        bindings[bytecode.formals_rest] = interop.scheme_list(args_rest)
-    return bindings
+
+_return_bytecode = Bytecode()
+_return_bytecode.append(OpCode.RET.value)
+"""Code which returns value on top of the stack."""
 
 
 class Evaluator:
-    """Scheme code evaluator."""
-    def __init__(self, *, bytecode, env, hooks=None):
+    """Scheme code evaluator.
+
+    Evaluator can be reused as a session which runs many top-level
+    forms one after another, see 'execute' and 'eval'.
+    """
+    def __init__(self, *, bytecode=_return_bytecode, env=None, hooks=None):
         self.call_stack = []
         self.stack = []
-        self.bytecode = bytecode
-        self.env = env
-        self.ip = 0
+        self.running = False
+        self.enter(bytecode, 0, env, None)
+        self.set_hooks(hooks)
+
+    def set_hooks(self, hooks):
+        """Look up hooks and settings in 'hooks' config."""
+        self.hooks = hooks
         self.call_hook = interop.get_config(hooks, "eval.call")
+        self.tier_threshold = interop.get_config(hooks, "eval.tier")
+        self.call_stats = interop.get_config(hooks, "eval.call_stats")
+        self.optimize = interop.get_config(hooks, "compile.optimize", 0)
 
-    class Return(Exception):
+    def enter(self, bytecode, ip, env, frame, base=None):
+        """Continue execution from instruction 'ip' of 'bytecode'.
 
-        def __init__(self, value):
-            self.value = value
+        'env' is environment for global variables, 'frame' holds
+        local variables. Leaf procedure keeps local variables on the
+        stack from index 'base' and 'frame' is the closure frame.
+        """
+        self.bytecode = bytecode
+        self.opcodes, self.args = bytecode.decoded()
+        self.ip = ip
+        self.env = env
+        self.frame = frame
+        self.base = base
+
+    def save(self):
+        """Save state to return to after a call."""
+        self.call_stack.append(
+            (self.bytecode, self.ip, self.env, self.frame, self.base))
 
     def pop_proc_args(self, num):
-        if len(self.stack) < num + 1:
+        stack = self.stack
+        start = len(stack) - num
+        if start < 1:
             raise EvalError("Not enough values on stack for procedure call")
-        proc = self.stack[len(self.stack)-num-1]
-        args = self.stack[len(self.stack)-num :]
-        self.stack = self.stack[: len(self.stack)-num-1]
+        proc = stack[start - 1]
+        args = stack[start:]
+        del stack[start - 1:]
         return proc, args
 
+    def enter_closure(self, proc, values, *, tail):
+        if not tail:
+            self.save()
+        frame = types.Frame(values, proc.frame)
+        self.enter(proc.bytecode, 0, proc.env, frame)
+        if self.call_hook is not None:
+            self.call_hook(self)
+
+    def enter_leaf(self, proc, base, *, tail):
+        """Call leaf procedure, its frame is on the stack from 'base'."""
+        if not tail:
+            self.save()
+        self.enter(proc.bytecode, 0, proc.env, proc.frame, base)
+        if self.call_hook is not None:
+            self.call_hook(self)
+
+    def drop_stack_frame(self, num_values):
+        """Drop stack frame of leaf procedure before a tail call.
+
+        'num_values' values on top of the stack are kept.
+        """
+        stack = self.stack
+        stack[self.base - 1:] = stack[len(stack) - num_values:]
+        self.base = None
+
     def do_apply(self, proc, args, *, tail):
+        if tail and self.base is not None:
+            self.drop_stack_frame(0)
         if isinstance(proc, Closure):
-            bindings = _bind_formals(proc.bytecode, args)
-            if not tail:
-                self.call_stack.append((self.bytecode, self.ip, self.env))
-            self.bytecode = proc.bytecode
-            self.ip = 0
-            self.env = types.Environment(parent=proc.env, bindings=bindings)
-            if self.call_hook is not None:
-                self.call_hook(self)
+            bytecode = proc.bytecode
+            values = _bind_formals(bytecode.binding, list(args))
+            if bytecode.leaf:
+                stack = self.stack
+                stack.append(proc)
+                base = len(stack)
+                stack.extend(values)
+                self.enter_leaf(proc, base, tail=tail)
+            else:
+                self.enter_closure(proc, values, tail=tail)
         elif hasattr(proc, "with_evaluator"):
             proc(*args, evaluator=self, tail=tail)
         else:
@@ -77,116 +173,621 @@ class Evaluator:
             if tail:
                 self.do_ret()
 
+    def call_native(self, proc, start, *, tail):
+        """Call translated procedure of 'proc' with arguments from stack.
+
+        Counts calls of procedure bytecode and translates it to Python
+        when the count reaches the tiering threshold. Returns False
+        if the procedure has to be interpreted.
+        """
+        bytecode = proc.bytecode
+        native = bytecode.native
+        if native is None:
+            bytecode.calls += 1
+            if bytecode.calls != self.tier_threshold:
+                return False
+            native = bytecode.native = compile_to_python.compile(proc)
+            if native is None:
+                return False
+        stack = self.stack
+        if len(stack) - start != bytecode.binding.num_formals:
+            return False
+        result = native(self, proc, *stack[start:])
+        del stack[start - 1:]
+        stack.append(result)
+        if tail:
+            self.do_ret()
+        return True
+
+    def call_nested(self, proc, args):
+        """Call 'proc' from Python code and return the result."""
+        if not (isinstance(proc, Closure) or hasattr(proc, "with_evaluator")):
+            return proc(*args)
+        evaluator = Evaluator(env=self.env, hooks=self.hooks)
+        evaluator.do_apply(proc, args, tail=False)
+        return evaluator.run()
+
+    def do_eval(self, expr, env, *, tail):
+        bytecode = compile.compile(expr, env=env, optimize=self.optimize)
+        self.do_apply(Closure(bytecode=bytecode, env=env), [], tail=tail)
+
     def do_call(self, num_args, *, tail):
-        proc, args = self.pop_proc_args(num_args)
-        self.do_apply(proc, args, tail=tail)
+        """Call procedure with 'num_args' arguments from stack.
+
+        Procedure and arguments are on top of the stack. Closure frame
+        is filled straight from the stack and the stack is truncated in
+        place, so the call costs O(num_args) and not O(stack depth).
+        """
+        stack = self.stack
+        start = len(stack) - num_args
+        if start < 1:
+            raise EvalError("Not enough values on stack for procedure call")
+        if tail and self.base is not None:
+            self.drop_stack_frame(num_args + 1)
+            start = len(stack) - num_args
+        proc = stack[start - 1]
+        if isinstance(proc, Closure):
+            if (self.tier_threshold is not None
+                    and self.call_native(proc, start, tail=tail)):
+                return
+            bytecode = proc.bytecode
+            binding = bytecode.binding
+            if not bytecode.leaf:
+                values = _bind_formals(binding, stack, start)
+                del stack[start - 1:]
+                self.enter_closure(proc, values, tail=tail)
+                return
+            if len(stack) - start != binding.fixed_arity:
+                values = _bind_formals(binding, stack, start)
+                stack[start:] = values
+            elif binding.padding:
+                stack.extend(binding.padding)
+            self.enter_leaf(proc, start, tail=tail)
+        else:
+            proc, args = self.pop_proc_args(num_args)
+            self.do_apply(proc, args, tail=tail)
+
+    def do_cached_call(self, cache, *, tail):
+        """Call procedure from call site with inline 'cache'.
+
+        Call site remembers the procedure it called last time and
+        its kind, so a repeated call of the same procedure skips
+        the dispatch of 'do_call'. Kind of a closure call depends
+        only on its bytecode, so closures made from the same code
+        share the cache entry. With 'eval.call_stats' hook set to
+        a mutable mapping, cache hits and misses are counted in it
+        under "hits" and "misses" keys.
+        """
+        num_args = cache.num_args
+        stack = self.stack
+        start = len(stack) - num_args
+        if start < 1:
+            raise EvalError("Not enough values on stack for procedure call")
+        proc = stack[start - 1]
+        target = proc.bytecode if type(proc) is Closure else proc
+        stats = self.call_stats
+        if target is cache.target:
+            kind = cache.kind
+            if stats is not None:
+                stats["hits"] = stats.get("hits", 0) + 1
+        else:
+            kind = cache.kind = _call_kind(proc, num_args)
+            cache.target = target
+            if stats is not None:
+                stats["misses"] = stats.get("misses", 0) + 1
+        if kind == _CALL_GENERIC or self.tier_threshold is not None:
+            self.do_call(num_args, tail=tail)
+            return
+        if tail and self.base is not None:
+            self.drop_stack_frame(num_args + 1)
+            start = len(stack) - num_args
+        if kind == _CALL_LEAF:
+            padding = proc.bytecode.binding.padding
+            if padding:
+                stack.extend(padding)
+            self.enter_leaf(proc, start, tail=tail)
+            return
+        values = stack[start:]
+        del stack[start - 1:]
+        if kind == _CALL_FRAME:
+            padding = proc.bytecode.binding.padding
+            if padding:
+                values += padding
+            self.enter_closure(proc, values, tail=tail)
+        elif kind == _CALL_EVALUATOR:
+            proc(*values, evaluator=self, tail=tail)
+        else:
+            stack.append(proc(*values))
+            if tail:
+                self.do_ret()
+
+    def do_direct_call(self, lambda_, cache, *, tail):
+        """Call procedure known at compile time to be made from 'lambda_'.
+
+        Compiler checked that the call passes as many arguments as
+        the lambda takes, so the frame is built without checking arity.
+        Calls of other procedures, or with tiering enabled, go through
+        'do_cached_call' with call site 'cache'.
+        """
+        stack = self.stack
+        num_args = cache.num_args
+        start = len(stack) - num_args
+        proc = stack[start - 1]
+        if (type(proc) is not Closure or proc.bytecode.lambda_ is not lambda_
+                or self.tier_threshold is not None):
+            self.do_cached_call(cache, tail=tail)
+            return
+        if tail and self.base is not None:
+            self.drop_stack_frame(num_args + 1)
+            start = len(stack) - num_args
+        bytecode = proc.bytecode
+        padding = bytecode.binding.padding
+        if bytecode.leaf:
+            if padding:
+                stack.extend(padding)
+            self.enter_leaf(proc, start, tail=tail)
+        else:
+            values = stack[start:]
+            if padding:
+                values += padding
+            del stack[start - 1:]
+            self.enter_closure(proc, values, tail=tail)
 
     def do_ret(self):
+        base = self.base
+        if base is not None:
+            stack = self.stack
+            stack[base - 1:] = stack[-1:]
         if self.call_stack:
-            self.bytecode, self.ip, self.env = self.call_stack.pop()
+            self.enter(*self.call_stack.pop())
         else:
             assert len(self.stack) == 1
-            raise self.Return(self.stack[0])
+            self.ip = None
 
-    def step(self):
-        instr = self.bytecode.code[self.ip]
-        self.ip += 1
-        if instr == OpCode.CONST_1.value:
-            index = self.bytecode.code[self.ip]
-            self.ip += 1
-            self.stack.append(self.bytecode.constants[index])
-        elif instr == OpCode.CONST_3.value:
-            index = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                   byteorder='big')
-            self.ip += 3
-            self.stack.append(self.bytecode.constants[index])
-        elif instr == OpCode.READ_VAR_1.value:
-            index = self.bytecode.code[self.ip]
-            self.ip += 1
-            self.stack.append(self.env[self.bytecode.variables[index]])
-        elif instr == OpCode.READ_VAR_3.value:
-            index = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                   byteorder='big')
-            self.ip += 3
-            self.stack.append(self.env[self.bytecode.variables[index]])
-        elif instr == OpCode.RET.value:
-            self.do_ret()
-        elif instr == OpCode.DROP.value:
-            self.stack.pop()
-        elif instr == OpCode.CALL_1.value:
-            num_args = self.bytecode.code[self.ip]
-            self.ip += 1
-            self.do_call(num_args, tail=False)
-        elif instr == OpCode.CALL_3.value:
-            num_args = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                      byteorder='big')
-            self.ip += 3
-            self.do_call(num_args, tail=False)
-        elif instr == OpCode.TAIL_CALL_1.value:
-            num_args = self.bytecode.code[self.ip]
+    def op_const(self, value):
+        self.stack.append(value)
+
+    def resolve_global(self, cache):
+        """Get cell of global variable, refresh 'cache' if stale."""
+        env = self.env
+        if cache.env is env and cache.version == types.Environment.version:
+            return cache.cell
+        cell = env.lookup(cache.variable)
+        if cell is None:
+            raise IdentifierNotBoundError(str(cache.variable))
+        cache.env = env
+        cache.version = types.Environment.version
+        cache.cell = cell
+        return cell
+
+    def op_read_var(self, cache):
+        self.stack.append(self.resolve_global(cache).value)
+
+    def op_read_local(self, address):
+        depth, slot = address
+        frame = self.frame
+        while depth:
+            frame = frame.parent
+            depth -= 1
+        self.stack.append(frame.values[slot])
+
+    def op_set_local(self, address):
+        depth, slot = address
+        frame = self.frame
+        while depth:
+            frame = frame.parent
+            depth -= 1
+        frame.values[slot] = self.stack.pop()
+
+    def op_read_stack(self, slot):
+        stack = self.stack
+        stack.append(stack[self.base + slot])
+
+    def op_set_stack(self, slot):
+        stack = self.stack
+        value = stack.pop()
+        stack[self.base + slot] = value
+
+    def op_read_free(self, slot):
+        self.stack.append(self.frame.values[slot])
+
+    def op_read_free_boxed(self, slot):
+        self.stack.append(self.frame.values[slot].value)
+
+    def op_set_free_boxed(self, slot):
+        self.frame.values[slot].value = self.stack.pop()
+
+    def op_read_boxed(self, address):
+        depth, slot = address
+        frame = self.frame
+        if depth:
+            frame = frame.parent
+        self.stack.append(frame.values[slot].value)
+
+    def op_set_boxed(self, address):
+        depth, slot = address
+        frame = self.frame
+        if depth:
+            frame = frame.parent
+        frame.values[slot].value = self.stack.pop()
+
+    def op_box_local(self, address):
+        values = self.frame.values
+        slot = address[1]
+        values[slot] = types.Cell(values[slot])
+
+    def op_check_assigned(self, variable):
+        if self.stack[-1] is types.Unassigned.instance:
+            raise IdentifierNotBoundError(str(variable))
+
+    def op_const_ret(self, value):
+        self.stack.append(value)
+        self.do_ret()
+
+    def op_read_var_call(self, arg):
+        cache, call_cache = arg
+        self.stack.append(self.resolve_global(cache).value)
+        self.do_cached_call(call_cache, tail=False)
+
+    def op_read_var_tail_call(self, arg):
+        cache, call_cache = arg
+        self.stack.append(self.resolve_global(cache).value)
+        self.do_cached_call(call_cache, tail=True)
+
+    def op_read_local_call(self, arg):
+        address, call_cache = arg
+        self.op_read_local(address)
+        self.do_cached_call(call_cache, tail=False)
+
+    def op_read_local_tail_call(self, arg):
+        address, call_cache = arg
+        self.op_read_local(address)
+        self.do_cached_call(call_cache, tail=True)
+
+    def op_read_stack_call(self, arg):
+        slot, call_cache = arg
+        self.op_read_stack(slot)
+        self.do_cached_call(call_cache, tail=False)
+
+    def op_read_stack_tail_call(self, arg):
+        slot, call_cache = arg
+        self.op_read_stack(slot)
+        self.do_cached_call(call_cache, tail=True)
+
+    def op_call_branch(self, cache):
+        """Call procedure, the next instruction is JUMP_IF_NOT.
+
+        Plain Python procedures return immediately, so the branch is
+        taken here once the call site cache knows the procedure.
+        Closures return to the JUMP_IF_NOT instruction.
+        """
+        stack = self.stack
+        num_args = cache.num_args
+        start = len(stack) - num_args
+        if start < 1:
+            raise EvalError("Not enough values on stack for procedure call")
+        proc = stack[start - 1]
+        if proc is not cache.target or cache.kind != _CALL_PYTHON:
+            self.do_cached_call(cache, tail=False)
+            return
+        stats = self.call_stats
+        if stats is not None:
+            stats["hits"] = stats.get("hits", 0) + 1
+        result = proc(*stack[start:])
+        del stack[start - 1:]
+        if base.is_false(result):
+            self.ip = self.args[self.ip]
+        else:
             self.ip += 1
+
+    def call_rebound(self, cache, num_args):
+        """Call procedure of primitive opcode whose binding has changed."""
+        stack = self.stack
+        stack.insert(len(stack) - num_args, cache.cell.value)
+        self.do_call(num_args, tail=False)
+
+    def op_add2(self, cache):
+        """Call of '+' with two arguments.
+
+        Integers are added inline, other arguments are passed
+        to the builtin, which rejects non-numbers.
+        """
+        stack = self.stack
+        if self.resolve_global(cache).value is base.plus:
+            y = stack.pop()
+            x = stack[-1]
+            if type(x) is type(y) is int:
+                stack[-1] = x + y
+            else:
+                stack[-1] = base.plus(x, y)
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_sub2(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.minus:
+            y = stack.pop()
+            x = stack[-1]
+            if type(x) is type(y) is int:
+                stack[-1] = x - y
+            else:
+                stack[-1] = base.minus(x, y)
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_lt2(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.lt:
+            y = stack.pop()
+            stack[-1] = stack[-1] < y
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_num_eq2(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.arithmetic_eq:
+            y = stack.pop()
+            stack[-1] = stack[-1] == y
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_car(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.car:
+            stack[-1] = stack[-1].car
+        else:
+            self.call_rebound(cache, 1)
+
+    def op_cdr(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.cdr:
+            stack[-1] = stack[-1].cdr
+        else:
+            self.call_rebound(cache, 1)
+
+    def op_cons(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.cons:
+            y = stack.pop()
+            stack[-1] = types.Pair(stack[-1], y)
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_nullp(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.nullp:
+            stack[-1] = stack[-1] is types.EmptyList.instance
+        else:
+            self.call_rebound(cache, 1)
+
+    def op_pairp(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is base.pairp:
+            stack[-1] = isinstance(stack[-1], types.Pair)
+        else:
+            self.call_rebound(cache, 1)
+
+    def op_eq(self, cache):
+        stack = self.stack
+        if self.resolve_global(cache).value is operator.is_:
+            y = stack.pop()
+            stack[-1] = stack[-1] is y
+        else:
+            self.call_rebound(cache, 2)
+
+    def op_ret(self, arg):
+        self.do_ret()
+
+    def op_drop(self, arg):
+        self.stack.pop()
+
+    def op_call(self, cache):
+        self.do_cached_call(cache, tail=False)
+
+    def op_tail_call(self, cache):
+        self.do_cached_call(cache, tail=True)
+
+    def op_self_tail_call(self, num_args):
+        """Tail call, reuse the frame if procedure calls itself.
+
+        Compiler emits this opcode only for procedures without nested
+        lambdas, which are leaf procedures with frame on the stack.
+        With tiering enabled the call goes through 'do_call', so it
+        is counted.
+        """
+        stack = self.stack
+        start = len(stack) - num_args
+        proc = stack[start - 1]
+        if (self.tier_threshold is None
+                and type(proc) is Closure and proc.bytecode is self.bytecode
+                and proc.frame is self.frame and proc.env is self.env):
+            base = self.base
+            stack[base:base + num_args] = stack[start:]
+            del stack[base + self.bytecode.frame_size:]
+            self.ip = 0
+        else:
             self.do_call(num_args, tail=True)
-        elif instr == OpCode.TAIL_CALL_3.value:
-            num_args = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                      byteorder='big')
-            self.ip += 3
-            self.do_call(num_args, tail=True)
-        elif instr == OpCode.JUMP_IF_NOT_3.value:
-            new_pos = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                     byteorder='big')
-            self.ip += 3
-            condition = self.stack.pop()
-            if base.is_false(condition):
-                self.ip = new_pos
-        elif instr == OpCode.JUMP_3.value:
-            new_pos = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                     byteorder='big')
-            self.ip = new_pos
-        elif instr == OpCode.DEFINE_1.value:
-            index = self.bytecode.code[self.ip]
-            self.ip += 1
-            value = self.stack.pop()
-            self.env.define(self.bytecode.variables[index], value)
-        elif instr == OpCode.DEFINE_3.value:
-            index = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                   byteorder='big')
-            self.ip += 3
-            value = self.stack.pop()
-            self.env.define(self.bytecode.variables[index], value)
-        elif instr == OpCode.SET_VAR_1.value:
-            index = self.bytecode.code[self.ip]
-            self.ip += 1
-            value = self.stack.pop()
-            self.env.set_(self.bytecode.variables[index], value)
-        elif instr == OpCode.SET_VAR_3.value:
-            index = int.from_bytes(self.bytecode.code[self.ip : self.ip+3],
-                                   byteorder='big')
-            self.ip += 3
-            value = self.stack.pop()
-            self.env.set_(self.bytecode.variables[index], value)
-        elif instr == OpCode.PUSH_FALSE.value:
-            self.stack.append(False)
-        elif instr == OpCode.MAKE_CLOSURE.value:
-            bytecode_const = self.stack.pop()
-            closure = Closure(bytecode_const, env=self.env)
-            self.stack.append(closure)
-        else:
-            raise EvalError("Unknown bytecode: 0x{:02x}".format(instr))
+
+    def op_direct_call(self, arg):
+        lambda_, cache = arg
+        self.do_direct_call(lambda_, cache, tail=False)
+
+    def op_direct_tail_call(self, arg):
+        lambda_, cache = arg
+        self.do_direct_call(lambda_, cache, tail=True)
+
+    def op_jump_if_not(self, new_ip):
+        condition = self.stack.pop()
+        if base.is_false(condition):
+            self.ip = new_ip
+
+    def op_case(self, table):
+        """Skip to JUMP instruction of clause selected by key."""
+        indexes, default = table
+        key = base.eqv_key(self.stack.pop())
+        self.ip += indexes.get(key, default)
+
+    def op_jump(self, new_ip):
+        self.ip = new_ip
+
+    def op_define(self, variable):
+        value = self.stack.pop()
+        self.env.define(variable, value)
+
+    def op_set_var(self, cache):
+        value = self.stack.pop()
+        self.resolve_global(cache).value = value
+
+    def op_push_false(self, arg):
+        self.stack.append(False)
+
+    def op_make_closure(self, arg):
+        """Create flat closure with copies of captured variables."""
+        bytecode_const = self.stack.pop()
+        captures = bytecode_const.captures
+        if not captures:
+            self.stack.append(Closure(bytecode_const, self.env, None))
+            return
+        frame = self.frame
+        values = []
+        for address in captures:
+            if address is None:
+                values.append(None)
+            elif address[0]:
+                values.append(frame.parent.values[address[1]])
+            else:
+                values.append(frame.values[address[1]])
+        closure = Closure(bytecode_const, self.env, types.Frame(values))
+        for slot, address in enumerate(captures):
+            if address is None:
+                values[slot] = closure
+        self.stack.append(closure)
+
+    def op_unknown(self, arg):
+        instr = self.opcodes[self.ip - 1]
+        raise EvalError("Unknown bytecode: 0x{:02x}".format(instr))
+
+    def step(self):
+        ip = self.ip
+        self.ip = ip + 1
+        self.handlers[self.opcodes[ip]](self, self.args[ip])
 
     def run(self):
+        """Run until top-level code returns, return its value."""
+        handlers = self.handlers
+        self.running = True
         try:
-            while True:
-                self.step()
-        except self.Return as e:
-            return e.value
+            ip = self.ip
+            while ip is not None:
+                self.ip = ip + 1
+                handlers[self.opcodes[ip]](self, self.args[ip])
+                ip = self.ip
+        finally:
+            self.running = False
+        return self.stack.pop()
+
+    def execute(self, bytecode, env):
+        """Run top-level 'bytecode' in environment 'env'.
+
+        State left by previous evaluation, which may have been
+        interrupted by an exception, is discarded.
+        """
+        self.call_stack.clear()
+        self.stack.clear()
+        frame = None
+        if bytecode.frame_size:
+            frame = types.Frame(list(bytecode.binding.padding))
+        self.enter(bytecode, 0, env, frame)
+        return self.run()
+
+    def eval(self, expr, *, env):
+        """Compile and execute Scheme expression 'expr' in 'env'."""
+        bytecode = compile.compile(expr, env=env, optimize=self.optimize)
+        return self.execute(bytecode, env)
+
+
+def _dispatch_table(handlers):
+    """Build opcode-indexed handler table.
+
+    Opcodes without a handler dispatch to 'Evaluator.op_unknown'.
+    """
+    table = [Evaluator.op_unknown] * 256
+    for opcode, handler in handlers.items():
+        table[opcode.value] = handler
+    return tuple(table)
+
+
+Evaluator.handlers = _dispatch_table({
+    OpCode.CONST_1: Evaluator.op_const,
+    OpCode.CONST_3: Evaluator.op_const,
+    OpCode.READ_VAR_1: Evaluator.op_read_var,
+    OpCode.READ_VAR_3: Evaluator.op_read_var,
+    OpCode.RET: Evaluator.op_ret,
+    OpCode.DROP: Evaluator.op_drop,
+    OpCode.CALL_1: Evaluator.op_call,
+    OpCode.CALL_3: Evaluator.op_call,
+    OpCode.TAIL_CALL_1: Evaluator.op_tail_call,
+    OpCode.TAIL_CALL_3: Evaluator.op_tail_call,
+    OpCode.JUMP_IF_NOT_3: Evaluator.op_jump_if_not,
+    OpCode.JUMP_3: Evaluator.op_jump,
+    OpCode.DEFINE_1: Evaluator.op_define,
+    OpCode.DEFINE_3: Evaluator.op_define,
+    OpCode.SET_VAR_1: Evaluator.op_set_var,
+    OpCode.SET_VAR_3: Evaluator.op_set_var,
+    OpCode.PUSH_FALSE: Evaluator.op_push_false,
+    OpCode.MAKE_CLOSURE: Evaluator.op_make_closure,
+    OpCode.READ_LOCAL_1: Evaluator.op_read_local,
+    OpCode.READ_LOCAL_3: Evaluator.op_read_local,
+    OpCode.SET_LOCAL_1: Evaluator.op_set_local,
+    OpCode.SET_LOCAL_3: Evaluator.op_set_local,
+    OpCode.READ_BOXED_1: Evaluator.op_read_boxed,
+    OpCode.READ_BOXED_3: Evaluator.op_read_boxed,
+    OpCode.SET_BOXED_1: Evaluator.op_set_boxed,
+    OpCode.SET_BOXED_3: Evaluator.op_set_boxed,
+    OpCode.BOX_LOCAL_1: Evaluator.op_box_local,
+    OpCode.BOX_LOCAL_3: Evaluator.op_box_local,
+    OpCode.CHECK_ASSIGNED_1: Evaluator.op_check_assigned,
+    OpCode.CHECK_ASSIGNED_3: Evaluator.op_check_assigned,
+    OpCode.READ_STACK_CALL_1: Evaluator.op_read_stack_call,
+    OpCode.READ_STACK_TAIL_CALL_1: Evaluator.op_read_stack_tail_call,
+    OpCode.READ_STACK_1: Evaluator.op_read_stack,
+    OpCode.READ_STACK_3: Evaluator.op_read_stack,
+    OpCode.SET_STACK_1: Evaluator.op_set_stack,
+    OpCode.SET_STACK_3: Evaluator.op_set_stack,
+    OpCode.READ_FREE_1: Evaluator.op_read_free,
+    OpCode.READ_FREE_3: Evaluator.op_read_free,
+    OpCode.READ_FREE_BOXED_1: Evaluator.op_read_free_boxed,
+    OpCode.READ_FREE_BOXED_3: Evaluator.op_read_free_boxed,
+    OpCode.SET_FREE_BOXED_1: Evaluator.op_set_free_boxed,
+    OpCode.SET_FREE_BOXED_3: Evaluator.op_set_free_boxed,
+    OpCode.CONST_RET_1: Evaluator.op_const_ret,
+    OpCode.READ_VAR_CALL_1: Evaluator.op_read_var_call,
+    OpCode.READ_VAR_TAIL_CALL_1: Evaluator.op_read_var_tail_call,
+    OpCode.READ_LOCAL_CALL_1: Evaluator.op_read_local_call,
+    OpCode.READ_LOCAL_TAIL_CALL_1: Evaluator.op_read_local_tail_call,
+    OpCode.CALL_BRANCH_1: Evaluator.op_call_branch,
+    OpCode.ADD2_1: Evaluator.op_add2,
+    OpCode.SUB2_1: Evaluator.op_sub2,
+    OpCode.LT2_1: Evaluator.op_lt2,
+    OpCode.NUM_EQ2_1: Evaluator.op_num_eq2,
+    OpCode.CAR_1: Evaluator.op_car,
+    OpCode.CDR_1: Evaluator.op_cdr,
+    OpCode.CONS_1: Evaluator.op_cons,
+    OpCode.NULLP_1: Evaluator.op_nullp,
+    OpCode.PAIRP_1: Evaluator.op_pairp,
+    OpCode.EQ_1: Evaluator.op_eq,
+    OpCode.SELF_TAIL_CALL_1: Evaluator.op_self_tail_call,
+    OpCode.DIRECT_CALL_1: Evaluator.op_direct_call,
+    OpCode.DIRECT_TAIL_CALL_1: Evaluator.op_direct_tail_call,
+    OpCode.CASE_1: Evaluator.op_case,
+    OpCode.CASE_3: Evaluator.op_case,
+})
 
 
 @with_evaluator
 @builtin("eval")
 def scheme_eval(expr, env, *, evaluator, tail):
-    bytecode = compile.compile(expr, env=env)
-    closure = Closure(bytecode=bytecode, env=env)
-    evaluator.do_apply(closure, [], tail=tail)
+    evaluator.do_eval(expr, env, tail=tail)
 
 
 @with_evaluator
@@ -206,6 +807,4 @@ def eval(expr, *, env, hooks=None):
     Compile and execute Scheme expression 'expr'
     in environment 'env'.
     """
-    bytecode = compile.compile(expr, env=env)
-    evaluator = Evaluator(bytecode=bytecode, env=env, hooks=hooks)
-    return evaluator.run()
+    return Evaluator(hooks=hooks).eval(expr, env=env)
@@ -9,10 +9,7 @@ from pyme import write
 
 
 def scheme_list(list_):
-    result = base.null()
-    for item in reversed(list_):
-        result = base.cons(item, result)
-    return result
+    return types.pair_list(list_)
 
 
 def from_scheme_list(list_):
@@ -61,7 +58,7 @@ def str_bindings_to_env(str_bindings, *, symbol_table, parent=None):
 def env_to_str_bindings(env):
     result = {}
     while env:
-        for symbol, value in env.bindings.items():
+        for symbol, value in env.items():
             name = symbol.name
             if name not in result:
                 result[name] = value
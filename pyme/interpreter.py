@@ -6,6 +6,7 @@ import sys
 
 from pyme import base
 from pyme import bytevector
+from pyme import compile_to_closure
 from pyme import env
 from pyme import eval
 from pyme import exceptions
@@ -20,9 +21,28 @@ from pyme import types
 from pyme import write
 
 
+backends = {
+    "bytecode": eval.Evaluator,
+    "closure": compile_to_closure.Runtime,
+}
+"""Evaluator session classes by backend name."""
+
+
 class Interpreter:
+    """Scheme interpreter with its global environment and ports.
+
+    'backend' is a key of 'backends'. 'optimize' is optimization level
+    of compiled code, see 'optimize.passes'. Levels 1 and 2 fold calls
+    of pure builtins like '+' with constant arguments at compile time,
+    so code compiled before a builtin's name is defined or assigned
+    keeps the builtin's result. Code compiled after it calls the new
+    value.
+    """
 
-    def __init__(self):
+    def __init__(self, *, backend="bytecode", optimize=0):
+        if backend not in backends:
+            raise ValueError(f"Unknown backend: {backend}")
+        self.backend = backend
         self.symbol_table = types.symbol_table()
         self.keyword_table = types.keyword_table()
         self.global_env = interop.str_bindings_to_env(
@@ -33,9 +53,15 @@ class Interpreter:
         self.stderr = ports.TextStreamPort.from_stream(sys.stderr)
         self.hooks = {
             "eval": {
-                "call": None
-            }
+                "call": None,
+                "tier": None,
+                "call_stats": None,
+            },
+            "compile": {
+                "optimize": optimize,
+            },
         }
+        self.session = backends[backend](hooks=self.hooks)
 
     @property
     def _default_builtins_dict(self):
@@ -59,13 +85,17 @@ class Interpreter:
             keyword_table=self.keyword_table)
         if env is None:
             env = self.global_env
+        session = self.session
+        if session.running:
+            # Nested evaluation, e.g. 'load' called from Scheme code.
+            session = backends[self.backend]()
+        session.set_hooks(self.hooks)
         result = False
         while True:
             expr = stream_reader.read(in_stream)
             if base.eofp(expr):
                 return result
-            result = eval.eval(expr, env=env,
-                               hooks=self.hooks)
+            result = session.eval(expr, env=env)
 
     def eval_str(self, string, env=None):
         in_port = io.StringIO(string)
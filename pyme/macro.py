@@ -0,0 +1,159 @@
+"""Compile-time expansion of syntax-rules macros."""
+
+import weakref
+
+from pyme import base
+from pyme import interop
+from pyme.exceptions import CompileError
+
+
+def _is_named(expr, name):
+    return base.symbolp(expr) and expr.name == name
+
+
+def _is_ellipsis(expr):
+    return _is_named(expr, "...")
+
+
+class SyntaxRules:
+    """Macro defined by 'syntax-rules'.
+
+    'literals' are symbols matched literally, 'rules' is a list
+    of (pattern, template) pairs tried in order. Patterns and
+    templates are Scheme lists without the macro keyword.
+
+    Expansions are cached by identity of the expanded form, so
+    the same source datum evaluated again is not expanded again.
+    Expansion is not hygienic.
+    """
+
+    def __init__(self, literals, rules):
+        self.literals = set(literals)
+        self.rules = rules
+        self.expansions = weakref.WeakKeyDictionary()
+
+    def expand(self, form):
+        """Expand macro use 'form' to a new Scheme expression."""
+        result = self.expansions.get(form)
+        if result is None:
+            result = self.transcribe(form)
+            self.expansions[form] = result
+        return result
+
+    def transcribe(self, form):
+        for pattern, template in self.rules:
+            bindings = {}
+            if self.match(pattern, form.cdr, bindings):
+                return self.substitute(template, bindings)
+        raise CompileError(
+            f"{form.car.name}: no syntax rule matches the form")
+
+    def match(self, pattern, form, bindings):
+        """Match 'form' against 'pattern' and store pattern variables.
+
+        Variables under an ellipsis are bound to a Python list
+        of matches.
+        """
+        if base.symbolp(pattern):
+            if pattern in self.literals:
+                return form is pattern
+            if pattern.name != "_":
+                bindings[pattern] = form
+            return True
+        if base.pairp(pattern):
+            if not base.pairp(form) and not base.nullp(form):
+                return False
+            patterns = interop.from_scheme_list(pattern)
+            forms = interop.from_scheme_list(form)
+            return self.match_list(patterns, forms, bindings)
+        if base.nullp(pattern):
+            return base.nullp(form)
+        return (not base.pairp(form) and not base.nullp(form)
+                and base.eqv_key(form) == base.eqv_key(pattern))
+
+    def match_list(self, patterns, forms, bindings):
+        for i, pattern in enumerate(patterns):
+            if i + 1 < len(patterns) and _is_ellipsis(patterns[i + 1]):
+                tail = patterns[i + 2:]
+                count = len(forms) - i - len(tail)
+                if count < 0:
+                    return False
+                matches = []
+                for form in forms[i:i + count]:
+                    match = {}
+                    if not self.match(pattern, form, match):
+                        return False
+                    matches.append(match)
+                for variable in self.pattern_variables(pattern):
+                    bindings[variable] = [match[variable]
+                                          for match in matches]
+                return self.match_list(tail, forms[i + count:], bindings)
+            if i >= len(forms) or not self.match(pattern, forms[i],
+                                                 bindings):
+                return False
+        return len(forms) == len(patterns)
+
+    def pattern_variables(self, pattern):
+        if base.symbolp(pattern):
+            if (pattern in self.literals or pattern.name == "_"
+                    or _is_ellipsis(pattern)):
+                return []
+            return [pattern]
+        result = []
+        for item in interop.from_scheme_list(pattern):
+            result.extend(self.pattern_variables(item))
+        return result
+
+    def substitute(self, template, bindings):
+        if base.symbolp(template):
+            value = bindings.get(template, template)
+            if isinstance(value, list):
+                raise CompileError(
+                    f"syntax-rules: {template.name} used without ellipsis")
+            return value
+        if not base.pairp(template):
+            return template
+        items = interop.from_scheme_list(template)
+        result = []
+        i = 0
+        while i < len(items):
+            item = items[i]
+            depth = 0
+            while i + 1 < len(items) and _is_ellipsis(items[i + 1]):
+                depth += 1
+                i += 1
+            result.extend(self.substitute_sequence(item, bindings, depth))
+            i += 1
+        return interop.scheme_list(result)
+
+    def substitute_sequence(self, template, bindings, depth):
+        """Expand 'template' followed by 'depth' ellipses to a list."""
+        if depth == 0:
+            return [self.substitute(template, bindings)]
+        variables = [variable
+                     for variable in self.template_variables(template)
+                     if isinstance(bindings.get(variable), list)]
+        if not variables:
+            raise CompileError(
+                "syntax-rules: no pattern variable before ellipsis")
+        lengths = {len(bindings[variable]) for variable in variables}
+        if len(lengths) != 1:
+            raise CompileError(
+                "syntax-rules: pattern variables of different lengths "
+                "under ellipsis")
+        result = []
+        for i in range(lengths.pop()):
+            iteration = dict(bindings)
+            for variable in variables:
+                iteration[variable] = bindings[variable][i]
+            result.extend(
+                self.substitute_sequence(template, iteration, depth - 1))
+        return result
+
+    def template_variables(self, template):
+        if base.symbolp(template):
+            return [template]
+        result = []
+        for item in interop.from_scheme_list(template):
+            result.extend(self.template_variables(item))
+        return result
@@ -0,0 +1,225 @@
+"""Optimizing passes over core elements.
+
+Passes run on the tree built by RunDriver, before analysis passes
+set attributes. Each pass is a core.Transformer which returns
+the optimized element.
+
+Optimizations assume that pure builtins bound to global variables
+at compile time are not rebound before the code runs.
+"""
+
+import operator
+
+from pyme import base
+from pyme import core
+
+
+def pure_builtins():
+    """Get builtins which can be called at compile time.
+
+    These have no side effects and return values which
+    may be shared between evaluations.
+    """
+    return {
+        base.plus, base.minus, base.multiply, base.divide,
+        base.lt, base.gt, base.le, base.ge, base.arithmetic_eq,
+        base.is_false, base.car, base.cdr, base.pairp, base.nullp,
+        base.listp, base.symbolp, base.keywordp, base.numberp,
+        base.stringp, base.booleanp, operator.is_,
+    }
+
+
+class DefinedVariables(core.Walker):
+    """Collect variables which are defined or assigned anywhere."""
+
+    def __init__(self):
+        self.variables = set()
+
+    def set_variable(self, element):
+        self.variables.add(element.variable)
+        super().set_variable(element)
+
+    def define_variable(self, element):
+        self.variables.add(element.variable)
+        super().define_variable(element)
+
+
+class HasDefine(core.Walker):
+    """Check if element defines a variable outside nested lambdas."""
+
+    def __init__(self):
+        self.found = False
+
+    def define_variable(self, element):
+        self.found = True
+
+    def lambda_(self, element):
+        pass
+
+
+class ScopedTransformer(core.Transformer):
+    """Transformer which tracks local variables in scope."""
+
+    def __init__(self):
+        self.scopes = []
+
+    def is_local(self, variable):
+        return any(variable in scope for scope in self.scopes)
+
+    def lambda_(self, element):
+        scope = set(element.args)
+        if element.rest_args is not None:
+            scope.add(element.rest_args)
+        body = element.body
+        if isinstance(body, core.Block):
+            for expr in body.exprs:
+                if isinstance(expr, core.DefineVariable):
+                    scope.add(expr.variable)
+        self.scopes.append(scope)
+        try:
+            return super().lambda_(element)
+        finally:
+            self.scopes.pop()
+
+    def let(self, element):
+        scope = set(element.variables)
+        if element.recursive:
+            self.scopes.append(scope)
+            try:
+                return super().let(element)
+            finally:
+                self.scopes.pop()
+        element.values = [value.accept(self) for value in element.values]
+        self.scopes.append(scope)
+        try:
+            element.body = element.body.accept(self)
+        finally:
+            self.scopes.pop()
+        return element
+
+
+class ConstantFolding(ScopedTransformer):
+    """Replace calls of pure builtins with constant arguments by result.
+
+    Calls which raise an exception are left to fail at run time.
+    """
+
+    def __init__(self, env, assigned):
+        super().__init__()
+        self.env = env
+        self.assigned = assigned
+        self.pure = pure_builtins()
+
+    def builtin(self, proc):
+        """Get pure builtin called by 'proc' or None."""
+        if (not isinstance(proc, core.GetVariable)
+                or proc.variable in self.assigned
+                or self.is_local(proc.variable)):
+            return None
+        value = self.env.get(proc.variable)
+        try:
+            if value in self.pure:
+                return value
+        except TypeError:
+            pass
+        return None
+
+    def apply(self, element):
+        element = super().apply(element)
+        builtin = self.builtin(element.proc)
+        if (builtin is None or element.kwargs
+                or not all(isinstance(arg, core.Constant)
+                           for arg in element.args)):
+            return element
+        try:
+            value = builtin(*(arg.value for arg in element.args))
+        except Exception:
+            return element
+        return core.Constant(value=value)
+
+
+class DeadBranches(core.Transformer):
+    """Replace 'If' with constant condition by the taken branch."""
+
+    def if_(self, element):
+        element = super().if_(element)
+        if not isinstance(element.condition, core.Constant):
+            return element
+        if element.condition.value is False:
+            return element.else_
+        return element.then_
+
+
+class InlineLambdas(core.Transformer):
+    """Bind arguments of immediately applied lambda with 'Let'.
+
+    ((lambda (a b) body) x y) becomes (let ((a x) (b y)) body),
+    so no closure is created and no call is made. Lambdas whose body
+    defines a variable are left alone, the definition belongs to
+    lambda frame and would become global outside of it.
+    """
+
+    def apply(self, element):
+        element = super().apply(element)
+        proc = element.proc
+        if (isinstance(proc, core.Lambda) and proc.rest_args is None
+                and not proc.kwargs and not proc.rest_kwargs
+                and not element.kwargs
+                and len(proc.args) == len(element.args)
+                and not self.has_define(proc.body)):
+            return core.Let(variables=proc.args,
+                            values=element.args,
+                            body=proc.body)
+        return element
+
+    def has_define(self, element):
+        has_define = HasDefine()
+        element.accept(has_define)
+        return has_define.found
+
+
+class DeadExpressions(ScopedTransformer):
+    """Remove pure expressions whose values are discarded in 'Block'."""
+
+    def is_pure(self, element):
+        if isinstance(element, (core.Constant, core.Lambda)):
+            return True
+        return (isinstance(element, core.GetVariable)
+                and self.is_local(element.variable))
+
+    def block(self, element):
+        element = super().block(element)
+        exprs = [expr for expr in element.exprs[:-1]
+                 if not self.is_pure(expr)]
+        element.exprs = exprs + element.exprs[-1:]
+        return element
+
+
+def passes(level, *, env, assigned):
+    """Get passes run at optimization 'level'.
+
+    Level 0 disables optimization, level 1 folds constants and
+    removes dead code, level 2 also inlines immediately
+    applied lambdas.
+    """
+    result = []
+    if level >= 2:
+        result.append(InlineLambdas())
+    if level >= 1:
+        result.extend([ConstantFolding(env, assigned),
+                       DeadBranches(),
+                       DeadExpressions()])
+    return result
+
+
+def optimize(element, *, env, level):
+    """Run optimizing passes of 'level' on 'element'.
+
+    'env' is environment for global variables. Returns
+    the optimized element.
+    """
+    assigned = DefinedVariables()
+    element.accept(assigned)
+    for pass_ in passes(level, env=env, assigned=assigned.variables):
+        element = element.accept(pass_)
+    return element
@@ -5,12 +5,23 @@ from pyme.registry import builtin
 
 
 class TextStreamPort(types.TextualPortBase):
+    """Textual port reading from and writing to a Python text stream.
+
+    Input is read to a buffer in chunks of up to 'chunk_size'
+    characters, one line at most, so reading from interactive
+    stream does not wait for more than a line. End of stream
+    is remembered and the stream is not read after it.
+    """
+
+    chunk_size = 8192
 
     def __init__(self, stream, *, readable, writable):
         self._stream = stream
         self._readable = readable
         self._writable = writable
-        self._peeked = None
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
         if readable and not stream.readable():
             raise ValueError("Stream must be readable if readable=True")
         if writable and not stream.writable():
@@ -34,71 +45,82 @@ class TextStreamPort(types.TextualPortBase):
     def is_open(self):
         return not self._stream.closed
 
+    def _fill(self):
+        """Read next chunk to empty buffer, False at end of stream."""
+        if not self._readable:
+            raise io.UnsupportedOperation("not readable")
+        if self._eof:
+            return False
+        chunk = self._stream.readline(self.chunk_size)
+        if chunk == "":
+            self._eof = True
+            return False
+        self._buffer = chunk
+        self._pos = 0
+        return True
+
+    def _take_buffer(self):
+        """Remove and return unread part of buffer."""
+        result = self._buffer[self._pos:]
+        self._buffer = ""
+        self._pos = 0
+        return result
+
     def read(self, size=-1):
         if not self._readable:
             raise io.UnsupportedOperation("not readable")
         elif size == 0:
             return ""
-        elif self._peeked is None:
-            result = self._stream.read(size)
-            if result == "":
-                self._peeked = ""
-                return types.Eof.instance
-            else:
-                return result
-        elif self._peeked == "":
-            return types.Eof.instance
         elif size < 0:
-            result = self._peeked + self._stream.read(size)
-            self._peeked = None
-            return result
-        elif size > len(self._peeked):
-            result = self._peeked \
-                + self._stream.read(size - len(self._peeked))
-            self._peeked = None
-            return result
-        elif size == len(self._peeked):
-            result = self._peeked
-            self._peeked = None
-            return result
-        else: # size < len(self._peeked):
-            result = self._peeked[:size]
-            self._peeked = self._peeked[size:]
-            return result
+            result = self._take_buffer()
+            if not self._eof:
+                result += self._stream.read()
+                self._eof = True
+        else:
+            pos = self._pos
+            result = self._buffer[pos:pos + size]
+            self._pos = pos + len(result)
+            if len(result) < size and not self._eof:
+                rest = self._stream.read(size - len(result))
+                if rest == "":
+                    self._eof = True
+                result += rest
+        if result == "":
+            self._eof = True
+            return types.Eof.instance
+        return result
 
     def read_char(self):
-        result = self.read(1)
-        return result if isinstance(result, types.Eof) else types.Char(result)
+        pos = self._pos
+        if pos >= len(self._buffer):
+            if not self._fill():
+                return types.Eof.instance
+            pos = 0
+        self._pos = pos + 1
+        return types.make_char(self._buffer[pos])
 
     def peek_char(self):
-        if not self._readable:
-            raise io.UnsupportedOperation("not readable")
-        if self._peeked is None:
-            self._peeked = self._stream.read(1)
-        if self._peeked == "":
+        if self._pos >= len(self._buffer) and not self._fill():
             return types.Eof.instance
-        else:
-            return types.Char(self._peeked)
+        return types.make_char(self._buffer[self._pos])
 
     def readline(self):
         if not self._readable:
             raise io.UnsupportedOperation("not readable")
-        if self._peeked is None:
-            result = self._stream.readline()
-            if result == "":
-                self._peeked = ""
-                return types.Eof.instance
-            else:
-                return result
-        elif self._peeked == "":
-            return types.Eof.instance
-        elif self._peeked == '\n':
-            self._peeked = None
-            return '\n'
-        else:
-            result = self._peeked + self._stream.readline()
-            self._peeked = None
+        end = self._buffer.find("\n", self._pos)
+        if end >= 0:
+            result = self._buffer[self._pos:end + 1]
+            self._pos = end + 1
             return result
+        result = self._take_buffer()
+        if not self._eof:
+            rest = self._stream.readline()
+            if rest == "":
+                self._eof = True
+            result += rest
+        if result == "":
+            return types.Eof.instance
+        return result
 
     def is_char_ready(self):
         raise NotImplementedError()
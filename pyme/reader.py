@@ -1,19 +1,10 @@
+import re
+
 from pyme import base
-from pyme import interop
+from pyme import types
 from pyme.exceptions import ReaderError
 
 
-class _RightBracket:
-    pass
-
-
-_RightBracket.instance = _RightBracket()
-
-
-def is_white(char):
-    return char in " \n\r\t"
-
-
 symbol_special_start_chars = frozenset("!$%&*+-./:<=>?@^_~")
 
 
@@ -28,34 +19,108 @@ def is_symbol_char(char):
     return char.isalnum() or char in symbol_special_chars
 
 
-char_to_decimal_digit = {
-    '0': 0, '1': 1, '2': 2, '3': 3, '4': 4,
-    '5': 5, '6': 6, '7': 7, '8': 8, '9': 9,
+_atom_chars = r"\w!$%&*+\-./:<=>?@^~"
+
+
+_token_re = re.compile(rf"""
+    [ \n\r\t]*(?:;[^\n]*[ \n\r\t]*)*
+    (
+        [{_atom_chars}][{_atom_chars}\#]*
+      | [()']
+      | "[^"\\]*(?:\\[\s\S]?[^"\\]*)*"?
+      | \#[tf](?![{_atom_chars}\#])
+      | \#(?:[tf][{_atom_chars}\#]*(?:[{_atom_chars}]|\#[\s\S]?)|[\s\S])?
+      | [\s\S]
+      |
+    )
+""", re.VERBOSE)
+"""Whitespace and comments followed by a token.
+
+'\\w' matches '_' and characters for which 'str.isalnum' is true,
+so atoms are made of symbol chars and start with symbol start char.
+String token lacks closing quote if input ends before it. Invalid
+hash syntax token includes the char reported in error. Boolean
+followed by symbol chars includes all of them and the char after
+a final '#', so they can be read again after the error. Any other
+char is a token which is reported as unexpected. Empty tokens
+match only at the end, so search for a match never skips input.
+Token group matches wherever whitespace and comments end, so the
+match never backtracks into them.
+"""
+
+
+_escape_re = re.compile(
+    r"\\(?:x([0-9a-fA-F]+);|[ \t]*(?:\r\n?|\n)[ \t]*|([\s\S]))")
+"""Escape sequence in string, line continuation matches no group."""
+
+
+_string_escapes = {
+    "a": "\a", "b": "\b", "t": "\t", "n": "\n", "r": "\r",
+    '"': '"', "\\": "\\", "|": "|",
 }
 
 
-char_to_hex_digit = {
-    '0': 0, '1': 1, '2': 2, '3': 3, '4': 4,
-    '5': 5, '6': 6, '7': 7, '8': 8, '9': 9,
-    'a': 10, 'b': 11, 'c': 12, 'd': 13, 'e': 14, 'f': 15,
-    'A': 10, 'B': 11, 'C': 12, 'D': 13, 'E': 14, 'F': 15,
-}
+def _unescape(match):
+    code, char = match.group(1, 2)
+    if code is not None:
+        try:
+            return chr(int(code, 16))
+        except (ValueError, OverflowError):
+            raise ReaderError(f"Invalid string escape: \\x{code};.")
+    if char is None:
+        return ""
+    try:
+        return _string_escapes[char]
+    except KeyError:
+        raise ReaderError(f"Invalid string escape: \\{char}.")
+
+
+def _split_tokens(text, pos=0, end=None):
+    """Split 'text[pos:end]' to tokens."""
+    if end is None:
+        end = len(text)
+    tokens = _token_re.findall(text, pos, end)
+    while tokens and tokens[-1] == "":
+        tokens.pop()
+    return tokens
 
 
-def to_decimal_digit(char):
-    return char_to_decimal_digit.get(char)
+def _is_terminated(token):
+    """Check that string token ends with unescaped closing quote."""
+    if len(token) < 2 or token[-1] != '"':
+        return False
+    end = len(token) - 1
+    start = end
+    while token[start - 1] == "\\":
+        start -= 1
+    return (end - start) % 2 == 0
 
 
-def to_hex_digit(char):
-    return char_to_hex_digit.get(char)
+_atom_start_re = re.compile(rf"[{_atom_chars}]")
 
 
-def check_legal_object(obj):
-    if isinstance(obj, _RightBracket):
-        raise ReaderError('Unexpected ")".')
+_integer_re = re.compile(r"[+-]?(?:(?P<hex>0[xX][0-9a-fA-F]+)|[0-9]+)")
+
+
+_number_start_chars = frozenset("+-0123456789")
 
 
 class Reader:
+    """Read Scheme data from text stream.
+
+    Input is read in chunks of 'chunk_size' characters and split
+    to tokens with a regular expression, one part ending with
+    a newline at a time, so no token but string continues to the
+    next part. Interactive stream is read by lines, so reading
+    a datum does not wait for more input than the line it ends on.
+
+    Symbols and keywords of recently read atoms are cached, the cache
+    is emptied when it reaches 'atom_cache_size' entries.
+    """
+
+    chunk_size = 65536
+
+    atom_cache_size = 4096
 
     def __init__(self, stream, *, symbol_table, keyword_table):
         if symbol_table is None:
@@ -65,155 +130,211 @@ class Reader:
         self._stream = stream
         self._symbol_table = symbol_table
         self._keyword_table = keyword_table
-        self._peeked = None
-
-    def read_char(self):
-        if self._peeked is None:
-            return self._stream.read(1)
-        else:
-            result = self._peeked
-            self._peeked = None
-            return result
-
-    def peek_char(self):
-        if self._peeked is None:
-            self._peeked = self._stream.read(1)
-            return self._peeked
-        else:
-            return self._peeked
-
-    def readline(self):
-        peeked = self._peeked
-        self._peeked = None
-        if peeked is None:
-            return self._stream.readline()
-        elif peeked == "\n":
-            return peeked
-        else:
-            return peeked + self._stream.readline()
-
-    def _read_list(self):
-        result = []
+        self._interactive = stream.isatty()
+        self._atoms = {}
+        self._rest = ""
+        self._eof = False
+        self._tokens = []
+        self._index = 0
+
+    def _read_until(self, text, char, start):
+        """Read input after 'text' until 'char' is found.
+
+        Returns extended text and index of first 'char' at or after
+        'start' in it, or -1 if input ends before 'char'.
+        """
+        index = text.find(char, start)
+        if index >= 0 or self._eof:
+            return text, index
+        chunks = [text]
+        size = len(text)
         while True:
-            item = self._read()
-            if isinstance(item, _RightBracket):
-                return interop.scheme_list(result)
-            elif base.eofp(item):
-                raise ReaderError('Unexpected end of file.')
+            if self._interactive:
+                chunk = self._stream.readline(self.chunk_size)
             else:
-                result.append(item)
-
-    def _read_string(self):
-        result = ""
+                chunk = self._stream.read(self.chunk_size)
+            if chunk == "":
+                self._eof = True
+                break
+            chunks.append(chunk)
+            index = chunk.find(char)
+            if index >= 0:
+                index += size
+                break
+            size += len(chunk)
+        return "".join(chunks), index
+
+    def _read_string_end(self, text, start):
+        """Read input until closing quote of string.
+
+        String starts before 'start' and has no closing quote before
+        it. Returns extended text and index of the closing quote,
+        or -1 if input ends before it.
+        """
         while True:
-            item = self.read_char()
-            if item == "":
-                raise ReaderError('Unexpected end of file.')
-            elif item == '"':
-                return result
-            else:
-                result += item
-
-    def _slice_symbol_or_number(self, char):
-        result = char
+            text, index = self._read_until(text, '"', start)
+            if index < 0:
+                return text, index
+            escape = index
+            while text[escape - 1] == "\\":
+                escape -= 1
+            if (index - escape) % 2 == 0:
+                return text, index
+            start = index + 1
+
+    def _scan(self):
+        """Split next part of input to tokens.
+
+        Returns False at end of input.
+        """
+        text, index = self._read_until(self._rest, "\n", 0)
+        if text == "":
+            return False
+        end = text.rfind("\n") + 1 if index >= 0 else len(text)
+        tokens = []
+        pos = 0
         while True:
-            item = self.peek_char()
-            if item == "":
-                return result
-            elif not is_symbol_char(item):
-                return result
-            else:
-                self.read_char()
-                result += item
-
-    def _parse_integer(self, string):
-        sign = 1
-        base = 10
-        to_digit = to_decimal_digit
-
-        if string[0] == "+":
-            string = string[1:]
-        elif string[0] == "-":
-            sign = -1
-            string = string[1:]
-
-        if string[:2] == "0x" or string[:2] == "0X":
-            to_digit = to_hex_digit
-            base = 16
-            string = string[2:]
-
-        if len(string) == 0:
-            return None
-
-        result = 0
-        for char in string:
-            digit = to_digit(char)
-            if digit is None:
+            part = _split_tokens(text, pos, end)
+            last = part[-1] if part else ""
+            if (last[:1] != '"' or end == len(text) and self._eof
+                    or _is_terminated(last)):
+                tokens.extend(part)
+                break
+            # Unterminated string, read input up to its end.
+            part.pop()
+            tokens.extend(part)
+            pos = end - len(last)
+            text, index = self._read_string_end(text, end)
+            if index >= 0:
+                text, index = self._read_until(text, "\n", index + 1)
+            end = text.rfind("\n") + 1 if index >= 0 else len(text)
+        self._rest = text[end:]
+        self._tokens = tokens
+        self._index = 0
+        return True
+
+    def _next_token(self):
+        """Get next token or None at end of input."""
+        while self._index >= len(self._tokens):
+            if not self._scan():
                 return None
-            result = result * base + digit
-
-        return sign * result
+        token = self._tokens[self._index]
+        self._index += 1
+        return token
 
     def _get_symbol_or_number(self, string):
-        as_integer = self._parse_integer(string)
-        if as_integer is not None:
-            return as_integer
+        """Get value of atom 'string'.
+
+        Symbols and keywords are cached by reader, numbers are not.
+        """
+        atoms = self._atoms
+        result = atoms.get(string)
+        if result is not None:
+            return result
+        if _atom_start_re.match(string) is None:
+            raise ReaderError(f"Unexpected char: {string}.")
+        if string[0] in _number_start_chars:
+            match = _integer_re.fullmatch(string)
+            if match is not None:
+                return int(string, 16 if match.group("hex") else 10)
         if string[0] == ":":
-            return self._keyword_table[string]
-        return self._symbol_table[string]
+            result = self._keyword_table[string]
+        else:
+            result = self._symbol_table[string]
+        if len(atoms) >= self.atom_cache_size:
+            atoms.clear()
+        atoms[string] = result
+        return result
 
-    def _read_quoted(self):
-        quoted = self._read()
-        check_legal_object(quoted)
-        if base.eofp(quoted):
+    def _read_string(self, token):
+        if not _is_terminated(token):
             raise ReaderError('Unexpected end of file.')
-        return interop.scheme_list([self._symbol_table["quote"], quoted])
+        result = token[1:-1]
+        if "\\" in result:
+            result = _escape_re.sub(_unescape, result)
+        return result
 
-    def _read_special(self):
-        char = self.read_char()
-        if char == "":
-            raise ReaderError('Unexpected end of file.')
-        elif char == 't':
-            next_char = self.peek_char()
-            if next_char != "" and is_symbol_char(next_char):
-                raise ReaderError("Invalid hash syntax: #"
-                                  + char + next_char)
+    def _read_special(self, token):
+        if token == "#t":
             return True
-        elif char == 'f':
-            next_char = self.peek_char()
-            if next_char != "" and is_symbol_char(next_char):
-                raise ReaderError("Invalid hash syntax: #"
-                                  + char + next_char)
+        elif token == "#f":
             return False
+        elif token == "#":
+            raise ReaderError('Unexpected end of file.')
         else:
-            raise ReaderError("Invalid hash syntax: #" + char)
+            raise ReaderError("Invalid hash syntax: " + token[:3])
 
     def _read(self):
-        while True:
-            char = self.read_char()
-            if char == "":
-                return base.eof()
-            elif is_white(char):
-                continue
-            elif char == ";":
-                self.readline()
-            elif char == "(":
-                return self._read_list()
-            elif char == ")":
-                return _RightBracket.instance
-            elif char == '"':
-                return self._read_string()
-            elif char == "'":
-                return self._read_quoted()
-            elif char == "#":
-                return self._read_special()
-            elif is_symbol_start_char(char):
-                string = self._slice_symbol_or_number(char)
-                return self._get_symbol_or_number(string)
-            else:
-                raise ReaderError(f"Unexpected char: {char}.")
+        """Read datum with an explicit stack of unfinished data.
+
+        Stack holds a [head, last] pair list frame for every open
+        list, where 'head' is a dummy pair before the first element,
+        and None for every quote waiting for its datum. Finished
+        datum is appended to the innermost open list directly.
+        """
+        new = object.__new__
+        Pair = types.Pair
+        nil = types.EmptyList.instance
+        atoms = self._atoms
+        stack = []
+        tokens = self._tokens
+        index = self._index
+        try:
+            while True:
+                if index < len(tokens):
+                    token = tokens[index]
+                    index += 1
+                else:
+                    self._index = index
+                    token = self._next_token()
+                    tokens = self._tokens
+                    index = self._index
+                    if token is None:
+                        if stack:
+                            raise ReaderError('Unexpected end of file.')
+                        return base.eof()
+                value = atoms.get(token)
+                if value is None:
+                    char = token[0]
+                    if char == "(":
+                        head = new(Pair)
+                        head.cdr = nil
+                        stack.append([head, head])
+                        continue
+                    elif char == ")":
+                        if not stack or stack[-1] is None:
+                            raise ReaderError('Unexpected ")".')
+                        value = stack.pop()[0].cdr
+                    elif char == "'":
+                        stack.append(None)
+                        continue
+                    elif char == '"':
+                        value = self._read_string(token)
+                    elif char == "#":
+                        if len(token) > 2:
+                            # Symbol chars after boolean are read again.
+                            tokens[index:index] = _split_tokens(token[2:])
+                        value = self._read_special(token)
+                    else:
+                        value = self._get_symbol_or_number(token)
+                while stack:
+                    frame = stack[-1]
+                    if frame is None:
+                        stack.pop()
+                        value = Pair.unchecked(
+                            self._symbol_table["quote"],
+                            Pair.unchecked(value, nil))
+                        continue
+                    pair = new(Pair)
+                    pair.car = value
+                    pair.cdr = nil
+                    frame[1].cdr = pair
+                    frame[1] = pair
+                    break
+                else:
+                    return value
+        finally:
+            self._index = index
 
     def read(self, stream=None):
-        result = self._read()
-        check_legal_object(result)
-        return result
+        return self._read()
@@ -12,13 +12,27 @@ EmptyList.instance = EmptyList()
 
 
 class Pair:
+    """Cons cell, 'cdr' is a pair or the empty list.
+
+    Pairs are keys of weak dictionaries, see 'macro.SyntaxRules'.
+    """
+
+    __slots__ = ["__weakref__", "car", "cdr"]
 
     def __init__(self, car, cdr):
-        if not isinstance(cdr, Pair) and not isinstance(cdr, EmptyList):
+        if not isinstance(cdr, (Pair, EmptyList)):
             raise ValueError("cdr of pair should be a pair or empty list")
         self.car = car
         self.cdr = cdr
 
+    @classmethod
+    def unchecked(cls, car, cdr):
+        """Create pair without checking 'cdr', for trusted callers."""
+        pair = object.__new__(cls)
+        pair.car = car
+        pair.cdr = cdr
+        return pair
+
     def write_to(self, port):
         return write.write_pair_to(self, port)
 
@@ -26,6 +40,22 @@ class Pair:
         return write.display_pair_to(self, port)
 
 
+def pair_list(items, tail=EmptyList.instance):
+    """Build Scheme list of sequence 'items' ending with 'tail'.
+
+    List is built in one pass from the end, pairs are created
+    without checks, so 'tail' must be a pair or the empty list.
+    """
+    new = object.__new__
+    result = tail
+    for item in reversed(items):
+        pair = new(Pair)
+        pair.car = item
+        pair.cdr = result
+        result = pair
+    return result
+
+
 class Char:
 
     __slots__ = ["_char"]
@@ -47,6 +77,20 @@ class Char:
         port.write(self.char)
 
 
+_latin1_chars = tuple(Char(chr(code)) for code in range(256))
+"""Shared Char instances of the Latin-1 range."""
+
+
+def make_char(char):
+    """Get Char for string 'char' of length 1.
+
+    Chars of the Latin-1 range are interned, others are created.
+    """
+    if isinstance(char, str) and len(char) == 1:
+        code = ord(char)
+        if code < 256:
+            return _latin1_chars[code]
+    return Char(char)
 
 
 class Symbol:
@@ -107,54 +151,142 @@ def keyword_table():
     return SymbolTable(Keyword)
 
 
+class Cell:
+    """Mutable box holding value of a global binding."""
+
+    __slots__ = ["value"]
+
+    def __init__(self, value):
+        self.value = value
+
+
 class Environment:
+    """First-class environment with bindings stored in cells.
+
+    'version' is incremented every time a binding is added to or
+    removed from any environment, or environment parent changes.
+    Compiled code caches cells resolved through environment chain and
+    uses version to find out that cached cell may be stale. Assigning
+    to existing binding updates its cell and does not change version.
+    """
+
+    __slots__ = ["_parent", "bindings"]
 
-    __slots__ = ["parent", "bindings"]
+    version = 0
 
     def __init__(self, *, parent=None, bindings=None):
-        self.parent = parent
-        self.bindings = {} if bindings is None else bindings
+        self._parent = parent
+        self.bindings = {} if bindings is None else {
+            key: Cell(value) for key, value in bindings.items()
+        }
 
-    def __getitem__(self, index):
+    def _changed(self):
+        Environment.version += 1
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        self._parent = parent
+        self._changed()
+
+    def lookup(self, index):
+        """Get cell of a binding visible from environment or None."""
         env = self
         while env is not None:
-            if index in env.bindings:
-                return env.bindings[index]
-            env = env.parent
-        raise exceptions.IdentifierNotBoundError(str(index))
+            cell = env.bindings.get(index)
+            if cell is not None:
+                return cell
+            env = env._parent
+        return None
+
+    def __getitem__(self, index):
+        cell = self.lookup(index)
+        if cell is None:
+            raise exceptions.IdentifierNotBoundError(str(index))
+        return cell.value
 
     def __contains__(self, index):
-        env = self
-        while env is not None:
-            if index in env.bindings:
-                return True
-            env = env.parent
-        return False
+        return self.lookup(index) is not None
 
     def get(self, index, default=None):
-        env = self
-        while env is not None:
-            if index in env.bindings:
-                return env.bindings[index]
-            env = env.parent
-        return default
+        cell = self.lookup(index)
+        return default if cell is None else cell.value
 
     def define(self, index, value):
-        self.bindings[index] = value
+        cell = self.bindings.get(index)
+        if cell is None:
+            self.bindings[index] = Cell(value)
+            self._changed()
+        else:
+            cell.value = value
 
     def set_(self, index, value):
-        env = self
-        while env is not None:
-            if index in env.bindings:
-                env.bindings[index] = value
-                return
-            env = env.parent
-        raise exceptions.IdentifierNotBoundError(str(index))
+        cell = self.lookup(index)
+        if cell is None:
+            raise exceptions.IdentifierNotBoundError(str(index))
+        cell.value = value
+
+    def has_binding(self, index):
+        """Check if binding is present in environment itself."""
+        return index in self.bindings
+
+    def get_binding(self, index, default=None):
+        """Get value bound in environment itself, ignoring parents."""
+        cell = self.bindings.get(index)
+        return default if cell is None else cell.value
+
+    def delete(self, index):
+        if self.bindings.pop(index, None) is not None:
+            self._changed()
+
+    def clear(self):
+        self.bindings.clear()
+        self._changed()
+
+    def items(self):
+        """Get list of (key, value) pairs bound in environment itself."""
+        return [(key, cell.value) for key, cell in self.bindings.items()]
+
+    def copy(self):
+        """Copy environment, the copy has its own cells."""
+        return Environment(parent=self._parent, bindings=dict(self.items()))
 
     def write_to(self, port):
         port.write(f"#<environment:{id(self)}>")
 
 
+class Frame:
+    """Activation frame of compiled procedure.
+
+    Local variables live in 'values' at slots assigned by the compiler,
+    'parent' is the frame of the closure, which holds variables
+    captured from enclosing procedures.
+    """
+
+    __slots__ = ["values", "parent"]
+
+    def __init__(self, values, parent=None):
+        self.values = values
+        self.parent = parent
+
+
+class Unassigned:
+    """Value of local variable before its definition is evaluated.
+
+    Frame slots of internal definitions and letrec variables hold it
+    until initialized, reading it raises IdentifierNotBoundError.
+    """
+
+    def write_to(self, port):
+        port.write("#<unassigned>")
+
+
+Unassigned.instance = Unassigned()
+
+
 class Eof:
 
     def write_to(self, port):
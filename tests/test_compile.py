@@ -7,7 +7,7 @@ from pyme import reader
 from pyme import types
 from pyme.bytecode import Bytecode, OpCode
 from pyme.compile import compile
-from pyme.compile_to_bytecode import BytecodeCompiler
+from pyme.compile_to_bytecode import BytecodeCompiler, peephole
 from pyme.drive import Builtins
 
 
@@ -36,8 +36,7 @@ class TestCompile(unittest.TestCase):
         expr = interop.read_str("123456")
         result = compile(expr, env=env)
         self.assertEqual(result.code, bytes([
-            OpCode.CONST_1.value, 0,
-            OpCode.RET.value]))
+            OpCode.CONST_RET_1.value, 0]))
         self.assertEqual(result.constants, [123456])
 
     def test_var(self):
@@ -70,11 +69,9 @@ class TestCompile(unittest.TestCase):
         result = compile(expr, env=env)
         self.assertEqual(result.code, bytes([
             OpCode.CONST_1.value, 0,
-            OpCode.JUMP_IF_NOT_3.value, 0, 0, 9,
-            OpCode.CONST_1.value, 1,
-            OpCode.RET.value,
-            OpCode.CONST_1.value, 2,
-            OpCode.RET.value,
+            OpCode.JUMP_IF_NOT_3.value, 0, 0, 8,
+            OpCode.CONST_RET_1.value, 1,
+            OpCode.CONST_RET_1.value, 2,
         ]))
         self.assertEqual(result.variables, [])
         self.assertEqual(result.constants, [True, 3, 4])
@@ -88,14 +85,14 @@ class TestCompile(unittest.TestCase):
         expr = interop.read_str("(+ (if #t 3 4) 5)", symbol_table=symbol_table)
         result = compile(expr, env=env)
         self.assertEqual(result.code, bytes([
-            OpCode.READ_VAR_1.value, 0,
             OpCode.CONST_1.value, 0,
-            OpCode.JUMP_IF_NOT_3.value, 0, 0, 14,
+            OpCode.JUMP_IF_NOT_3.value, 0, 0, 12,
             OpCode.CONST_1.value, 1,
-            OpCode.JUMP_3.value, 0, 0, 16,
+            OpCode.JUMP_3.value, 0, 0, 14,
             OpCode.CONST_1.value, 2,
             OpCode.CONST_1.value, 3,
-            OpCode.TAIL_CALL_1.value, 2,
+            OpCode.ADD2_1.value, 0,
+            OpCode.RET.value,
         ]))
         self.assertEqual(result.variables, [symbol_table["+"]])
         self.assertEqual(result.constants, [True, 3, 4, 5])
@@ -107,8 +104,7 @@ class TestCompile(unittest.TestCase):
         expr = interop.read_str("'a", symbol_table=symbol_table)
         result = compile(expr, env=env)
         self.assertEqual(result.code, bytes([
-            OpCode.CONST_1.value, 0,
-            OpCode.RET.value]))
+            OpCode.CONST_RET_1.value, 0]))
         self.assertEqual(result.variables, [])
         self.assertEqual(result.constants, [symbol_table["a"]])
 
@@ -125,13 +121,10 @@ class TestCompile(unittest.TestCase):
         self.assertEqual(result.variables, [])
         self.assertIsInstance(result.constants[0], Bytecode)
         self.assertEqual(result.constants[0].code, bytes([
-            OpCode.CONST_1.value, 0,
-            OpCode.DROP.value,
-            OpCode.CONST_1.value, 1,
-            OpCode.RET.value]))
+            OpCode.CONST_RET_1.value, 1]))
         self.assertEqual(result.constants[0].constants, [4, 5])
         self.assertEqual(result.constants[0].variables, [])
-        self.assertEqual(result.constants[0].formals, [])
+        self.assertEqual(result.constants[0].formals, ())
         self.assertIsNone(result.constants[0].formals_rest)
 
     def test_lambda_arg(self):
@@ -148,11 +141,14 @@ class TestCompile(unittest.TestCase):
         self.assertEqual(result.variables, [])
         self.assertIsInstance(result.constants[0], Bytecode)
         self.assertEqual(result.constants[0].code, bytes([
-            OpCode.READ_VAR_1.value, 0,
+            OpCode.READ_STACK_1.value, 0,
             OpCode.RET.value]))
         self.assertEqual(result.constants[0].constants, [])
-        self.assertEqual(result.constants[0].variables, [x])
-        self.assertEqual(result.constants[0].formals, [x])
+        self.assertEqual(result.constants[0].variables, [])
+        self.assertEqual(result.constants[0].locals, [])
+        self.assertEqual(result.constants[0].formals, (x,))
+        self.assertEqual(result.constants[0].frame_size, 1)
+        self.assertTrue(result.constants[0].leaf)
 
     def test_lambda_rest(self):
         symbol_table = types.symbol_table()
@@ -170,12 +166,60 @@ class TestCompile(unittest.TestCase):
         self.assertEqual(result.variables, [])
         self.assertIsInstance(result.constants[0], Bytecode)
         self.assertEqual(result.constants[0].code, bytes([
-            OpCode.READ_VAR_1.value, 0,
+            OpCode.READ_STACK_1.value, 1,
             OpCode.RET.value]))
         self.assertEqual(result.constants[0].constants, [])
-        self.assertEqual(result.constants[0].variables, [y])
-        self.assertEqual(result.constants[0].formals, [x])
+        self.assertEqual(result.constants[0].variables, [])
+        self.assertEqual(result.constants[0].locals, [])
+        self.assertEqual(result.constants[0].formals, (x,))
         self.assertEqual(result.constants[0].formals_rest, y)
+        self.assertIsNone(result.constants[0].binding.fixed_arity)
+
+    def test_lambda_outer(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(
+            bindings={symbol_table["lambda"]: Builtins.LAMBDA})
+        expr = interop.read_str("(lambda (x y) (lambda (z) (y z)))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertFalse(result.constants[0].leaf)
+        inner = result.constants[0].constants[0]
+        self.assertEqual(inner.code, bytes([
+            OpCode.READ_FREE_1.value, 0,
+            OpCode.READ_STACK_TAIL_CALL_1.value, 0, 1]))
+        self.assertEqual(inner.captures, ((0, 1),))
+        self.assertTrue(inner.leaf)
+
+    def test_lambda_internal_define(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["lambda"]: Builtins.LAMBDA,
+            symbol_table["define"]: Builtins.DEFINE,
+        })
+        expr = interop.read_str("(lambda (x) (define y x) y)",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertEqual(result.constants[0].code, bytes([
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.SET_STACK_1.value, 1,
+            OpCode.READ_STACK_1.value, 1,
+            OpCode.RET.value]))
+        self.assertEqual(result.constants[0].frame_size, 2)
+        self.assertEqual(result.constants[0].binding.fixed_arity, 1)
+        self.assertEqual(result.constants[0].binding.padding,
+                         (types.Unassigned.instance,))
+
+    def test_let_internal_define(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["let"]: Builtins.LET,
+            symbol_table["define"]: Builtins.DEFINE,
+        })
+        expr = interop.read_str("(let () (define y 1) y)",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertNotIn(OpCode.DEFINE_1.value, result.code)
+        self.assertEqual(result.variables, [])
 
     def test_define(self):
         symbol_table = types.symbol_table()
@@ -206,3 +250,209 @@ class TestCompile(unittest.TestCase):
             OpCode.RET.value]))
         self.assertEqual(result.variables, [x])
         self.assertEqual(result.constants, [3])
+
+    def test_decoded(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["if"]: Builtins.IF,
+            symbol_table["+"]: base.plus,
+        })
+        expr = interop.read_str("(+ (if #t 3 4) 5)", symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        opcodes, args = result.decoded()
+        self.assertEqual(opcodes, [
+            OpCode.CONST_1,
+            OpCode.JUMP_IF_NOT_3,
+            OpCode.CONST_1,
+            OpCode.JUMP_3,
+            OpCode.CONST_1,
+            OpCode.CONST_1,
+            OpCode.ADD2_1,
+            OpCode.RET,
+        ])
+        self.assertEqual(args[:6], [True, 4, 3, 5, 4, 5])
+        self.assertEqual(args[6].variable, symbol_table["+"])
+        self.assertIsNone(args[7])
+        self.assertIs(result.decoded(), result.decoded())
+
+    def test_peephole_jumps(self):
+        bytecode = Bytecode()
+        bytecode.extend([
+            OpCode.CONST_1.value, 0,
+            OpCode.JUMP_IF_NOT_3.value, 0, 0, 9,
+            OpCode.CONST_1.value, 1,
+            OpCode.RET.value,
+            OpCode.JUMP_3.value, 0, 0, 13,
+            OpCode.CONST_1.value, 2,
+            OpCode.RET.value,
+        ])
+        peephole(bytecode)
+        self.assertEqual(bytecode.code, bytes([
+            OpCode.CONST_1.value, 0,
+            OpCode.JUMP_IF_NOT_3.value, 0, 0, 12,
+            OpCode.CONST_RET_1.value, 1,
+            OpCode.JUMP_3.value, 0, 0, 12,
+            OpCode.CONST_RET_1.value, 2,
+        ]))
+
+    def test_peephole_jump_to_ret(self):
+        bytecode = Bytecode()
+        bytecode.extend([
+            OpCode.JUMP_3.value, 0, 0, 4,
+            OpCode.JUMP_3.value, 0, 0, 8,
+            OpCode.RET.value,
+        ])
+        peephole(bytecode)
+        self.assertEqual(bytecode.code, bytes([
+            OpCode.RET.value,
+            OpCode.RET.value,
+            OpCode.RET.value,
+        ]))
+
+    def test_call_branch(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["if"]: Builtins.IF,
+            symbol_table["lambda"]: Builtins.LAMBDA,
+        })
+        expr = interop.read_str("(lambda (p x) (if (p x) 1 2))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertEqual(result.constants[0].code, bytes([
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.READ_STACK_1.value, 1,
+            OpCode.CALL_BRANCH_1.value, 1,
+            OpCode.JUMP_IF_NOT_3.value, 0, 0, 12,
+            OpCode.CONST_RET_1.value, 0,
+            OpCode.CONST_RET_1.value, 1,
+        ]))
+
+    def test_primitive_shadowed(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["lambda"]: Builtins.LAMBDA,
+            symbol_table["car"]: base.car,
+        })
+        expr = interop.read_str("(lambda (car x) (car x))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertEqual(result.constants[0].code, bytes([
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.READ_STACK_TAIL_CALL_1.value, 1, 1,
+        ]))
+
+    def test_self_tail_call_checked(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["define"]: Builtins.DEFINE,
+        })
+        expr = interop.read_str("(define (f x) (f x))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertEqual(result.constants[0].code, bytes([
+            OpCode.READ_VAR_1.value, 0,
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.SELF_TAIL_CALL_1.value, 1,
+        ]))
+
+    def test_self_tail_call_jump(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["let"]: Builtins.LET,
+        })
+        expr = interop.read_str("(let loop ((x 1) (y 2)) (loop y x))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        loop = result.constants[0]
+        self.assertEqual(loop.code, bytes([
+            OpCode.READ_STACK_1.value, 1,
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.SET_STACK_1.value, 1,
+            OpCode.SET_STACK_1.value, 0,
+            OpCode.JUMP_3.value, 0, 0, 0,
+        ]))
+
+    def test_self_tail_call_assigned(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["lambda"]: Builtins.LAMBDA,
+            symbol_table["define"]: Builtins.DEFINE,
+            symbol_table["set!"]: Builtins.SET,
+        })
+        expr = interop.read_str(
+            "(lambda () (define (f x) (f x)) (set! f 1))",
+            symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        f = result.constants[0].constants[0]
+        self.assertEqual(f.code, bytes([
+            OpCode.READ_FREE_BOXED_1.value, 0,
+            OpCode.READ_STACK_TAIL_CALL_1.value, 0, 1,
+        ]))
+
+    def test_direct_call(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["define"]: Builtins.DEFINE,
+        })
+        expr = interop.read_str("(define (f x) (f (f x)))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        f = result.constants[0]
+        self.assertEqual(f.code, bytes([
+            OpCode.READ_VAR_1.value, 0,
+            OpCode.READ_VAR_1.value, 1,
+            OpCode.READ_STACK_1.value, 0,
+            OpCode.DIRECT_CALL_1.value, 0, 1,
+            OpCode.SELF_TAIL_CALL_1.value, 1,
+        ]))
+        self.assertIs(f.constants[0], f.lambda_)
+
+    def test_direct_call_excluded(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["define"]: Builtins.DEFINE,
+            symbol_table["set!"]: Builtins.SET,
+            symbol_table["car"]: base.car,
+        })
+        for source in ["(define (f x) (car (f 1 2)))",
+                       "(define (f x) (set! f car) (car (f 1)))"]:
+            expr = interop.read_str(source, symbol_table=symbol_table)
+            result = compile(expr, env=env)
+            self.assertNotIn(OpCode.DIRECT_CALL_1.value,
+                             result.constants[0].code)
+
+    def test_let_no_closure(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["let"]: Builtins.LET,
+        })
+        expr = interop.read_str("(let ((x 1)) x)",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        self.assertEqual(result.code, bytes([
+            OpCode.CONST_1.value, 0,
+            OpCode.SET_LOCAL_1.value, 0,
+            OpCode.READ_LOCAL_1.value, 1,
+            OpCode.RET.value,
+        ]))
+        self.assertEqual(result.frame_size, 1)
+
+    def test_case(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["case"]: Builtins.CASE,
+        })
+        expr = interop.read_str("(case x ((1 2) 3) (else 4))",
+                                symbol_table=symbol_table)
+        result = compile(expr, env=env)
+        opcodes, args = result.decoded()
+        self.assertEqual(opcodes, [
+            OpCode.READ_VAR_1,
+            OpCode.CASE_1,
+            OpCode.JUMP_3,
+            OpCode.JUMP_3,
+            OpCode.CONST_RET_1,
+            OpCode.CONST_RET_1,
+        ])
+        self.assertEqual(args[1], ({(int, 1): 0, (int, 2): 0}, 1))
+        self.assertEqual(args[2:], [4, 5, 3, 4])
@@ -0,0 +1,50 @@
+import sys
+import unittest
+from unittest import mock
+
+from pyme import Interpreter
+from pyme import compile_to_closure
+from pyme import eval
+from pyme import exceptions
+
+from tests import test_eval
+from tests import test_interpreter
+
+
+class TestClosureEval(test_eval.TestEval):
+    """Run evaluator tests with closure compiler."""
+
+    def setUp(self):
+        patcher = mock.patch.object(eval, "eval", compile_to_closure.eval)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestClosureInterpreter(test_interpreter.TestInterpreter):
+    """Run interpreter tests with closure compiler."""
+
+    def setUp(self):
+        super().setUp()
+        load_paths = self.interpreter.load_paths
+        self.interpreter = Interpreter(backend="closure")
+        self.interpreter.load_paths = load_paths
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            Interpreter(backend="unknown")
+
+    def test_deep_recursion(self):
+        self.interpreter.eval_str("""
+            (define (deep n) (if (= n 0) 0 (+ 1 (deep (- n 1)))))
+        """)
+        self.assertEqual(self.interpreter.eval_str("(deep 100)"), 100)
+        if compile_to_closure.recursion_limit is not None:
+            self.assertEqual(self.interpreter.eval_str("(deep 5000)"), 5000)
+        limit = sys.getrecursionlimit()
+        with self.assertRaises(exceptions.EvalError):
+            self.interpreter.eval_str("""
+                (define (endless n) (+ 1 (endless n)))
+                (endless 0)
+            """)
+        self.assertEqual(sys.getrecursionlimit(), limit)
+        self.assertEqual(self.interpreter.eval_str("(deep 100)"), 100)
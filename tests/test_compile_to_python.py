@@ -0,0 +1,103 @@
+import unittest
+
+from pyme import Interpreter
+from pyme import exceptions
+
+
+class TestTiering(unittest.TestCase):
+
+    def setUp(self):
+        self.interpreter = Interpreter()
+        self.interpreter.hooks["eval"]["tier"] = 2
+
+    def bytecode(self, name):
+        symbol = self.interpreter.symbol_table[name]
+        return self.interpreter.global_env[symbol].bytecode
+
+    def test_self_tail_call(self):
+        result = self.interpreter.eval_str("""
+            (define (sum-to n acc) (if (= n 0) acc (sum-to (- n 1) (+ acc n))))
+            (sum-to 10000 0)
+        """)
+        self.assertEqual(result, 10000 * 10001 // 2)
+        native = self.bytecode("sum-to").native
+        self.assertIsNotNone(native)
+        self.assertIn("while True", native.source)
+
+    def test_tiering_off(self):
+        self.interpreter.hooks["eval"]["tier"] = None
+        result = self.interpreter.eval_str("""
+            (define (sum-to n acc) (if (= n 0) acc (sum-to (- n 1) (+ acc n))))
+            (sum-to 100 0)
+        """)
+        self.assertEqual(result, 5050)
+        self.assertIsNone(self.bytecode("sum-to").native)
+        self.assertEqual(self.bytecode("sum-to").calls, 0)
+
+    def test_list_loop(self):
+        result = self.interpreter.eval_str("""
+            (define (build n l) (if (= n 0) l (build (- n 1) (cons n l))))
+            (define (len l n) (if (null? l) n (len (cdr l) (+ n 1))))
+            (len (build 1000 '()) 0)
+        """)
+        self.assertEqual(result, 1000)
+        self.assertIsNotNone(self.bytecode("len").native)
+
+    def test_builtin_rebound(self):
+        self.interpreter.eval_str("""
+            (define (add a b) (+ a b))
+            (add 1 2) (add 1 2) (add 1 2)
+        """)
+        self.assertIsNotNone(self.bytecode("add").native)
+        result = self.interpreter.eval_str("""
+            (define (+ a b) (* a b))
+            (add 3 4)
+        """)
+        self.assertEqual(result, 12)
+
+    def test_add_non_numbers(self):
+        self.interpreter.eval_str("""
+            (define (add a b) (+ a b))
+            (add 1 2) (add 1 2) (add 1 2)
+        """)
+        self.assertIsNotNone(self.bytecode("add").native)
+        with self.assertRaises(TypeError):
+            self.interpreter.eval_str('(add "a" "b")')
+
+    def test_self_rebound(self):
+        result = self.interpreter.eval_str("""
+            (define (count n) (if (= n 0) 0 (count (- n 1))))
+            (count 10)
+            (define old-count count)
+            (define (count n) 'other)
+            (old-count 5)
+        """)
+        self.assertEqual(result, self.interpreter.symbol_table["other"])
+
+    def test_internal_define(self):
+        result = self.interpreter.eval_str("""
+            (define (f n acc)
+              (define m (* n 2))
+              (if (= n 0) acc (f (- n 1) (+ acc m))))
+            (f 100 0)
+        """)
+        self.assertEqual(result, 10100)
+        self.assertIsNotNone(self.bytecode("f").native)
+
+    def test_not_translated(self):
+        result = self.interpreter.eval_str("""
+            (define (f n) (if (= n 0) 0 (+ 1 (f (- n 1)))))
+            (f 100)
+        """)
+        self.assertEqual(result, 100)
+        self.assertIsNone(self.bytecode("f").native)
+        self.assertGreater(self.bytecode("f").calls, 2)
+
+    def test_arity_error(self):
+        self.interpreter.eval_str("""
+            (define (f n) (+ n 1))
+            (f 1) (f 1) (f 1)
+        """)
+        with self.assertRaises(exceptions.EvalError):
+            self.interpreter.eval_str("(f 1 2)")
+
@@ -1,3 +1,4 @@
+import io
 import unittest
 
 from pyme import eval
@@ -6,6 +7,7 @@ from pyme import interop
 from pyme import base
 from pyme import reader
 from pyme import types
+from pyme.bytecode import Bytecode, CallCache
 from pyme.drive import Builtins
 
 
@@ -224,3 +226,170 @@ class TestEval(unittest.TestCase):
         """
         result = interop.eval_str(source, bindings)
         self.assertEqual(result, 4 + 5 - 6)
+
+    def test_unknown_opcode(self):
+        bytecode = Bytecode()
+        bytecode.append(0xff)
+        evaluator = eval.Evaluator(bytecode=bytecode, env=types.Environment())
+        with self.assertRaises(exceptions.EvalError):
+            evaluator.run()
+
+    def test_closure_counter(self):
+        bindings = {
+            "define": Builtins.DEFINE,
+            "lambda": Builtins.LAMBDA,
+            "set!": Builtins.SET,
+            "+": base.plus,
+        }
+        source = """
+            (define (make-counter n)
+              (lambda () (set! n (+ n 1)) n))
+            (define c (make-counter 10))
+            (c)
+            (c)
+        """
+        result = interop.eval_str(source, bindings)
+        self.assertEqual(result, 12)
+
+    def test_eval_in_environment(self):
+        symbol_table = types.symbol_table()
+        x = symbol_table["x"]
+        env = types.Environment(bindings={
+            symbol_table["lambda"]: Builtins.LAMBDA,
+            symbol_table["eval"]: eval.scheme_eval,
+            symbol_table["quote"]: Builtins.QUOTE,
+            x: 1,
+        })
+        inner = types.Environment(bindings={x: 2}, parent=env)
+        expr = interop.read_str("((lambda (x) (eval 'x e)) 3)",
+                                symbol_table=symbol_table)
+        env.define(symbol_table["e"], inner)
+        result = eval.eval(expr, env=env)
+        self.assertEqual(result, 2)
+
+    def test_call_arity_errors(self):
+        bindings = {
+            "define": Builtins.DEFINE,
+        }
+        source = "(define (p a b) a)"
+        for call in ["(p 1)", "(p 1 2 3)"]:
+            with self.assertRaises(exceptions.EvalError):
+                interop.eval_str(source + call, bindings)
+
+    def test_evaluator_session(self):
+        symbol_table = types.symbol_table()
+        env = types.Environment(bindings={
+            symbol_table["define"]: Builtins.DEFINE,
+            symbol_table["+"]: base.plus,
+        })
+        evaluator = eval.Evaluator()
+        for source, value in [("(define a 1)", False), ("(+ a 2)", 3)]:
+            expr = interop.read_str(source, symbol_table=symbol_table)
+            self.assertEqual(evaluator.eval(expr, env=env), value)
+        self.assertEqual(evaluator.stack, [])
+        self.assertFalse(evaluator.running)
+
+    def test_rest_args_internal_define(self):
+        bindings = {
+            "define": Builtins.DEFINE,
+            "quote": Builtins.QUOTE,
+            "list": base.list_,
+        }
+        source = """
+            (define (p a :rest b) (define c (list b a)) c)
+            (list (p 1) (p 1 2 3))
+        """
+        result = interop.eval_str(source, bindings)
+        self.assertEqual(interop.write_str(result), "((() 1) ((2 3) 1))")
+
+    def test_call_pending_operands(self):
+        bindings = {
+            "define": Builtins.DEFINE,
+            "quote": Builtins.QUOTE,
+            "list": base.list_,
+        }
+        source = """
+            (define (p a :rest b) (list a b))
+            (list 1 2 (list 3 (p 4 5 6)) 7)
+        """
+        result = interop.eval_str(source, bindings)
+        self.assertEqual(interop.write_str(result), "(1 2 (3 (4 (5 6))) 7)")
+
+    def test_leaf_stack_frame(self):
+        bindings = {
+            "define": Builtins.DEFINE,
+            "if": Builtins.IF,
+            "lambda": Builtins.LAMBDA,
+            "+": base.plus,
+            "-": base.minus,
+            "=": base.arithmetic_eq,
+            "list": base.list_,
+            "apply": eval.scheme_apply,
+        }
+        source = """
+            (define (leaf a b :rest c) (define d (+ a b)) (list d c))
+            (define (to-builtin x) (apply + (list x 1)))
+            (define (to-leaf x) (leaf x 1))
+            (define (make x) (lambda () (to-leaf x)))
+            (define (count n acc)
+              (if (= n 0) acc
+                  (count (- n 1) (+ acc (to-builtin 0)))))
+            (list (leaf 1 2 3 4) (to-builtin 1) ((make 2)) (count 1000 0))
+        """
+        result = interop.eval_str(source, bindings)
+        self.assertEqual(interop.write_str(result),
+                         "((3 (3 4)) 2 (3 ()) 1000)")
+
+    def test_call_cache_stats(self):
+        symbol_table = types.symbol_table()
+        env = interop.str_bindings_to_env({
+            "define": Builtins.DEFINE,
+            "if": Builtins.IF,
+            "-": base.minus,
+            "=": base.arithmetic_eq,
+            "list": base.list_,
+            "car": base.car,
+        }, symbol_table=symbol_table)
+        stats = {}
+        evaluator = eval.Evaluator(hooks={"eval": {"call_stats": stats}})
+        reader_ = reader.Reader(io.StringIO("""
+            (define (call f x) (f x))
+            (define (loop n)
+              (if (= n 0) (call car (list n)) (loop (car (list (- n 1))))))
+            (loop 10)
+            (call list 1)
+        """), symbol_table=symbol_table,
+              keyword_table=types.keyword_table())
+        result = None
+        while True:
+            expr = reader_.read(None)
+            if base.eofp(expr):
+                break
+            result = evaluator.eval(expr, env=env)
+        self.assertEqual(interop.write_str(result), "(1)")
+        self.assertGreaterEqual(stats["hits"], 9)
+        self.assertGreaterEqual(stats["misses"], 3)
+        before = stats["misses"]
+        evaluator.eval(interop.read_str("(call list 2)",
+                                        symbol_table=symbol_table), env=env)
+        self.assertEqual(stats["misses"], before)
+
+    def test_call_cache_keeps_no_closure(self):
+        symbol_table = types.symbol_table()
+        env = interop.str_bindings_to_env({
+            "define": Builtins.DEFINE,
+            "lambda": Builtins.LAMBDA,
+        }, symbol_table=symbol_table)
+        evaluator = eval.Evaluator()
+        for source in ["(define (make x) (lambda () x))",
+                       "(define (call f) (f))",
+                       "(call (make 1))"]:
+            result = evaluator.eval(
+                interop.read_str(source, symbol_table=symbol_table), env=env)
+        self.assertEqual(result, 1)
+        call = env[symbol_table["call"]]
+        _, args = call.bytecode.decoded()
+        caches = [arg[-1] for arg in args
+                  if isinstance(arg, tuple) and isinstance(arg[-1], CallCache)]
+        self.assertEqual(len(caches), 1)
+        self.assertIsInstance(caches[0].target, Bytecode)
@@ -4,6 +4,7 @@ import unittest
 
 from pyme import Interpreter
 from pyme import exceptions
+from pyme import interop
 from pyme import ports
 
 
@@ -45,6 +46,290 @@ class TestInterpreter(unittest.TestCase):
         self.interpreter.eval_str('(display "abc")')
         self.assertEqual(stream.getvalue(), 'abc')
 
+    def test_session_after_error(self):
+        with self.assertRaises(exceptions.SchemeError):
+            self.interpreter.eval_str('(define (f) (error "qwerty")) (+ 1 (f))')
+        result = self.interpreter.eval_str("(+ 1 2)")
+        self.assertEqual(result, 3)
+
+    def test_nested_load(self):
+        result = self.interpreter.eval_str(
+            '(load "tests/define_a_1.scm") (+ a 1)')
+        self.assertEqual(result, 2)
+
+    def test_let(self):
+        result = self.interpreter.eval_str("""
+            (define x 1)
+            (let ((x 2) (y x)) (list x y))
+        """)
+        self.assertEqual(interop.write_str(result), "(2 1)")
+
+    def test_let_invalid(self):
+        for source in ["(let (x) x)", "(let ((1 2)) 1)", "(let loop)"]:
+            with self.assertRaises(exceptions.CompileError):
+                self.interpreter.eval_str(source)
+
+    def test_named_let(self):
+        def call_hook(evaluator):
+            nonlocal max_depth
+            max_depth = max(max_depth, len(evaluator.call_stack))
+        max_depth = 0
+        self.interpreter.hooks["eval"]["call"] = call_hook
+        result = self.interpreter.eval_str("""
+            (let loop ((i 1000) (acc '()))
+              (if (= i 0) acc (loop (- i 1) (cons i acc))))
+        """)
+        self.assertEqual(interop.from_scheme_list(result),
+                         list(range(1, 1001)))
+        self.assertLess(max_depth, 10)
+
+    def test_let_star(self):
+        result = self.interpreter.eval_str("""
+            (let* ((x 1) (y (+ x 1))) (list x y))
+        """)
+        self.assertEqual(interop.write_str(result), "(1 2)")
+
+    def test_letrec(self):
+        result = self.interpreter.eval_str("""
+            (letrec ((even? (lambda (n) (if (= n 0) #t (odd? (- n 1)))))
+                     (odd? (lambda (n) (if (= n 0) #f (even? (- n 1))))))
+              (list (even? 100) (odd? 7)))
+        """)
+        self.assertEqual(interop.write_str(result), "(#t #t)")
+
+    def test_internal_define(self):
+        result = self.interpreter.eval_str("""
+            (define y 0)
+            (define (f x)
+              (define a (+ x 1))
+              (define b (* a 2))
+              (list a b))
+            (list (f 1) (let () (define y 5) y) y)
+        """)
+        self.assertEqual(interop.write_str(result), "((2 4) 5 0)")
+
+    def test_internal_define_invalid(self):
+        self.interpreter.eval_str("(define x 0)")
+        for source in [
+                "(define (f x) (let ((y 0)) y (define x 2) x) x)",
+                "(define (f) (define x 1) (let () (display 0) (define x 2) x))",
+                "(let () (display 1) (define x 2) x)",
+                "(let () (define x 1) (define x 2) x)",
+                "(define (f) (define x 1) (define x 2) x)"]:
+            with self.assertRaises(exceptions.CompileError):
+                self.interpreter.eval_str(source)
+        result = self.interpreter.eval_str("x")
+        self.assertEqual(result, 0)
+
+    def test_empty_let(self):
+        result = self.interpreter.eval_str("""
+            (list (let () 5) (letrec () 6) (let* () 7))
+        """)
+        self.assertEqual(interop.write_str(result), "(5 6 7)")
+
+    def test_internal_define_before_init(self):
+        self.interpreter.eval_str("""
+            (define (f) (define a b) (define b 1) a)
+        """)
+        with self.assertRaises(exceptions.IdentifierNotBoundError):
+            self.interpreter.eval_str("(f)")
+
+    def test_internal_define_shadow_before_init(self):
+        self.interpreter.eval_str("""
+            (define x 5)
+            (define (f) (define x (+ x 1)) x)
+        """)
+        with self.assertRaises(exceptions.IdentifierNotBoundError):
+            self.interpreter.eval_str("(f)")
+
+    def test_mutual_internal_defines(self):
+        result = self.interpreter.eval_str("""
+            (define (f n)
+              (define (even? n) (if (= n 0) #t (odd? (- n 1))))
+              (define (odd? n) (if (= n 0) #f (even? (- n 1))))
+              (even? n))
+            (list (f 10) (f 7))
+        """)
+        self.assertEqual(interop.write_str(result), "(#t #f)")
+
+    def test_cond(self):
+        self.interpreter.eval_str("""
+            (define (classify x)
+              (cond ((< x 0) 'negative)
+                    ((= x 0))
+                    ((= x 1) => (lambda (t) (list t 'one)))
+                    (else 'many)))
+        """)
+        for arg, expected in [("-1", "negative"), ("0", "#t"),
+                              ("1", "(#t one)"), ("5", "many")]:
+            result = self.interpreter.eval_str(f"(classify {arg})")
+            self.assertEqual(interop.write_str(result), expected)
+
+    def test_case(self):
+        self.interpreter.eval_str("""
+            (define (kind x)
+              (case x
+                ((1 2 3) 'small)
+                ((a b) 'symbol)
+                ((#t) 'true)
+                (else 'other)))
+        """)
+        for arg, expected in [("2", "small"), ("'b", "symbol"),
+                              ("#t", "true"), ("'c", "other"),
+                              ("'(1)", "other")]:
+            result = self.interpreter.eval_str(f"(kind {arg})")
+            self.assertEqual(interop.write_str(result), expected)
+        self.assertEqual(self.interpreter.eval_str("(case 1 ((2) 2))"),
+                         False)
+
+    def test_and_or(self):
+        result = self.interpreter.eval_str("""
+            (list (and) (and 1 2) (and 1 #f 2) (or) (or #f 2) (or #f #f))
+        """)
+        self.assertEqual(interop.write_str(result), "(#t 2 #f #f 2 #f)")
+
+    def test_when_unless(self):
+        result = self.interpreter.eval_str("""
+            (list (when (< 1 2) 1 2) (when #f 1) (unless #f 3) (unless 1 3))
+        """)
+        self.assertEqual(interop.write_str(result), "(2 #f 3 #f)")
+
+    def test_do(self):
+        result = self.interpreter.eval_str("""
+            (do ((i 0 (+ i 1))
+                 (acc '() (cons i acc))
+                 (n 3))
+                ((= i n) acc))
+        """)
+        self.assertEqual(interop.write_str(result), "(2 1 0)")
+
+    def test_define_syntax(self):
+        result = self.interpreter.eval_str("""
+            (define-syntax swap!
+              (syntax-rules ()
+                ((_ a b) (let ((tmp a)) (set! a b) (set! b tmp)))))
+            (define-syntax my-or
+              (syntax-rules ()
+                ((_) #f)
+                ((_ e) e)
+                ((_ e r ...) (let ((t e)) (if t t (my-or r ...))))))
+            (define x 1)
+            (define y 2)
+            (swap! x y)
+            (list x y (my-or) (my-or #f 3))
+        """)
+        self.assertEqual(interop.write_str(result), "(2 1 #f 3)")
+
+    def test_syntax_rules_literals_and_nested_ellipsis(self):
+        result = self.interpreter.eval_str("""
+            (define-syntax for
+              (syntax-rules (in)
+                ((_ x in lst body ...)
+                 (let loop ((l lst))
+                   (when (pair? l)
+                     (let ((x (car l))) body ... (loop (cdr l))))))))
+            (define-syntax flatten
+              (syntax-rules ()
+                ((_ (a b ...) ...) '(a ... b ... ...))))
+            (define acc '())
+            (for e in '(1 2 3) (set! acc (cons e acc)))
+            (list acc (flatten (1 2 3) (4 5)))
+        """)
+        self.assertEqual(interop.write_str(result), "((3 2 1) (1 4 2 3 5))")
+
+    def test_syntax_rules_no_match(self):
+        with self.assertRaises(exceptions.CompileError):
+            self.interpreter.eval_str("""
+                (define-syntax one (syntax-rules () ((_ x) x)))
+                (one 1 2)
+            """)
+
+    def test_closure_counter(self):
+        result = self.interpreter.eval_str("""
+            (define (make-counter)
+              (let ((n 0))
+                (lambda () (set! n (+ n 1)) n)))
+            (define a (make-counter))
+            (define b (make-counter))
+            (a) (a) (b)
+            (list (a) (b))
+        """)
+        self.assertEqual(interop.write_str(result), "(3 2)")
+
+    def test_closure_shared_box(self):
+        result = self.interpreter.eval_str("""
+            (define (make-cell x)
+              (list (lambda () x) (lambda (v) (set! x v))))
+            (define cell (make-cell 1))
+            ((car (cdr cell)) 2)
+            ((car cell))
+        """)
+        self.assertEqual(result, 2)
+
+    def test_closure_mutual_recursion(self):
+        result = self.interpreter.eval_str("""
+            (define (f n)
+              (define (even? n) (if (= n 0) #t (odd? (- n 1))))
+              (define (odd? n) (if (= n 0) #f (even? (- n 1))))
+              (list (even? n) (odd? n)))
+            (f 11)
+        """)
+        self.assertEqual(interop.write_str(result), "(#f #t)")
+
+    def test_closure_nested_capture(self):
+        result = self.interpreter.eval_str("""
+            (define (adder x)
+              (lambda (y)
+                (lambda (z) (+ x y z))))
+            (((adder 1) 10) 100)
+        """)
+        self.assertEqual(result, 111)
+
+    def test_closure_captures_loop_values(self):
+        result = self.interpreter.eval_str("""
+            (define (thunks n)
+              (let loop ((i 0) (acc '()))
+                (if (= i n) acc (loop (+ i 1) (cons (lambda () i) acc)))))
+            (let loop ((ts (thunks 3)) (acc '()))
+              (if (null? ts) acc (loop (cdr ts) (cons ((car ts)) acc))))
+        """)
+        self.assertEqual(interop.write_str(result), "(0 1 2)")
+
+    def test_closure_copies_only_free_variables(self):
+        result = self.interpreter.eval_str("""
+            (define (f big y) (lambda () y))
+            (f (make-bytevector 1000 0) 2)
+        """)
+        self.assertEqual(result.frame.values, [2])
+        result = self.interpreter.eval_str("""
+            (define (g big) (lambda () 1))
+            (g (make-bytevector 1000 0))
+        """)
+        self.assertIsNone(result.frame)
+
+    def test_self_tail_call_redefined(self):
+        result = self.interpreter.eval_str("""
+            (define (count n) (if (= n 0) 'done (count (- n 1))))
+            (define old-count count)
+            (define (count n) n)
+            (old-count 5)
+        """)
+        self.assertEqual(result, 4)
+
+    def test_direct_call_redefined(self):
+        result = self.interpreter.eval_str("""
+            (define (f x) (list 'old x))
+            (define (g x) (f x))
+            (define r1 (g 1))
+            (eval '(define (f x) (list 'new x)) (global-environment))
+            (define r2 (g 2))
+            (eval '(define f (lambda (:rest x) (list 'rest x)))
+                  (global-environment))
+            (list r1 r2 (g 3))
+        """)
+        self.assertEqual(interop.write_str(result),
+                         "((old 1) (new 2) (rest (3)))")
+
     def test_call_hook(self):
         def call_hook(evaluator):
             nonlocal max_depth
@@ -106,3 +391,60 @@ class TestInterpreter(unittest.TestCase):
     def test_empty_lambda(self):
         result = self.interpreter.eval_str("((lambda () ))")
         self.assertEqual(result, False)
+
+    def test_global_cache_shadow(self):
+        result = self.interpreter.eval_str("""
+            (define x 1)
+            (define (get-x) x)
+            (get-x)
+            (define env (global-environment))
+            (define child (empty-environment))
+            (set-environment-parent! child env)
+            (define f (eval '(lambda () x) child))
+            (f)
+            (set-environment-binding! child 'x 2)
+            (f)""")
+        self.assertEqual(result, 2)
+
+    def test_global_cache_redefine(self):
+        result = self.interpreter.eval_str("""
+            (define x 1)
+            (define (get-x) x)
+            (get-x)
+            (define x 2)
+            (get-x)""")
+        self.assertEqual(result, 2)
+
+    def test_global_cache_delete(self):
+        self.interpreter.eval_str("""
+            (define x 1)
+            (define (get-x) x)
+            (get-x)
+            (delete-environment-binding! (global-environment) 'x)""")
+        with self.assertRaises(exceptions.IdentifierNotBoundError):
+            self.interpreter.eval_str("(get-x)")
+
+    def test_primitives(self):
+        result = self.interpreter.eval_str("""
+            (define (f x y l)
+              (list (+ x y) (- x y) (< x y) (= x y)
+                    (car (cons x l)) (cdr (cons x l))
+                    (null? l) (pair? (cons x l)) (eq? x x)))
+            (f 5 3 '())""")
+        self.assertEqual(interop.write_str(result),
+                         "(8 2 #f #f 5 () #t #t #t)")
+
+    def test_primitive_non_numbers(self):
+        self.interpreter.eval_str("(define (f x y) (list (+ x y) (- x y)))")
+        with self.assertRaises(TypeError):
+            self.interpreter.eval_str('(+ "a" "b")')
+        with self.assertRaises(TypeError):
+            self.interpreter.eval_str('(f "a" "b")')
+
+    def test_primitive_rebound(self):
+        result = self.interpreter.eval_str("""
+            (define (f x) (car x))
+            (define before (f '(1 2)))
+            (define (car x) (list 'rebound x))
+            (list before (f 3))""")
+        self.assertEqual(interop.write_str(result), "(1 (rebound 3))")
@@ -0,0 +1,38 @@
+import unittest
+
+from pyme import interop
+from pyme import types
+from pyme.drive import Builtins, RunDriver
+from pyme.macro import SyntaxRules
+
+
+class TestSyntaxRules(unittest.TestCase):
+
+    def setUp(self):
+        self.symbol_table = types.symbol_table()
+        self.env = types.Environment(bindings={
+            self.symbol_table["define-syntax"]: Builtins.DEFINE_SYNTAX,
+        })
+        self.driver = RunDriver(env=self.env)
+
+    def read(self, source):
+        return interop.read_str(source, symbol_table=self.symbol_table)
+
+    def test_define_binds_at_compile_time(self):
+        self.driver.compile_expr(self.read(
+            "(define-syntax id (syntax-rules () ((_ x) x)))"))
+        macro = self.env.get(self.symbol_table["id"])
+        self.assertIsInstance(macro, SyntaxRules)
+
+    def test_expansion_cache(self):
+        self.driver.compile_expr(self.read(
+            "(define-syntax pair (syntax-rules () ((_ a b) (list a b))))"))
+        macro = self.env.get(self.symbol_table["pair"])
+        form = self.read("(pair 1 2)")
+        expansion = macro.expand(form)
+        self.assertEqual(interop.write_str(expansion), "(list 1 2)")
+        self.assertIs(macro.expand(form), expansion)
+        other = self.read("(pair 1 2)")
+        self.assertIsNot(macro.expand(other), expansion)
+        del form, other
+        self.assertEqual(len(macro.expansions), 0)
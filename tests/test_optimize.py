@@ -0,0 +1,93 @@
+import unittest
+
+from pyme import core
+from pyme import exceptions
+from pyme import interop
+from pyme import types
+from pyme.drive import RunDriver
+from pyme.interpreter import Interpreter
+from pyme.optimize import optimize
+
+
+class TestOptimize(unittest.TestCase):
+
+    def setUp(self):
+        self.interpreter = Interpreter()
+        self.env = self.interpreter.global_env
+
+    def optimize(self, source, level=2):
+        expr = interop.read_str(
+            source, symbol_table=self.interpreter.symbol_table)
+        element = RunDriver(env=self.env).compile_expr(expr)
+        return optimize(element, env=self.env, level=level)
+
+    def test_level_0(self):
+        result = self.optimize("(+ 1 2)", level=0)
+        self.assertIsInstance(result, core.Apply)
+
+    def test_constant_folding(self):
+        result = self.optimize("(* (+ 1 2) (- 5 1))")
+        self.assertIsInstance(result, core.Constant)
+        self.assertEqual(result.value, 12)
+
+    def test_folding_error_left_to_runtime(self):
+        result = self.optimize("(car 1)")
+        self.assertIsInstance(result, core.Apply)
+
+    def test_folding_shadowed(self):
+        result = self.optimize("(lambda (+) (+ 1 2))")
+        self.assertIsInstance(result.body.exprs[0], core.Apply)
+        result = self.optimize("(define (+ a b) a)")
+        self.assertIsInstance(result, core.DefineVariable)
+        result = self.optimize("(lambda () (define (f) (+ 1 2)) (set! + -))")
+        value = result.body.values[0]
+        self.assertIsInstance(value.body.exprs[0], core.Apply)
+
+    def test_dead_branches(self):
+        result = self.optimize("(if (< 1 2) 'yes (error 'no))")
+        self.assertIsInstance(result, core.Constant)
+        self.assertEqual(result.value.name, "yes")
+        result = self.optimize("(if (not #t) 1 x)")
+        self.assertIsInstance(result, core.GetVariable)
+
+    def test_inline_lambda(self):
+        result = self.optimize("((lambda (a b) (+ a b)) x 2)")
+        self.assertIsInstance(result, core.Let)
+        self.assertEqual([variable.name for variable in result.variables],
+                         ["a", "b"])
+        result = self.optimize("((lambda (a) a) x 2)")
+        self.assertIsInstance(result, core.Apply)
+        result = self.optimize("((lambda (a b) a) x 2)", level=1)
+        self.assertIsInstance(result, core.Apply)
+
+    def test_inline_lambda_with_define(self):
+        result = self.optimize("((lambda () (if #t (define x 2) #f) x))")
+        self.assertIsInstance(result, core.Apply)
+        for level in [0, 2]:
+            interpreter = Interpreter(optimize=level)
+            result = interpreter.eval_str(
+                "((lambda () (if #t (define x 2) #f) x))")
+            self.assertEqual(result, 2)
+            with self.assertRaises(exceptions.IdentifierNotBoundError):
+                interpreter.eval_str("x")
+
+    def test_dead_expressions(self):
+        result = self.optimize("(lambda (a) 1 a (lambda () 2) x (f) a)")
+        exprs = result.body.exprs
+        self.assertEqual(len(exprs), 3)
+        self.assertEqual(exprs[0].variable.name, "x")
+        self.assertIsInstance(exprs[1], core.Apply)
+        self.assertEqual(exprs[2].variable.name, "a")
+
+    def test_interpreter(self):
+        for level in [0, 1, 2]:
+            for backend in ["bytecode", "closure"]:
+                interpreter = Interpreter(backend=backend, optimize=level)
+                result = interpreter.eval_str("""
+                    (define (f x)
+                      ((lambda (a b)
+                         (if (< 1 2) (+ a b (* 2 3)) (error 'unreachable)))
+                       x 1))
+                    (f 10)
+                """)
+                self.assertEqual(result, 17)
@@ -106,6 +106,26 @@ class TestReadPorts(unittest.TestCase):
         self.assertTrue(base.eofp(result2))
         self.assertTrue(base.eofp(result3))
 
+    def test_chars_interned(self):
+        port = ports.TextStreamPort.from_stream(io.StringIO("aa\u0416"))
+        first = port.peek_char()
+        self.assertIs(port.read_char(), first)
+        self.assertIs(port.read_char(), first)
+        self.assertEqual(port.read_char().char, "\u0416")
+        self.assertTrue(base.eofp(port.read_char()))
+
+    def test_read_chunks(self):
+        stream = io.StringIO("abcdefg\nhij")
+        port = ports.TextStreamPort.from_stream(stream)
+        port.chunk_size = 3
+        chars = [port.read_char().char for _ in range(4)]
+        self.assertEqual(chars, ["a", "b", "c", "d"])
+        self.assertEqual(stream.tell(), 6)
+        self.assertEqual(port.read(4), "efg\n")
+        self.assertEqual(port.peek_char().char, "h")
+        self.assertEqual(port.readline(), "hij")
+        self.assertTrue(base.eofp(port.peek_char()))
+
 
 class TestWritePorts(unittest.TestCase):
 
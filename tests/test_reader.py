@@ -48,6 +48,19 @@ class TestReader(unittest.TestCase):
         result = self.reader(stream).read(stream)
         self.assertEqual(result, "abc")
 
+    def test_string_escapes(self):
+        stream = io.StringIO(r'"a\nb\t\\\"\x41;\x3bb; \
+   c"')
+        result = self.reader(stream).read(stream)
+        self.assertEqual(result, 'a\nb\t\\"A\u03bb c')
+
+    def test_string_escaped_quote_chunks(self):
+        stream = io.StringIO('"\\"\n\\\\" x')
+        stream_reader = self.reader(stream)
+        stream_reader.chunk_size = 2
+        self.assertEqual(stream_reader.read(stream), '"\n\\')
+        self.assertEqual(stream_reader.read(stream).name, "x")
+
     def test_symbol(self):
         stream = io.StringIO("abc")
         result = self.reader(stream).read(stream)
@@ -177,6 +190,15 @@ class TestReader(unittest.TestCase):
         result2 = stream_reader.read(stream)
         self.assertIs(result1, result2)
 
+    def test_atom_cache_bounded(self):
+        stream = io.StringIO("a b c 1 2 a")
+        stream_reader = self.reader(stream)
+        stream_reader.atom_cache_size = 2
+        result = [stream_reader.read(stream) for _ in range(6)]
+        self.assertIs(result[0], result[5])
+        self.assertEqual(result[3:5], [1, 2])
+        self.assertLessEqual(len(stream_reader._atoms), 2)
+
     def test_quote_eq(self):
         stream = io.StringIO("quote 'abc")
         stream_reader = self.reader(stream)
@@ -184,6 +206,44 @@ class TestReader(unittest.TestCase):
         result2 = stream_reader.read(stream)
         self.assertIs(result1, result2.car)
 
+    def test_deep_nesting(self):
+        depth = 100000
+        stream = io.StringIO("(" * depth + "a" + ")" * depth)
+        result = self.reader(stream).read(stream)
+        for _ in range(depth):
+            self.assertIs(result.cdr, types.EmptyList.instance)
+            result = result.car
+        self.assertEqual(result.name, "a")
+
+    def test_deep_quotes(self):
+        depth = 100000
+        stream = io.StringIO("'" * depth + "a")
+        result = self.reader(stream).read(stream)
+        for _ in range(depth):
+            self.assertEqual(result.car.name, "quote")
+            result = result.cdr.car
+        self.assertEqual(result.name, "a")
+
+    def test_long_list(self):
+        length = 1000000
+        stream = io.StringIO("(" + "1 " * length + "2)")
+        result = self.reader(stream).read(stream)
+        ones = 0
+        while result.car == 1:
+            ones += 1
+            result = result.cdr
+        self.assertEqual(ones, length)
+        self.assertEqual(interop.from_scheme_list(result), [2])
+
+    def test_chunks(self):
+        stream = io.StringIO('(abc "d\ne" 0x1f) ; f\n(g\n"h")')
+        stream_reader = self.reader(stream)
+        stream_reader.chunk_size = 3
+        write.write_to(stream_reader.read(stream), self.port)
+        write.write_to(stream_reader.read(stream), self.port)
+        self.assertEqual(self.stream.getvalue(), '(abc "d\ne" 31)(g "h")')
+        self.assertTrue(base.eofp(stream_reader.read(stream)))
+
 
 class TestReaderError(unittest.TestCase):
 
@@ -198,6 +258,24 @@ class TestReaderError(unittest.TestCase):
         with self.assertRaises(exceptions.ReaderError):
             self.reader(stream).read(stream)
 
+    def test_broken_quote(self):
+        stream = io.StringIO("(a ')")
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    'Unexpected "\\)".'):
+            self.reader(stream).read(stream)
+
+    def test_broken_string_escape(self):
+        stream = io.StringIO('"q\\"')
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    "Unexpected end of file."):
+            self.reader(stream).read(stream)
+
+    def test_invalid_string_escape(self):
+        stream = io.StringIO('"\\q"')
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    "Invalid string escape: \\\\q."):
+            self.reader(stream).read(stream)
+
     def test_broken_string(self):
         stream = io.StringIO('"q')
         with self.assertRaises(exceptions.ReaderError):
@@ -207,3 +285,23 @@ class TestReaderError(unittest.TestCase):
         stream = io.StringIO(")")
         with self.assertRaises(exceptions.ReaderError):
             self.reader(stream).read(stream)
+
+    def test_unexpected_char(self):
+        stream = io.StringIO("[ a")
+        stream_reader = self.reader(stream)
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    "Unexpected char: \\[."):
+            stream_reader.read(stream)
+        self.assertEqual(stream_reader.read(stream).name, "a")
+
+    def test_invalid_hash(self):
+        stream = io.StringIO("#ta12 #f#t")
+        stream_reader = self.reader(stream)
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    "Invalid hash syntax: #ta"):
+            stream_reader.read(stream)
+        self.assertEqual(stream_reader.read(stream).name, "a12")
+        with self.assertRaisesRegex(exceptions.ReaderError,
+                                    "Invalid hash syntax: #f#"):
+            stream_reader.read(stream)
+        self.assertIs(stream_reader.read(stream), True)
@@ -19,6 +19,22 @@ class TestTypes(unittest.TestCase):
         pair.car = "hello"
         self.assertEqual(pair.car, "hello")
 
+    def test_pair_slots(self):
+        pair = base.cons(1, base.null())
+        with self.assertRaises(AttributeError):
+            pair.other = 2
+        with self.assertRaises(ValueError):
+            base.cons(1, 2)
+        pair = types.Pair.unchecked(1, 2)
+        self.assertEqual((pair.car, pair.cdr), (1, 2))
+
+    def test_pair_list(self):
+        tail = base.cons(3, base.null())
+        result = types.pair_list([1, 2], tail)
+        self.assertEqual(interop.from_scheme_list(result), [1, 2, 3])
+        self.assertIs(result.cdr.cdr, tail)
+        self.assertIs(types.pair_list(()), base.null())
+
     def test_symbol_unique(self):
         store = types.symbol_table()
         a = store['qwe']
@@ -60,3 +76,30 @@ class TestTypes(unittest.TestCase):
         a = types.Symbol("a")
         with self.assertRaises(exceptions.IdentifierNotBoundError):
             env.set_(a, 5)
+
+    def test_env_version(self):
+        parent = types.Environment()
+        env = types.Environment(parent=parent)
+        a = types.Symbol("a")
+        version = types.Environment.version
+        parent.define(a, 3)
+        self.assertNotEqual(types.Environment.version, version)
+        version = types.Environment.version
+        cell = env.lookup(a)
+        parent.define(a, 4)
+        env.set_(a, 5)
+        self.assertEqual(types.Environment.version, version)
+        self.assertIs(env.lookup(a), cell)
+        self.assertEqual(cell.value, 5)
+        env.define(a, 6)
+        self.assertNotEqual(types.Environment.version, version)
+        self.assertEqual(env.lookup(a).value, 6)
+
+    def test_env_copy(self):
+        env = types.Environment()
+        a = types.Symbol("a")
+        env.define(a, 1)
+        env_copy = env.copy()
+        env_copy.define(a, 2)
+        self.assertEqual(env[a], 1)
+        self.assertEqual(env_copy[a], 2)